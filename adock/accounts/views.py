@@ -18,6 +18,7 @@ from ..carriers import models as carriers_models
 from ..carriers import tokens as carriers_tokens
 from ..carriers import views as carriers_views
 from ..core import views as core_views
+from ..outbox import backends as outbox_backends
 
 from . import mails as accounts_mails
 from . import models as accounts_models
@@ -32,6 +33,7 @@ ACCOUNT_CREATED_MESSAGE = (
 
 
 @require_POST
+@outbox_backends.atomic_with_outbox
 def account_create(request):
     """Create an A Dock user account (email as username)"""
     serializer, response = core_views.request_validate(
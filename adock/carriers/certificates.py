@@ -0,0 +1,224 @@
+import datetime
+import functools
+import hashlib
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, Max, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.formats import date_format
+
+from ..core import pdf as core_pdf
+from . import models as carriers_models
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "jinja2")
+
+
+def get_template_name(certificate):
+    return (
+        "certificate_workers.html"
+        if certificate.kind == carriers_models.CERTIFICATE_WORKERS
+        else "certificate_no_workers.html"
+    )
+
+
+@functools.lru_cache()
+def get_template_version(template_name):
+    """The rendered PDF are invalidated on changes of the template"""
+    with open(os.path.join(TEMPLATES_DIR, template_name), "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+
+def get_qr_code_data(carrier):
+    return settings.HTTP_CLIENT_URL + "transporteur/" + carrier.siret
+
+
+def render_html(certificate, request=None):
+    carrier = certificate.carrier
+    return render_to_string(
+        get_template_name(certificate),
+        {
+            "carrier": carrier,
+            "certificate": certificate,
+            "formated_date": date_format(certificate.created_at),
+            "HOSTNAME": settings.HOSTNAME,
+            "HTTP_CLIENT_URL": settings.HTTP_CLIENT_URL,
+            "qr_code": core_pdf.get_qr_code(get_qr_code_data(carrier)),
+        },
+        request=request,
+    )
+
+
+def get_pdf_filename(certificate):
+    return "adock-%s-attestation-%s.pdf" % (certificate.carrier_id, certificate.pk)
+
+
+def get_etag(certificate):
+    """The stored PDF of a confirmed certificate never change"""
+    return '"%s-%s"' % (
+        certificate.pk,
+        get_template_version(get_template_name(certificate)),
+    )
+
+
+def get_cached_pdf(certificate):
+    pdf = carriers_models.CarrierCertificatePDF.objects.filter(
+        certificate=certificate,
+        template_version=get_template_version(get_template_name(certificate)),
+    ).first()
+    return bytes(pdf.content) if pdf else None
+
+
+def get_pdf(certificate, store=True):
+    """Returns the content of the PDF of the certificate, rendered only once
+    by version of the template (the rendered PDF isn't stored with
+    store=False)."""
+    content = get_cached_pdf(certificate)
+    if content is not None:
+        return content
+
+    template_version = get_template_version(get_template_name(certificate))
+    content = core_pdf.render_pdf(render_html(certificate))
+    if not content or not store:
+        # Never keep an empty document
+        return content
+
+    try:
+        with transaction.atomic():
+            # Previous versions of the template
+            carriers_models.CarrierCertificatePDF.objects.filter(
+                certificate=certificate
+            ).delete()
+            carriers_models.CarrierCertificatePDF.objects.create(
+                certificate=certificate,
+                template_version=template_version,
+                content=content,
+            )
+    except IntegrityError:
+        # Stored by a concurrent request
+        pass
+
+    return content
+
+
+def enqueue(certificate):
+    """Returns the job of the certificate in the queue or a new one.
+
+    Raises QueueFull when CARRIERS_CERTIFICATE_PDF_QUEUE_SIZE jobs are
+    already waiting.
+    """
+    queued_jobs = carriers_models.CarrierCertificatePDFJob.objects.filter(
+        finished_at__isnull=True
+    )
+    job = queued_jobs.filter(certificate=certificate).first()
+    if job:
+        return job
+
+    if queued_jobs.count() >= settings.CARRIERS_CERTIFICATE_PDF_QUEUE_SIZE:
+        raise QueueFull()
+
+    try:
+        with transaction.atomic():
+            return carriers_models.CarrierCertificatePDFJob.objects.create(
+                certificate=certificate
+            )
+    except IntegrityError:
+        # Enqueued by a concurrent request
+        return queued_jobs.get(certificate=certificate)
+
+
+def prerender(certificate):
+    """The PDF is rendered by the worker so it's ready for the first
+    download."""
+    try:
+        enqueue(certificate)
+    except QueueFull:
+        logger.warning("Queue full, certificate %s not prerendered", certificate.pk)
+
+
+def claim_job():
+    """Returns the next job to render and marks it as started.
+
+    The started jobs of a stopped worker are taken again after
+    CARRIERS_CERTIFICATE_PDF_JOB_TIMEOUT.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            carriers_models.CarrierCertificatePDFJob.objects.select_for_update(
+                skip_locked=True
+            )
+            .select_related("certificate__carrier")
+            .filter(finished_at__isnull=True)
+            .filter(
+                Q(started_at__isnull=True)
+                | Q(
+                    started_at__lt=now
+                    - datetime.timedelta(
+                        seconds=settings.CARRIERS_CERTIFICATE_PDF_JOB_TIMEOUT
+                    )
+                )
+            )
+            .order_by("created_at", "pk")
+            .first()
+        )
+        if job:
+            job.started_at = now
+            job.save(update_fields=["started_at"])
+    return job
+
+
+def run_job(job):
+    start = time.perf_counter()
+    try:
+        get_pdf(job.certificate)
+    except Exception as e:  # pylint: disable=W0703
+        logger.exception("Unable to render the certificate %s", job.certificate_id)
+        job.error = str(e) or e.__class__.__name__
+    job.render_duration = time.perf_counter() - start
+    job.finished_at = timezone.now()
+    job.save(update_fields=["error", "render_duration", "finished_at"])
+
+
+def purge_jobs():
+    """The finished jobs are only kept a day for the statistics"""
+    carriers_models.CarrierCertificatePDFJob.objects.filter(
+        finished_at__lt=timezone.now() - datetime.timedelta(days=1)
+    ).delete()
+
+
+def get_job_stats(since=None):
+    """Depth of the queue and render times of the jobs finished in the last
+    hour."""
+    if since is None:
+        since = timezone.now() - datetime.timedelta(hours=1)
+    jobs = carriers_models.CarrierCertificatePDFJob.objects
+    stats = jobs.aggregate(
+        pending=Count(
+            "pk", filter=Q(finished_at__isnull=True, started_at__isnull=True)
+        ),
+        running=Count(
+            "pk", filter=Q(finished_at__isnull=True, started_at__isnull=False)
+        ),
+    )
+    stats["max_size"] = settings.CARRIERS_CERTIFICATE_PDF_QUEUE_SIZE
+    stats.update(
+        jobs.filter(finished_at__gte=since).aggregate(
+            done=Count("pk", filter=Q(error="")),
+            failed=Count("pk", filter=~Q(error="")),
+            render_duration_avg=Avg("render_duration"),
+            render_duration_max=Max("render_duration"),
+        )
+    )
+    return stats
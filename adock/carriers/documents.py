@@ -0,0 +1,309 @@
+import hashlib
+import json
+
+import psycopg2.extras
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import BooleanField, Exists, OuterRef, Subquery, Value
+
+from . import models as carriers_models
+
+CARRIER_DETAIL_FIELDS = (
+    "siret",
+    # get_siren is added too
+    "raison_sociale",
+    "enseigne",
+    "gestionnaire",
+    "adresse",
+    "code_postal",
+    "ville",
+    "debut_activite",
+    "code_ape",
+    "libelle_ape",
+    "numero_tva",
+    "completeness",
+    "lti_numero",
+    "lti_date_debut",
+    "lti_date_fin",
+    "lti_nombre",
+    "lc_numero",
+    "lc_date_debut",
+    "lc_date_fin",
+    "lc_nombre",
+    "objectif_co2",
+    "objectif_co2_begin",
+    "objectif_co2_end",
+    "deleted_at",
+    "sirene_exists",
+    "sirene_closed_at",
+    "longitude",
+    "latitude",
+    # is_confirmed boolean is added to indicate if editable is present
+)
+
+# From CarrierEditable
+CARRIER_DETAIL_EDITABLE_FIELDS = (
+    # "telephone" is manually added
+    "email",
+    "working_area",
+    "working_area_departements",
+    "specialities",
+    "website",
+    "description",
+)
+
+# Number of carriers of each query on refresh of the documents
+CARRIER_DOCUMENT_BATCH_SIZE = 1000
+
+OTHER_FACILITIES_LIST_FIELDS = (
+    "code_postal",
+    "completeness",
+    "debut_activite",
+    "deleted_at",
+    "enseigne",
+    "is_siege",
+    "sirene_closed_at",
+    "siret",
+    "ville",
+)
+
+
+def format_telephone(phonenumber):
+    return (
+        phonenumber
+        if isinstance(phonenumber, str)
+        else "0" + phonenumber.format_as(settings.PHONENUMBER_DEFAULT_REGION)
+    )
+
+
+def get_carrier_detail_queryset(user=None):
+    """The ownership, the latest certificate and the latest license renewal are
+    annotated so the carrier detail is loaded in one query."""
+    # The primary key breaks the ties so the subqueries return the same row
+    certificates = carriers_models.CarrierCertificate.objects.filter(
+        carrier=OuterRef("pk"), confirmed_at__isnull=False
+    ).order_by("-created_at", "-pk")
+    license_renewals = carriers_models.CarrierLicenseRenewal.objects.filter(
+        carrier=OuterRef("pk"), confirmed_at__isnull=False
+    ).order_by("-created_at", "-pk")
+
+    if user is None or user.is_anonymous:
+        user_is_owner = Value(False, output_field=BooleanField())
+    else:
+        user_is_owner = Exists(
+            carriers_models.CarrierUser.objects.filter(
+                carrier=OuterRef("pk"), user=user
+            )
+        )
+
+    return carriers_models.Carrier.objects.select_related("editable").annotate(
+        user_is_owner=user_is_owner,
+        latest_certificate_id=Subquery(certificates.values("pk")[:1]),
+        latest_certificate_kind=Subquery(certificates.values("kind")[:1]),
+        latest_certificate_created_at=Subquery(certificates.values("created_at")[:1]),
+        latest_license_renewal_id=Subquery(license_renewals.values("pk")[:1]),
+        latest_license_renewal_confirmed_at=Subquery(
+            license_renewals.values("confirmed_at")[:1]
+        ),
+        latest_license_renewal_delivered_at=Subquery(
+            license_renewals.values("delivered_at")[:1]
+        ),
+    )
+
+
+def get_carrier_as_json(carrier):
+    """The carrier must be loaded with get_carrier_detail_queryset()"""
+    carrier_json = {}
+
+    for field in CARRIER_DETAIL_FIELDS:
+        carrier_json[field] = getattr(carrier, field)
+    carrier_json["siren"] = carrier.get_siren()
+
+    editable = carrier.editable
+    carrier_json["is_confirmed"] = bool(editable.confirmed_at)
+    carrier_json["telephone"] = format_telephone(editable.telephone)
+
+    for field in CARRIER_DETAIL_EDITABLE_FIELDS:
+        carrier_json[field] = getattr(editable, field)
+
+    # License renewal on going, we don't set the field if we don't have the
+    # information (paper process for example)
+    if (
+        carrier.latest_license_renewal_confirmed_at is not None
+        and carrier.latest_license_renewal_delivered_at is None
+    ):
+        carrier_json[
+            "license_renewal_on_going"
+        ] = carrier.latest_license_renewal_confirmed_at.date()
+
+    return carrier_json
+
+
+def get_latest_certificate_as_json(carrier):
+    """The carrier must be loaded with get_carrier_detail_queryset()"""
+    if carrier.latest_certificate_kind is None:
+        return None
+
+    return {
+        "kind_display": carriers_models.CERTIFICATE_DICT[
+            carrier.latest_certificate_kind
+        ],
+        "created_at": carrier.latest_certificate_created_at,
+    }
+
+
+def get_carrier_document(carrier, other_facilities):
+    """The public detail of the carrier (without the fields depending on the
+    user), other_facilities is the result of get_other_facilities()."""
+    document = get_carrier_as_json(carrier)
+    document["other_facilities"] = other_facilities
+    document["latest_certificate"] = get_latest_certificate_as_json(carrier)
+    return document
+
+
+def dump_carrier_document(document):
+    """Returns the document as JSON and its version"""
+    document_json = json.dumps(document, cls=DjangoJSONEncoder)
+    return document_json, hashlib.sha1(document_json.encode()).hexdigest()
+
+
+def get_other_facilities_limit():
+    """The documents list one more facility than the first page so the detail
+    knows if there is a next page (the total count isn't stored, it changes
+    on each new facility of the company)."""
+    return settings.CARRIERS_OTHER_FACILITIES_LIMIT + 1
+
+
+def get_other_facilities(carrier):
+    """The other facilities of the company listed in the document"""
+    return list(
+        carriers_models.Carrier.objects.filter(siren=carrier.get_siren())
+        .exclude(pk=carrier.pk)
+        .order_by("siret")
+        .values(*OTHER_FACILITIES_LIST_FIELDS)[: get_other_facilities_limit()]
+    )
+
+
+def get_first_facilities_by_siren(sirens):
+    """The first facilities of each SIREN in one query, enough to list the
+    other facilities of any carrier of the SIREN (see
+    get_other_facilities_from_siren)."""
+    columns = ", ".join('"%s"' % field for field in OTHER_FACILITIES_LIST_FIELDS)
+    facilities_by_siren = {}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT siren, {columns}
+              FROM (
+                    SELECT siren, {columns},
+                           row_number() OVER (PARTITION BY siren ORDER BY siret) AS rank
+                      FROM carrier
+                     WHERE siren = ANY(%s)
+                   ) f
+             WHERE rank <= %s
+             ORDER BY siren, siret
+            """.format(
+                columns=columns
+            ),
+            # The carrier itself can be one of them
+            [list(sirens), get_other_facilities_limit() + 1],
+        )
+        for row in cursor.fetchall():
+            facilities_by_siren.setdefault(row[0], []).append(
+                dict(zip(OTHER_FACILITIES_LIST_FIELDS, row[1:]))
+            )
+    return facilities_by_siren
+
+
+def get_other_facilities_from_siren(carrier, facilities):
+    return [f for f in facilities if f["siret"] != carrier.siret][
+        : get_other_facilities_limit()
+    ]
+
+
+def carrier_document_refresh(carriers=None):
+    """Store the public detail of the carriers (all of them by default) in
+    their document column, the carriers are processed by batch.
+
+    Returns the number of documents.
+    """
+    if carriers is None:
+        carriers = carriers_models.Carrier.objects.all()
+
+    # The editable is created on import by update-carrier.sql
+    sirets = list(
+        carriers.filter(editable__isnull=False)
+        .order_by("siren", "siret")
+        .values_list("siret", flat=True)
+    )
+    count = 0
+    for i in range(0, len(sirets), CARRIER_DOCUMENT_BATCH_SIZE):
+        batch = list(
+            get_carrier_detail_queryset()
+            .filter(siret__in=sirets[i : i + CARRIER_DOCUMENT_BATCH_SIZE])
+            .defer("document")
+        )
+        facilities_by_siren = get_first_facilities_by_siren(
+            set(carrier.siren for carrier in batch)
+        )
+        documents = []
+        for carrier in batch:
+            other_facilities = get_other_facilities_from_siren(
+                carrier, facilities_by_siren.get(carrier.siren, [])
+            )
+            documents.append(
+                (carrier.siret,)
+                + dump_carrier_document(get_carrier_document(carrier, other_facilities))
+            )
+
+        with connection.cursor() as cursor:
+            psycopg2.extras.execute_values(
+                cursor.cursor,
+                """
+                UPDATE carrier c
+                   SET document = d.document::jsonb,
+                       document_version = d.document_version
+                  FROM (VALUES %s) AS d (siret, document, document_version)
+                 WHERE c.siret = d.siret
+                """,
+                documents,
+            )
+        count += len(documents)
+
+    return count
+
+
+def get_facility(siret):
+    """The carrier as listed in the documents of the other facilities"""
+    return (
+        carriers_models.Carrier.objects.filter(siret=siret)
+        .values(*OTHER_FACILITIES_LIST_FIELDS)
+        .first()
+    )
+
+
+def get_carriers_listing(carrier):
+    """The other facilities of the company listing the carrier in their
+    document, only the first ones of the SIREN are listed."""
+    limit = get_other_facilities_limit()
+    siblings = carriers_models.Carrier.objects.filter(siren=carrier.siren).exclude(
+        pk=carrier.pk
+    )
+    rank = siblings.filter(siret__lt=carrier.siret).order_by()[: limit + 1].count()
+    if rank < limit:
+        return siblings
+    if rank == limit:
+        # Listed by the previous ones only (they don't list themselves)
+        return siblings.filter(siret__lt=carrier.siret)
+    return siblings.none()
+
+
+def carrier_save_document_refresh(carrier, previous_facility):
+    """Refresh the document of the saved carrier and, when its summary has
+    changed (previous_facility is the result of get_facility() before the
+    save), the documents of the other facilities listing it."""
+    carriers = carriers_models.Carrier.objects.filter(pk=carrier.pk)
+    if get_facility(carrier.pk) != previous_facility:
+        carriers |= get_carriers_listing(carrier)
+    return carrier_document_refresh(carriers)
@@ -3,9 +3,11 @@ import smtplib
 import sentry_sdk
 
 from django.conf import settings
-from django.core.mail import mail_managers, send_mail
+from django.core.mail import EmailMessage, mail_managers, send_mail
 
 from ..core import mails as core_mails
+from ..outbox import mails as outbox_mails
+from ..outbox import models as outbox_models
 from . import models as carriers_models
 from . import tokens as carriers_tokens
 
@@ -172,7 +174,7 @@ Informations modifiées :
     message += get_message_of_changes(
         changed_fields, current_carrier_editable, new_carrier_editable
     )
-    mail_managers(subject, message, fail_silently=True)
+    outbox_mails.mail_managers_or_digest(subject, message)
 
 
 def mail_managers_carrier_confirmed(carrier_editable):
@@ -187,7 +189,7 @@ SIRET : {siret}
         siret=carrier.siret,
         http_client_url=settings.HTTP_CLIENT_URL,
     )
-    mail_managers(subject, message, fail_silently=True)
+    outbox_mails.mail_managers_or_digest(subject, message)
 
 
 def mail_carrier_certificate_to_confirm(carrier, certificate):
@@ -245,7 +247,7 @@ Données :
         siret=carrier.siret,
         user=certificate.created_by,
     )
-    mail_managers(subject, message, fail_silently=True)
+    outbox_mails.mail_managers_or_digest(subject, message)
 
 
 def mail_managers_certificate_confirmed(certificate):
@@ -270,7 +272,7 @@ Données :
         siret=carrier.siret,
         user=certificate.created_by,
     )
-    mail_managers(subject, message, fail_silently=True)
+    outbox_mails.mail_managers_or_digest(subject, message)
 
 
 def get_license_message(label, numero, date_fin, new_nombre):
@@ -359,7 +361,7 @@ Nombre de LC : {lc_nombre}
         http_client_url=settings.HTTP_CLIENT_URL,
         siret=carrier.siret,
     )
-    mail_managers(subject, message, fail_silently=True)
+    outbox_mails.mail_managers_or_digest(subject, message)
 
 
 def mail_dreal_license_renewal_with_fallback(license_renewal):
@@ -406,6 +408,14 @@ pièces justificatives à l’adresse {email}.
         email=license_renewal.carrier.editable.email, signature=core_mails.SIGNATURE
     )
     recipient_list = get_recipient_list_from_env(settings.DREAL_EMAIL)
+    if settings.USE_MAIL_OUTBOX:
+        # The fallback is handled by the send_outbox command
+        outbox_models.Message.from_email_message(
+            EmailMessage(subject, message, settings.SERVER_EMAIL, recipient_list),
+            fallback_to_managers=True,
+        ).save()
+        return True
+
     try:
         send_mail(
             subject,
@@ -443,4 +453,4 @@ Nombre de LC : {lc_nombre}
         http_client_url=settings.HTTP_CLIENT_URL,
         siret=carrier.siret,
     )
-    mail_managers(subject, message, fail_silently=True)
+    outbox_mails.mail_managers_or_digest(subject, message)
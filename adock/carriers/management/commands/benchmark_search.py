@@ -0,0 +1,153 @@
+import json
+import math
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from adock.carriers import search_cache as carriers_search_cache
+from adock.carriers import views as carriers_views
+
+# Fixed mix of query shapes, each shape is replayed with all its variants
+QUERY_SHAPES = (
+    (
+        "siret_prefix",
+        [{"q": "99900000001"}, {"q": "999 000 000 12"}, {"q": "999000000"}],
+    ),
+    ("postcode", [{"q": "44"}, {"q": "44300"}, {"q": "75"}]),
+    (
+        "multi_word",
+        [
+            {"q": "transports martin"},
+            {"q": "dupont et fils"},
+            {"q": "sarl logistique ouest"},
+        ],
+    ),
+    (
+        "departement",
+        [
+            {"departement-depart": "44"},
+            {"departement-depart": "44", "departement-arrivee": "35"},
+            {"departement-depart": "13", "departement-arrivee": "69"},
+        ],
+    ),
+    (
+        "speciality",
+        [
+            {"specialities[]": ["LOT"]},
+            {"specialities[]": ["LOT", "PALETTE"]},
+            {"specialities[]": ["ANIMAL"]},
+        ],
+    ),
+    ("limit", [{"limit": "10"}, {"limit": "50"}, {"limit": "200"}]),
+    (
+        "combined",
+        [
+            {"q": "transports", "departement-depart": "44", "licence-types[]": "lc"},
+            {"q": "martin", "specialities[]": ["LOT"], "limit": "20"},
+        ],
+    ),
+    ("near", [{"near": "47.218,-1.553"}, {"near": "48.117,-1.677", "radius": "50"}]),
+    ("fuzzy", [{"q": "transports dupomt", "fuzzy": "1"}]),
+    ("facets", [{"q": "transports", "facets": "1"}]),
+)
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile"""
+    index = max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = "Replay a fixed mix of searches and report the latencies as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=20,
+            help="Number of runs of each variant of query shape.",
+        )
+        parser.add_argument(
+            "--with-cache",
+            action="store_true",
+            help="Keep the cache of the search results between the runs.",
+        )
+        parser.add_argument("--shape", action="append", help="Only these shapes.")
+        parser.add_argument(
+            "--compare-sql-json",
+            action="store_true",
+            help="Run each shape with the JSON built by Python then by PostgreSQL.",
+        )
+
+    def run_shape(self, url, variants, options):
+        request_factory = RequestFactory()
+        durations = []
+        cpu_durations = []
+        queries = []
+        results = []
+        for _ in range(options["iterations"]):
+            for params in variants:
+                if not options["with_cache"]:
+                    carriers_search_cache.search_cache.clear()
+
+                request = request_factory.get(url, params)
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    cpu_start = time.process_time()
+                    # The content of the response is rendered on creation
+                    response = carriers_views.carrier_search(request)
+                    cpu_durations.append((time.process_time() - cpu_start) * 1000)
+                    durations.append((time.perf_counter() - start) * 1000)
+
+                if response.status_code != 200:
+                    raise ValueError(
+                        "Search %s failed: %s" % (params, response.content)
+                    )
+                queries.append(len(context.captured_queries))
+                results.append(len(json.loads(response.content.decode())["carriers"]))
+
+        durations.sort()
+        return {
+            "requests": len(durations),
+            "p50_ms": round(percentile(durations, 50), 2),
+            "p95_ms": round(percentile(durations, 95), 2),
+            "p99_ms": round(percentile(durations, 99), 2),
+            "max_ms": round(durations[-1], 2),
+            # CPU time of the Python process only
+            "cpu_ms": round(sum(cpu_durations) / len(cpu_durations), 3),
+            "queries": max(queries),
+            "results": round(sum(results) / len(results), 1),
+        }
+
+    def run(self, url, variants, options):
+        # Warm up the connection and the plans
+        self.run_shape(url, variants, dict(options, iterations=1))
+        return self.run_shape(url, variants, options)
+
+    def handle(self, *args, **options):
+        url = reverse("carriers_search")
+        report = {}
+        for shape, variants in QUERY_SHAPES:
+            if options["shape"] and shape not in options["shape"]:
+                continue
+
+            if options["compare_sql_json"]:
+                report[shape] = {}
+                for sql_json in (False, True):
+                    with override_settings(CARRIERS_SEARCH_SQL_JSON=sql_json):
+                        report[shape]["sql" if sql_json else "python"] = self.run(
+                            url, variants, options
+                        )
+                report[shape]["cpu_ms_saved"] = round(
+                    report[shape]["python"]["cpu_ms"] - report[shape]["sql"]["cpu_ms"],
+                    3,
+                )
+            else:
+                report[shape] = self.run(url, variants, options)
+
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
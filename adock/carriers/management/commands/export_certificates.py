@@ -0,0 +1,148 @@
+import argparse
+import multiprocessing
+import time
+import zipfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils.dateparse import parse_date
+
+from adock.carriers import certificates as carriers_certificates
+from adock.carriers import models as carriers_models
+
+PROGRESS_INTERVAL = 5
+
+
+def date_argument(value):
+    date = parse_date(value)
+    if date is None:
+        raise argparse.ArgumentTypeError("Invalid date '%s' (YYYY-MM-DD)" % value)
+    return date
+
+
+def render_certificate(certificate_id):
+    """Runs in the processes of the pool, the PDF already rendered are taken
+    from the cache. Only the PDF of the latest certificates are stored, the
+    other ones are never served."""
+    certificate = carriers_models.CarrierCertificate.objects.select_related(
+        "carrier"
+    ).get(pk=certificate_id)
+    filename = "%s/%s" % (
+        certificate.carrier.departement or "inconnu",
+        carriers_certificates.get_pdf_filename(certificate),
+    )
+    store = certificate.carrier.get_latest_certificate() == certificate
+    try:
+        return filename, carriers_certificates.get_pdf(certificate, store), None
+    except Exception as e:  # pylint: disable=W0703
+        return filename, None, str(e) or e.__class__.__name__
+
+
+def close_connections():
+    # The connections of the parent process can't be shared
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Export the confirmed certificates in a ZIP file of PDF."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the ZIP file.")
+        parser.add_argument(
+            "--departement", action="append", help="Only these departements."
+        )
+        parser.add_argument(
+            "--kind",
+            choices=[kind for kind, _ in carriers_models.CERTIFICATE_CHOICES],
+            help="Only this kind of certificates.",
+        )
+        parser.add_argument(
+            "--since",
+            type=date_argument,
+            help="Confirmed on or after this date (YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--until",
+            type=date_argument,
+            help="Confirmed on or before this date (YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.CARRIERS_CERTIFICATE_PDF_WORKERS,
+            help="Number of renders at the same time.",
+        )
+
+    def get_certificate_ids(self, options):
+        certificates = carriers_models.CarrierCertificate.objects.filter(
+            confirmed_at__isnull=False
+        )
+        if options["departement"]:
+            certificates = certificates.filter(
+                carrier__departement__in=options["departement"]
+            )
+        if options["kind"]:
+            certificates = certificates.filter(kind=options["kind"])
+        if options["since"]:
+            certificates = certificates.filter(confirmed_at__date__gte=options["since"])
+        if options["until"]:
+            certificates = certificates.filter(confirmed_at__date__lte=options["until"])
+        return list(
+            certificates.order_by(
+                "carrier__departement", "carrier_id", "pk"
+            ).values_list("pk", flat=True)
+        )
+
+    def write_progress(self, done, total, start):
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            "%d/%d certificates (%.1f PDF/s)"
+            % (done, total, done / elapsed if elapsed else 0)
+        )
+
+    def handle(self, *args, **options):
+        certificate_ids = self.get_certificate_ids(options)
+        total = len(certificate_ids)
+        processes = max(1, options["processes"])
+        pool = None
+        if processes > 1 and total > 1:
+            close_connections()
+            pool = multiprocessing.Pool(processes, initializer=close_connections)
+            results = pool.imap_unordered(render_certificate, certificate_ids)
+        else:
+            results = map(render_certificate, certificate_ids)
+
+        start = time.perf_counter()
+        last_progress = start
+        done = failed = 0
+        try:
+            # Each PDF is written to the archive as soon as it's rendered
+            with zipfile.ZipFile(options["output"], "w", zipfile.ZIP_STORED) as archive:
+                for filename, content, error in results:
+                    done += 1
+                    if content:
+                        archive.writestr(filename, content)
+                    else:
+                        failed += 1
+                        self.stderr.write(
+                            self.style.ERROR(
+                                "Unable to render %s: %s"
+                                % (filename, error or "empty document")
+                            )
+                        )
+
+                    if time.perf_counter() - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = time.perf_counter()
+                        self.write_progress(done, total, start)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        self.write_progress(done, total, start)
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Certificates exported: %d, failed: %d" % (done - failed, failed)
+            )
+        )
@@ -2,9 +2,12 @@ import datetime
 
 from django.core.management.base import LabelCommand
 from django.db import transaction
+from django.db.models import Q
 from openpyxl import load_workbook
 
+from adock.carriers import documents as carriers_documents
 from adock.carriers import models as carriers_models
+from adock.carriers import search_cache as carriers_search_cache
 
 
 class Command(LabelCommand):
@@ -48,9 +51,7 @@ class Command(LabelCommand):
                 # Not always a string...
                 row["siren"] = row["siren"].replace(" ", "")
 
-            carriers = carriers_models.Carrier.objects.filter(
-                siret__startswith=row["siren"]
-            )
+            carriers = carriers_models.Carrier.objects.filter(siren=row["siren"])
             if not carriers:
                 self.counters["siren_not_found"] += 1
                 self.stdout.write(
@@ -92,11 +93,21 @@ class Command(LabelCommand):
         reader = wb.active.iter_rows()
 
         with transaction.atomic():
+            labelled_carriers = carriers_models.Carrier.objects.exclude(objectif_co2="")
+            previous_sirets = list(labelled_carriers.values_list("siret", flat=True))
             # Reset
             carriers_models.Carrier.objects.update(
                 objectif_co2="", objectif_co2_begin=None, objectif_co2_end=None
             )
             # Set
             self.import_objectif_co2(reader)
+            # Invalidate the cached search results
+            carriers_search_cache.bump_generation()
+            # Documents of the carriers labelled before or now
+            carriers_documents.carrier_document_refresh(
+                carriers_models.Carrier.objects.filter(
+                    Q(siret__in=previous_sirets) | ~Q(objectif_co2="")
+                )
+            )
 
         self.stdout.write(self.style.SUCCESS("%s" % self.counters))
@@ -11,6 +11,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 from adock.carriers import models as carriers_models
+from adock.carriers import search_cache as carriers_search_cache
 
 
 class Command(BaseCommand):
@@ -124,6 +125,7 @@ class Command(BaseCommand):
                 sys.exit(1)
 
         queryset.update(applied_at=timezone.now())
+        carriers_search_cache.bump_generation()
         self.stdout.write(
             self.style.SUCCESS("Registre '%s' imported with success." % filename)
         )
@@ -1,15 +1,56 @@
-from pathlib import Path
 import gzip
 import os
-import shutil
-import subprocess
 import sys
+import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 from django.utils import timezone
 
 from adock.carriers import models as carriers_models
+from adock.carriers import search_cache as carriers_search_cache
+
+PROGRESS_INTERVAL = 10
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def read_script(name):
+    with open(os.path.join(settings.BASE_DIR, "scripts", name)) as f:
+        return f.read()
+
+
+class ProgressReader:
+    """File given to copy_expert, it reports the number of rows read from the
+    compressed file."""
+
+    def __init__(self, f, compressed_size, write):
+        self.f = f
+        self.compressed_size = compressed_size
+        self.write = write
+        # The header isn't a row
+        self.rows = -1
+        self.start = self.last_progress = time.perf_counter()
+
+    def get_rate(self):
+        elapsed = time.perf_counter() - self.start
+        return self.rows / elapsed if elapsed else 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        # The line breaks in quoted values are counted too
+        self.rows += data.count(b"\n")
+        if time.perf_counter() - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = time.perf_counter()
+            self.write(
+                "%d rows (%.0f rows/s, %d%% of the file)"
+                % (
+                    self.rows,
+                    self.get_rate(),
+                    100 * self.f.fileobj.tell() / self.compressed_size,
+                )
+            )
+        return data
 
 
 class Command(BaseCommand):
@@ -25,48 +66,32 @@ class Command(BaseCommand):
         except carriers_models.CarrierFeed.DoesNotExist:
             sys.exit(1)
 
-        # The Python version of gunzip in command line...
+        # The file is decompressed on the fly, straight into PostgreSQL
         gzip_filename = os.path.join(settings.DATAFILES_ROOT, feed.filename.name)
-        self.stdout.write("File to decompress: %s" % gzip_filename)
-        with gzip.open(gzip_filename, "rb") as f_in:
-            filename = str(Path(gzip_filename).with_suffix(""))
-            with open(filename, "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
-
-        self.stdout.write("psql import of '%s'..." % filename)
-        # Call SQL script to import the CSV file
-        psql_ps = subprocess.Popen(
-            [
-                "psql",
-                settings.DATABASES["default"]["NAME"],
-                "-f",
-                os.path.join(settings.BASE_DIR, "scripts", "import-sirene.sql"),
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-
-        try:
-            # Max 20 mn
-            _, stderr_data = psql_ps.communicate(timeout=1200)
-        except subprocess.TimeoutExpired:
-            psql_ps.kill()
-            self.stderr.write(
-                self.style.ERROR("Timeout: psql on file '%s'." % filename)
+        self.stdout.write("COPY of '%s'..." % gzip_filename)
+        with transaction.atomic(), connection.cursor() as cursor, gzip.open(
+            gzip_filename, "rb"
+        ) as f:
+            cursor.execute(read_script("create-sirene.sql"))
+            reader = ProgressReader(
+                f, os.path.getsize(gzip_filename), self.stdout.write
             )
-            sys.exit(1)
-
-        if psql_ps.returncode < 0:
-            self.stderr.write(
-                self.style.ERROR(
-                    "Unable to 'psql' the file '%s' with 'import-sirene.sql'."
-                    % feed.filename.name
-                )
+            cursor.cursor.copy_expert(
+                "COPY sirene FROM STDIN "
+                "WITH (FORMAT csv, HEADER, DELIMITER ',', NULL '', ENCODING 'utf-8')",
+                reader,
+                size=COPY_BUFFER_SIZE,
             )
-            self.stderr.write(self.style.ERROR(stderr_data))
-            sys.exit(1)
+            self.stdout.write(
+                "%d rows copied (%.0f rows/s), indexing..."
+                % (reader.rows, reader.get_rate())
+            )
+            cursor.execute(read_script("index-sirene.sql"))
+            queryset.update(applied_at=timezone.now())
+            carriers_search_cache.bump_generation()
 
-        queryset.update(applied_at=timezone.now())
         self.stdout.write(
-            self.style.SUCCESS("Geo Sirene '%s' imported with success." % filename)
+            self.style.SUCCESS(
+                "Geo Sirene '%s' imported with success." % feed.filename.name
+            )
         )
@@ -0,0 +1,340 @@
+import bisect
+import csv
+import io
+import itertools
+import random
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from adock.carriers import models as carriers_models
+from adock.carriers import validators as carriers_validators
+
+# The SIREN of the synthetic carriers start with this prefix (not allocated by
+# INSEE) so they can be deleted without touching the real ones.
+SIRET_PREFIX = "999"
+
+# Most carriers are in the populated departements
+DEPARTEMENTS = ["{:0>2}".format(n) for n in range(1, 96) if n != 20] + [
+    "2A",
+    "2B",
+    "971",
+    "972",
+    "973",
+    "974",
+    "976",
+]
+POPULATED_DEPARTEMENTS = ["13", "31", "33", "44", "59", "69", "75", "77", "92", "93"]
+
+# Bounding box of metropolitan France
+LATITUDES = (42.3, 51.0)
+LONGITUDES = (-4.7, 8.2)
+
+ENSEIGNE_PREFIXES = ["TRANSPORTS", "TRANSPORT", "TRANS", "SARL", "SAS", "EURL", "STE"]
+ENSEIGNE_WORDS = [
+    "MARTIN",
+    "BERNARD",
+    "DUBOIS",
+    "THOMAS",
+    "ROBERT",
+    "RICHARD",
+    "PETIT",
+    "DURAND",
+    "LEROY",
+    "MOREAU",
+    "SIMON",
+    "LAURENT",
+    "LEFEBVRE",
+    "MICHEL",
+    "GARCIA",
+    "DAVID",
+    "BERTRAND",
+    "ROUX",
+    "VINCENT",
+    "FOURNIER",
+    "MOREL",
+    "GIRARD",
+    "ANDRE",
+    "LEFEVRE",
+    "MERCIER",
+    "DUPONT",
+    "LAMBERT",
+    "BONNET",
+    "FRANCOIS",
+    "MARTINEZ",
+    "EXPRESS",
+    "LOGISTIQUE",
+    "SERVICES",
+    "FRET",
+    "ROUTE",
+    "ATLANTIQUE",
+    "OUEST",
+    "SUD",
+    "NORD",
+    "EST",
+    "ET FILS",
+    "FRERES",
+    "COURSIER",
+    "LIVRAISON",
+    "DÉMÉNAGEMENTS",
+    "MESSAGERIE",
+]
+CITIES = ["NANTES", "LYON", "MARSEILLE", "TOULOUSE", "LILLE", "BORDEAUX", "RENNES"]
+
+CARRIER_COLUMNS = (
+    "siret",
+    "siren",
+    "raison_sociale",
+    "enseigne",
+    "enseigne_unaccent",
+    "categorie_juridique",
+    "is_siege",
+    "adresse",
+    "code_postal",
+    "ville",
+    "departement",
+    "telephone",
+    "email",
+    "code_ape",
+    "libelle_ape",
+    "gestionnaire",
+    "lti_numero",
+    "lti_nombre",
+    "lc_numero",
+    "lc_nombre",
+    "created_at",
+    "completeness",
+    "sirene_exists",
+    "objectif_co2",
+    "latitude",
+    "longitude",
+    "document_version",
+)
+
+EDITABLE_COLUMNS = (
+    "carrier_id",
+    "telephone",
+    "email",
+    "created_at",
+    "confirmed_at",
+    "working_area",
+    "working_area_departements",
+    "specialities",
+    "specialities_mask",
+    "website",
+    "description",
+)
+
+
+def weighted_choice(rand, population, weights):
+    # random.choices isn't available in Python 3.5
+    cumulative_weights = list(itertools.accumulate(weights))
+    x = rand.random() * cumulative_weights[-1]
+    return population[bisect.bisect(cumulative_weights, x)]
+
+
+def to_pg_array(values):
+    return "{%s}" % ",".join(values) if values is not None else None
+
+
+class Command(BaseCommand):
+    help = "Load a synthetic registre of carriers with COPY to benchmark the search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=60000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help="Only delete the synthetic carriers previously loaded.",
+        )
+
+    def get_enseigne(self, rand):
+        # 1 to 5 words, 2 or 3 in most cases
+        nb_words = weighted_choice(rand, [1, 2, 3, 4, 5], [10, 40, 30, 15, 5])
+        words = rand.sample(ENSEIGNE_WORDS, nb_words)
+        if rand.random() < 0.6:
+            words.insert(0, rand.choice(ENSEIGNE_PREFIXES))
+        return " ".join(words)
+
+    def get_code_postal(self, rand, departement):
+        if len(departement) == 3:
+            return "%s%02d" % (departement, rand.randint(0, 99))
+        # Corsica
+        return "%s%03d" % (
+            departement.replace("2A", "20").replace("2B", "20"),
+            rand.randint(0, 999),
+        )
+
+    def get_specialities(self, rand):
+        # 85% of the carriers didn't fill the specialities
+        if rand.random() < 0.85:
+            return None
+
+        codes = [code for code, _ in carriers_models.SPECIALITY_CHOICES]
+        # LOT, PALETTE and MESSAGERIE are the most common
+        weights = [
+            10 if code in ("LOT", "PALETTE", "MESSAGERIE") else 1 for code in codes
+        ]
+        return sorted(
+            set(
+                weighted_choice(rand, codes, weights) for _ in range(rand.randint(1, 4))
+            )
+        )
+
+    def get_rows(self, rand, count, now):
+        carrier_rows = []
+        editable_rows = []
+        for i in range(count):
+            siret = "{}{:0>11}".format(SIRET_PREFIX, i)
+            if rand.random() < 0.5:
+                departement = rand.choice(POPULATED_DEPARTEMENTS)
+            else:
+                departement = rand.choice(DEPARTEMENTS)
+            enseigne = self.get_enseigne(rand)
+            has_lc = rand.random() < 0.4
+            has_lti = not has_lc or rand.random() < 0.3
+            confirmed = rand.random() < 0.05
+            carrier_rows.append(
+                (
+                    siret,
+                    siret[: carriers_validators.SIREN_LENGTH],
+                    enseigne,
+                    enseigne,
+                    # Close enough to unaccent for the synthetic words
+                    enseigne.replace("É", "E"),
+                    "Société par actions simplifiée (SAS)",
+                    rand.random() < 0.7,
+                    "%d RUE DE LA GARE" % rand.randint(1, 200),
+                    self.get_code_postal(rand, departement),
+                    rand.choice(CITIES),
+                    departement,
+                    "",
+                    "",
+                    "4941A",
+                    "Transports routiers de fret interurbains",
+                    "",
+                    "2018 84 %08d" % i if has_lti else "",
+                    rand.randint(1, 20) if has_lti else 0,
+                    "2017 84 %08d" % i if has_lc else "",
+                    rand.randint(1, 50) if has_lc else 0,
+                    now,
+                    rand.choice([70, 85, 100]) if confirmed else 40,
+                    True,
+                    "",
+                    round(rand.uniform(*LATITUDES), 5),
+                    round(rand.uniform(*LONGITUDES), 5),
+                    "",
+                )
+            )
+
+            working_area = carriers_models.WORKING_AREA_DEPARTEMENT
+            working_area_departements = [departement]
+            specialities = None
+            if confirmed:
+                working_area = weighted_choice(
+                    rand,
+                    [
+                        carriers_models.WORKING_AREA_DEPARTEMENT,
+                        carriers_models.WORKING_AREA_REGION,
+                        carriers_models.WORKING_AREA_FRANCE,
+                        carriers_models.WORKING_AREA_INTERNATIONAL,
+                    ],
+                    [50, 20, 20, 10],
+                )
+                if working_area == carriers_models.WORKING_AREA_DEPARTEMENT:
+                    working_area_departements = sorted(
+                        set(
+                            [departement]
+                            + rand.sample(DEPARTEMENTS, rand.randint(0, 4))
+                        )
+                    )
+                elif working_area == carriers_models.WORKING_AREA_REGION:
+                    working_area_departements = sorted(
+                        set(
+                            [departement]
+                            + rand.sample(DEPARTEMENTS, rand.randint(3, 12))
+                        )
+                    )
+                specialities = self.get_specialities(rand)
+
+            editable_rows.append(
+                (
+                    siret,
+                    "",
+                    "",
+                    now,
+                    now if confirmed else None,
+                    working_area,
+                    to_pg_array(working_area_departements),
+                    to_pg_array(specialities),
+                    carriers_models.get_specialities_mask(specialities),
+                    "",
+                    "",
+                )
+            )
+
+        return carrier_rows, editable_rows
+
+    def copy(self, cursor, table, columns, rows):
+        f = io.StringIO()
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow([r"\N" if value is None else value for value in row])
+        f.seek(0)
+        cursor.cursor.copy_expert(
+            r"COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '\N')"
+            % (table, ", ".join(columns)),
+            f,
+        )
+
+    def delete(self, cursor):
+        like = SIRET_PREFIX + "%"
+        cursor.execute(
+            "UPDATE carrier SET editable_id = NULL WHERE siret LIKE %s", [like]
+        )
+        cursor.execute("DELETE FROM carrier_editable WHERE carrier_id LIKE %s", [like])
+        cursor.execute("DELETE FROM carrier WHERE siret LIKE %s", [like])
+        return cursor.rowcount
+
+    def handle(self, *args, **options):
+        if settings.ENVIRONMENT == "PRODUCTION":
+            self.stderr.write(
+                self.style.ERROR("Synthetic carriers can't be loaded in production.")
+            )
+            sys.exit(1)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            deleted = self.delete(cursor)
+            if deleted:
+                self.stdout.write("Synthetic carriers deleted: %d" % deleted)
+
+            if not options["delete"]:
+                rand = random.Random(options["seed"])
+                carrier_rows, editable_rows = self.get_rows(
+                    rand, options["count"], timezone.now()
+                )
+                self.copy(cursor, "carrier", CARRIER_COLUMNS, carrier_rows)
+                self.copy(cursor, "carrier_editable", EDITABLE_COLUMNS, editable_rows)
+                cursor.execute(
+                    """
+                    UPDATE carrier c
+                       SET editable_id = ce.id
+                      FROM carrier_editable ce
+                     WHERE ce.carrier_id = c.siret AND c.siret LIKE %s
+                    """,
+                    [SIRET_PREFIX + "%"],
+                )
+
+            carriers_models.carrier_search_refresh()
+            cursor.execute("ANALYZE carrier")
+            cursor.execute("ANALYZE carrier_editable")
+            cursor.execute("ANALYZE carrier_search")
+
+        if not options["delete"]:
+            self.stdout.write(
+                self.style.SUCCESS("Synthetic carriers loaded: %d" % options["count"])
+            )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from adock.carriers import documents as carriers_documents
+from adock.carriers import models as carriers_models
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored public detail of the carriers (after the imports)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("siret", nargs="*", help="Only these carriers.")
+
+    def handle(self, *args, **options):
+        carriers = carriers_models.Carrier.objects.all()
+        if options["siret"]:
+            carriers = carriers.filter(siret__in=options["siret"])
+
+        count = carriers_documents.carrier_document_refresh(carriers)
+        self.stdout.write(self.style.SUCCESS("Carrier documents refreshed: %d" % count))
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from adock.carriers import certificates as carriers_certificates
+
+
+class Command(BaseCommand):
+    help = "Render the PDF of the certificates queued by the asynchronous mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.CARRIERS_CERTIFICATE_PDF_WORKERS,
+            help="Number of renders at the same time.",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Don't exit and check the queue every "
+            "CARRIERS_CERTIFICATE_PDF_POLL_INTERVAL seconds.",
+        )
+
+    def work(self, loop):
+        # Each thread has its own connection to the database
+        try:
+            while True:
+                job = carriers_certificates.claim_job()
+                if job:
+                    carriers_certificates.run_job(job)
+                    with self.lock:
+                        self.counters["failed" if job.error else "done"] += 1
+                elif loop:
+                    carriers_certificates.purge_jobs()
+                    time.sleep(settings.CARRIERS_CERTIFICATE_PDF_POLL_INTERVAL)
+                else:
+                    break
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        carriers_certificates.purge_jobs()
+        self.lock = threading.Lock()
+        self.counters = {"done": 0, "failed": 0}
+        threads = [
+            threading.Thread(target=self.work, args=(options["loop"],))
+            for _ in range(max(1, options["workers"]))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Certificates rendered: %d, failed: %d (%s)"
+                % (
+                    self.counters["done"],
+                    self.counters["failed"],
+                    carriers_certificates.get_job_stats(),
+                )
+            )
+        )
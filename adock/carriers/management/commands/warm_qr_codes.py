@@ -0,0 +1,34 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from adock.carriers import certificates as carriers_certificates
+from adock.carriers import models as carriers_models
+from adock.core import pdf as core_pdf
+
+
+class Command(BaseCommand):
+    help = "Store the QR codes of the carriers with a confirmed certificate."
+
+    def handle(self, *args, **options):
+        if not settings.QR_CODE_CACHE:
+            # The QR codes would only be kept by the process of the command
+            self.stderr.write(
+                self.style.ERROR("QR_CODE_CACHE isn't set, nothing to warm.")
+            )
+            sys.exit(1)
+
+        carriers = (
+            carriers_models.Carrier.objects.filter(
+                certificates__confirmed_at__isnull=False
+            )
+            .distinct()
+            .only("siret")
+        )
+        count = 0
+        for carrier in carriers.iterator():
+            core_pdf.get_qr_code(carriers_certificates.get_qr_code_data(carrier))
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS("QR codes warmed: %d" % count))
@@ -0,0 +1,148 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:27
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("carriers", "0016_carrier_users")]
+
+    operations = [
+        migrations.CreateModel(
+            name="CarrierSearch",
+            fields=[
+                (
+                    "siret",
+                    models.CharField(
+                        editable=False, max_length=14, primary_key=True, serialize=False
+                    ),
+                ),
+                ("raison_sociale", models.CharField(max_length=131)),
+                ("enseigne", models.CharField(max_length=131)),
+                ("enseigne_unaccent", models.CharField(max_length=131)),
+                ("adresse", models.CharField(max_length=126)),
+                ("code_postal", models.CharField(max_length=5)),
+                ("ville", models.CharField(max_length=100)),
+                ("departement", models.CharField(max_length=3)),
+                ("completeness", models.PositiveSmallIntegerField()),
+                ("lti_nombre", models.PositiveSmallIntegerField()),
+                ("lc_nombre", models.PositiveSmallIntegerField()),
+                ("has_lti", models.BooleanField()),
+                ("has_lc", models.BooleanField()),
+                (
+                    "working_area",
+                    models.CharField(blank=True, max_length=15, null=True),
+                ),
+                (
+                    "working_area_departements",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.CharField(max_length=3),
+                        blank=True,
+                        null=True,
+                        size=None,
+                    ),
+                ),
+                ("working_area_rank", models.PositiveSmallIntegerField()),
+                (
+                    "specialities",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.CharField(max_length=63),
+                        blank=True,
+                        null=True,
+                        size=None,
+                    ),
+                ),
+            ],
+            options={"db_table": "carrier_search"},
+        ),
+        migrations.AddIndex(
+            model_name="carriersearch",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["enseigne_unaccent"],
+                name="carrier_search_trgm_enseigne",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="carriersearch",
+            index=models.Index(
+                fields=["siret"],
+                name="carrier_search_siret_like",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="carriersearch",
+            index=models.Index(
+                fields=["code_postal"],
+                name="carrier_search_code_postal",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            CREATE INDEX carrier_search_ranking
+                ON carrier_search (working_area_rank, (-completeness), enseigne, siret);
+            """,
+            "DROP INDEX carrier_search_ranking",
+        ),
+        migrations.RunSQL(
+            """
+            CREATE VIEW carrier_search_source AS
+                SELECT
+                    c.siret,
+                    c.raison_sociale,
+                    c.enseigne,
+                    c.enseigne_unaccent,
+                    c.adresse,
+                    c.code_postal,
+                    c.ville,
+                    c.departement,
+                    c.completeness,
+                    c.lti_nombre,
+                    c.lc_nombre,
+                    c.lti_numero <> '' AS has_lti,
+                    c.lc_numero <> '' AS has_lc,
+                    ce.working_area,
+                    ce.working_area_departements,
+                    COALESCE(
+                        CASE ce.working_area
+                        WHEN 'DEPARTEMENT' THEN array_length(ce.working_area_departements, 1)
+                        WHEN 'REGION' THEN array_length(ce.working_area_departements, 1)
+                        WHEN 'FRANCE' THEN 101
+                        WHEN 'INTERNATIONAL' THEN 102
+                        END,
+                        1000
+                    ) AS working_area_rank,
+                    ce.specialities
+                FROM carrier c
+                LEFT JOIN carrier_editable ce
+                       ON ce.id = c.editable_id
+                WHERE c.deleted_at IS NULL AND c.sirene_closed_at IS NULL;
+
+            -- Refresh the rows of the SIRET list or rebuild the table on NULL
+            CREATE FUNCTION carrier_search_refresh(refreshed_sirets text[])
+            RETURNS void AS $$
+            BEGIN
+                IF refreshed_sirets IS NULL THEN
+                    TRUNCATE carrier_search;
+                    INSERT INTO carrier_search SELECT * FROM carrier_search_source;
+                ELSE
+                    DELETE FROM carrier_search WHERE siret = ANY(refreshed_sirets);
+                    INSERT INTO carrier_search
+                        SELECT * FROM carrier_search_source
+                        WHERE siret = ANY(refreshed_sirets);
+                END IF;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            SELECT carrier_search_refresh(NULL);
+            """,
+            """
+            DROP FUNCTION carrier_search_refresh(text[]);
+            DROP VIEW carrier_search_source;
+            """,
+        ),
+    ]
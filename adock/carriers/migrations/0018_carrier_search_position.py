@@ -0,0 +1,75 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:58
+
+from django.contrib.postgres.operations import CreateExtension
+from django.db import migrations, models
+
+CARRIER_SEARCH_SOURCE_SELECT = """
+    SELECT
+        c.siret,
+        c.raison_sociale,
+        c.enseigne,
+        c.enseigne_unaccent,
+        c.adresse,
+        c.code_postal,
+        c.ville,
+        c.departement,
+        c.completeness,
+        c.lti_nombre,
+        c.lc_nombre,
+        c.lti_numero <> '' AS has_lti,
+        c.lc_numero <> '' AS has_lc,
+        ce.working_area,
+        ce.working_area_departements,
+        COALESCE(
+            CASE ce.working_area
+            WHEN 'DEPARTEMENT' THEN array_length(ce.working_area_departements, 1)
+            WHEN 'REGION' THEN array_length(ce.working_area_departements, 1)
+            WHEN 'FRANCE' THEN 101
+            WHEN 'INTERNATIONAL' THEN 102
+            END,
+            1000
+        ) AS working_area_rank,
+        ce.specialities{extra_columns}
+    FROM carrier c
+    LEFT JOIN carrier_editable ce
+           ON ce.id = c.editable_id
+    WHERE c.deleted_at IS NULL AND c.sirene_closed_at IS NULL
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("carriers", "0017_carrier_search")]
+
+    operations = [
+        CreateExtension("cube"),
+        CreateExtension("earthdistance"),
+        migrations.AddField(
+            model_name="carriersearch",
+            name="latitude",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="carriersearch",
+            name="longitude",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunSQL(
+            "CREATE OR REPLACE VIEW carrier_search_source AS"
+            + CARRIER_SEARCH_SOURCE_SELECT.format(
+                extra_columns=",\n        c.latitude,\n        c.longitude"
+            )
+            + ";\nSELECT carrier_search_refresh(NULL);",
+            "DROP VIEW carrier_search_source;\nCREATE VIEW carrier_search_source AS"
+            + CARRIER_SEARCH_SOURCE_SELECT.format(extra_columns="")
+            + ";",
+        ),
+        migrations.RunSQL(
+            """
+            CREATE INDEX carrier_search_earth
+                ON carrier_search
+                USING GIST (ll_to_earth(latitude, longitude));
+            """,
+            "DROP INDEX carrier_search_earth",
+        ),
+    ]
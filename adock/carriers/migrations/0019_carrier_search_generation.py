@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("carriers", "0018_carrier_search_position")]
+
+    operations = [
+        # Generation of the search table to invalidate the cached results, the
+        # first value is consumed so last_value changes on each bump.
+        migrations.RunSQL(
+            "CREATE SEQUENCE carrier_search_generation;\n"
+            "SELECT nextval('carrier_search_generation');",
+            "DROP SEQUENCE carrier_search_generation",
+        )
+    ]
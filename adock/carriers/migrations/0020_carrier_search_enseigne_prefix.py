@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("carriers", "0019_carrier_search_generation")]
+
+    operations = [
+        # Prefix matching and ordering of the suggestions (C collation)
+        migrations.RunSQL(
+            """
+            CREATE INDEX carrier_search_enseigne_prefix
+                ON carrier_search (enseigne_unaccent COLLATE "C", siret);
+            """,
+            "DROP INDEX carrier_search_enseigne_prefix",
+        )
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:40
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("carriers", "0020_carrier_search_enseigne_prefix")]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="carriersearch",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["working_area_departements"], name="carrier_search_departements"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="carriersearch",
+            index=models.Index(
+                fields=["working_area"], name="carrier_search_working_area"
+            ),
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+# Frozen list of the specialities, the position is the bit of the mask
+SPECIALITIES = (
+    "ANIMAL",
+    "AUTRE",
+    "BOIS",
+    "DECHETS",
+    "DEMENAGEMENT",
+    "LOCATION",
+    "LOT",
+    "MATIERE_DANGEREUSE",
+    "MESSAGERIE",
+    "MULTIMODAL",
+    "PALETTE",
+    "PLATEAU",
+    "TEMPERATURE",
+    "URBAIN",
+    "VEHICULE",
+    "VRAC_LIQUIDE",
+    "VRAC_SOLIDE",
+)
+
+CARRIER_SEARCH_SOURCE_SELECT = """
+    SELECT
+        c.siret,
+        c.raison_sociale,
+        c.enseigne,
+        c.enseigne_unaccent,
+        c.adresse,
+        c.code_postal,
+        c.ville,
+        c.departement,
+        c.completeness,
+        c.lti_nombre,
+        c.lc_nombre,
+        c.lti_numero <> '' AS has_lti,
+        c.lc_numero <> '' AS has_lc,
+        ce.working_area,
+        ce.working_area_departements,
+        COALESCE(
+            CASE ce.working_area
+            WHEN 'DEPARTEMENT' THEN array_length(ce.working_area_departements, 1)
+            WHEN 'REGION' THEN array_length(ce.working_area_departements, 1)
+            WHEN 'FRANCE' THEN 101
+            WHEN 'INTERNATIONAL' THEN 102
+            END,
+            1000
+        ) AS working_area_rank,
+        {specialities_columns}
+    FROM carrier c
+    LEFT JOIN carrier_editable ce
+           ON ce.id = c.editable_id
+    WHERE c.deleted_at IS NULL AND c.sirene_closed_at IS NULL
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("carriers", "0021_carrier_search_departements")]
+
+    operations = [
+        migrations.AddField(
+            model_name="carriereditable",
+            name="specialities_mask",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            [
+                (
+                    """
+                    UPDATE carrier_editable
+                       SET specialities_mask = (
+                           SELECT COALESCE(bit_or(1 << (array_position(%s, s) - 1)), 0)
+                           FROM unnest(specialities) s
+                       )
+                     WHERE specialities IS NOT NULL;
+                    """,
+                    [list(SPECIALITIES)],
+                )
+            ],
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            "DROP VIEW carrier_search_source",
+            # The column specialities is restored at the end of the table
+            "CREATE VIEW carrier_search_source AS"
+            + CARRIER_SEARCH_SOURCE_SELECT.format(
+                specialities_columns="c.latitude,\n        c.longitude,\n        ce.specialities"
+            )
+            + ";\nSELECT carrier_search_refresh(NULL);",
+        ),
+        migrations.RemoveField(model_name="carriersearch", name="specialities"),
+        migrations.AddField(
+            model_name="carriersearch",
+            name="specialities_mask",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            "CREATE VIEW carrier_search_source AS"
+            + CARRIER_SEARCH_SOURCE_SELECT.format(
+                specialities_columns="c.latitude,\n        c.longitude,\n        "
+                "COALESCE(ce.specialities_mask, 0) AS specialities_mask"
+            )
+            + ";\nSELECT carrier_search_refresh(NULL);",
+            "DROP VIEW carrier_search_source",
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("carriers", "0022_specialities_mask")]
+
+    operations = [
+        migrations.AddField(
+            model_name="carrier",
+            name="siren",
+            field=models.CharField(default="", editable=False, max_length=9),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            "UPDATE carrier SET siren = left(siret, 9);", migrations.RunSQL.noop
+        ),
+        migrations.AddIndex(
+            model_name="carrier",
+            index=models.Index(fields=["siren", "siret"], name="carrier_siren_siret"),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:02
+
+import django.contrib.postgres.fields.jsonb
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("carriers", "0023_carrier_siren")]
+
+    operations = [
+        migrations.AddField(
+            model_name="carrier",
+            name="document",
+            field=django.contrib.postgres.fields.jsonb.JSONField(
+                blank=True,
+                editable=False,
+                encoder=django.core.serializers.json.DjangoJSONEncoder,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="carrier",
+            name="document_version",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=40
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("carriers", "0024_carrier_document")]
+
+    operations = [
+        migrations.CreateModel(
+            name="CarrierCertificatePDF",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("template_version", models.CharField(max_length=16)),
+                ("content", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "certificate",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pdfs",
+                        to="carriers.CarrierCertificate",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "carrier_certificate_pdf",
+                "unique_together": {("certificate", "template_version")},
+            },
+        ),
+    ]
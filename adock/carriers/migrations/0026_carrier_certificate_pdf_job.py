@@ -0,0 +1,48 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("carriers", "0025_carrier_certificate_pdf")]
+
+    operations = [
+        migrations.CreateModel(
+            name="CarrierCertificatePDFJob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("error", models.TextField(blank=True)),
+                ("render_duration", models.FloatField(blank=True, null=True)),
+                (
+                    "certificate",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pdf_jobs",
+                        to="carriers.CarrierCertificate",
+                    ),
+                ),
+            ],
+            options={"db_table": "carrier_certificate_pdf_job"},
+        ),
+        migrations.AddConstraint(
+            model_name="carriercertificatepdfjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(finished_at__isnull=True),
+                fields=("certificate",),
+                name="carrier_certificate_pdf_job_queued",
+            ),
+        ),
+    ]
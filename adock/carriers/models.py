@@ -2,7 +2,8 @@ from collections import OrderedDict
 
 from django.contrib.postgres.fields import ArrayField, JSONField
 from django.contrib.postgres.indexes import GinIndex
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
 from django.db.models import Lookup
 from django.db.models.fields import Field
 from django.urls import reverse
@@ -10,6 +11,8 @@ from phonenumber_field.modelfields import PhoneNumberField
 
 from adock.accounts import models as accounts_models
 
+from . import documents as carriers_documents
+from . import search_cache as carriers_search_cache
 from . import validators as carriers_validators
 
 
@@ -68,6 +71,20 @@ SPECIALITY_CHOICES = (
     ("VRAC_LIQUIDE", "Vrac liquide"),
     ("VRAC_SOLIDE", "Vrac solide"),
 )
+# The specialities are stored as a bitmask too (the position in the choices is
+# the bit) so new specialities must be appended (see migration 0022).
+SPECIALITY_BITS = {
+    code: 1 << position for position, (code, _) in enumerate(SPECIALITY_CHOICES)
+}
+
+
+def get_specialities_mask(specialities):
+    """The unknown specialities are skipped (as in migration 0022)."""
+    mask = 0
+    for speciality in specialities or []:
+        mask |= SPECIALITY_BITS.get(speciality, 0)
+    return mask
+
 
 OBJECTIF_CO2_ENLISTED = "ENLISTED"
 OBJECTIF_CO2_LABELLED = "LABELLED"
@@ -85,6 +102,11 @@ class Carrier(models.Model):
         db_index=True,
         editable=False,
     )
+    # First digits of the SIRET stored to find the other establishments of
+    # the company (see carrier_siren_siret index)
+    siren = models.CharField(
+        max_length=carriers_validators.SIREN_LENGTH, editable=False
+    )
     # raison_sociale in Registre
     # Always in uppercase
     raison_sociale = models.CharField(max_length=131)
@@ -164,6 +186,15 @@ class Carrier(models.Model):
     # From cquest data
     longitude = models.FloatField(blank=True, null=True)
     latitude = models.FloatField(blank=True, null=True)
+    # Public detail of the carrier served as is (see documents.py), NULL until
+    # the first refresh
+    document = JSONField(
+        blank=True, null=True, editable=False, encoder=DjangoJSONEncoder
+    )
+    # SHA1 of the stored document
+    document_version = models.CharField(
+        max_length=40, blank=True, editable=False, default=""
+    )
     editable = models.ForeignKey(
         "CarrierEditable",
         on_delete=models.SET_NULL,
@@ -182,7 +213,9 @@ class Carrier(models.Model):
                 name="carrier_trgm_enseigne_unaccent",
                 fields=["enseigne_unaccent"],
                 opclasses=["gin_trgm_ops"],
-            )
+            ),
+            # The establishments of a company ordered by SIRET
+            models.Index(name="carrier_siren_siret", fields=["siren", "siret"]),
         ]
         # Take care to create manual index because GinIndex is not able to
         # handle it. One solution is to inherit and adapt the code for that but
@@ -229,7 +262,7 @@ class Carrier(models.Model):
     def get_latest_certificate(self):
         try:
             return self.certificates.filter(confirmed_at__isnull=False).latest(
-                "created_at"
+                "created_at", "pk"
             )
         except CarrierCertificate.DoesNotExist:
             return None
@@ -237,18 +270,111 @@ class Carrier(models.Model):
     def get_latest_license_renewal(self):
         try:
             return self.license_renewals.filter(confirmed_at__isnull=False).latest(
-                "created_at"
+                "created_at", "pk"
             )
         except CarrierLicenseRenewal.DoesNotExist:
             return None
 
     def save(self, *args, **kwargs):  # pylint: disable=W0221
+        self.siren = self.get_siren()
         self.completeness = self.compute_completeness()
         if "update_fields" in kwargs:
             # Could be a dict_keys instance so cast as list and add 'completeness'
             kwargs["update_fields"] = list(kwargs["update_fields"])
             kwargs["update_fields"].append("completeness")
-        super().save(*args, **kwargs)
+        with transaction.atomic(savepoint=False):
+            previous_facility = carriers_documents.get_facility(self.pk)
+            super().save(*args, **kwargs)
+            carrier_search_refresh([self.siret])
+            carriers_documents.carrier_save_document_refresh(self, previous_facility)
+
+
+def carrier_search_refresh(sirets=None):
+    """Refresh the rows of the search table for the list of SIRET or rebuild
+    the whole table when no SIRET are provided (see update-carrier.sql).
+
+    The cached search results are invalidated."""
+    with connection.cursor() as cursor:
+        cursor.execute("select carrier_search_refresh(%s)", [sirets])
+    carriers_search_cache.bump_generation()
+
+
+# Ranks of the working areas in the search table (see migration 0017), the
+# more the working area is restricted the more the carrier is relevant.
+WORKING_AREA_RANK_FRANCE = 101
+WORKING_AREA_RANK_INTERNATIONAL = 102
+WORKING_AREA_RANK_UNDEFINED = 1000
+
+
+class CarrierSearch(models.Model):
+    """Denormalized projection of the active carriers (not deleted and not
+    closed) and of their current editable, with the precomputed ranking keys
+    of the search.
+
+    The table is maintained by the SQL function carrier_search_refresh called
+    on each save of a carrier and at the end of update-carrier.sql, so the
+    search doesn't require any join and the ordering is served by an index.
+    """
+
+    siret = models.CharField(
+        max_length=carriers_validators.SIRET_LENGTH, primary_key=True, editable=False
+    )
+    raison_sociale = models.CharField(max_length=131)
+    enseigne = models.CharField(max_length=131)
+    enseigne_unaccent = models.CharField(max_length=131)
+    adresse = models.CharField(max_length=126)
+    code_postal = models.CharField(max_length=5)
+    ville = models.CharField(max_length=100)
+    departement = models.CharField(max_length=3)
+    completeness = models.PositiveSmallIntegerField()
+    lti_nombre = models.PositiveSmallIntegerField()
+    lc_nombre = models.PositiveSmallIntegerField()
+    has_lti = models.BooleanField()
+    has_lc = models.BooleanField()
+    working_area = models.CharField(max_length=15, blank=True, null=True)
+    working_area_departements = ArrayField(
+        models.CharField(max_length=3), blank=True, null=True
+    )
+    # Number of departements, WORKING_AREA_RANK_FRANCE,
+    # WORKING_AREA_RANK_INTERNATIONAL or WORKING_AREA_RANK_UNDEFINED
+    working_area_rank = models.PositiveSmallIntegerField()
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    # Bitmask of SPECIALITY_BITS
+    specialities_mask = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "carrier_search"
+        indexes = [
+            GinIndex(
+                name="carrier_search_trgm_enseigne",
+                fields=["enseigne_unaccent"],
+                opclasses=["gin_trgm_ops"],
+            ),
+            models.Index(
+                name="carrier_search_siret_like",
+                fields=["siret"],
+                opclasses=["varchar_pattern_ops"],
+            ),
+            models.Index(
+                name="carrier_search_code_postal",
+                fields=["code_postal"],
+                opclasses=["varchar_pattern_ops"],
+            ),
+            # Filtering on departements (bitmap OR of both indexes)
+            GinIndex(
+                name="carrier_search_departements",
+                fields=["working_area_departements"],
+            ),
+            models.Index(name="carrier_search_working_area", fields=["working_area"]),
+        ]
+        # The index on the ranking keys (with negated completeness), the GiST
+        # index on the position (earthdistance) and the prefix index of the
+        # suggestions (C collation) are created in raw SQL because Index
+        # doesn't handle expressions.
+
+    def __str__(self):
+        return self.siret
 
 
 CERTIFICATE_NO_WORKERS = "NO_WORKERS"
@@ -282,6 +408,53 @@ class CarrierCertificate(models.Model):
         db_table = "carrier_certificate"
 
 
+class CarrierCertificatePDF(models.Model):
+    """Rendered PDF of a confirmed certificate (see certificates.get_pdf)"""
+
+    certificate = models.ForeignKey(
+        CarrierCertificate, on_delete=models.CASCADE, related_name="pdfs"
+    )
+    template_version = models.CharField(max_length=16)
+    content = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "carrier_certificate_pdf"
+        unique_together = ("certificate", "template_version")
+
+
+class CarrierCertificatePDFJob(models.Model):
+    """Render of a PDF by the render_certificates command (asynchronous
+    mode of certificate_detail)."""
+
+    certificate = models.ForeignKey(
+        CarrierCertificate, on_delete=models.CASCADE, related_name="pdf_jobs"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    # Empty on success
+    error = models.TextField(blank=True)
+    # Seconds
+    render_duration = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        db_table = "carrier_certificate_pdf_job"
+        constraints = [
+            # Only one job in the queue by certificate
+            models.UniqueConstraint(
+                name="carrier_certificate_pdf_job_queued",
+                fields=["certificate"],
+                condition=models.Q(finished_at__isnull=True),
+            )
+        ]
+
+    def get_status(self):
+        if self.finished_at is None:
+            return "pending" if self.started_at is None else "running"
+        return "failed" if self.error else "done"
+
+
 class CarrierEditable(models.Model):
     """Editable part of the carrier.
     The history of changes on carriers are set by the list of CarrierEditable.
@@ -333,6 +506,8 @@ class CarrierEditable(models.Model):
         blank=True,
         null=True,
     )
+    # Computed from specialities on save, used by the search
+    specialities_mask = models.IntegerField(default=0, editable=False)
     website = models.CharField(
         max_length=200,
         blank=True,
@@ -348,6 +523,13 @@ class CarrierEditable(models.Model):
     def __str__(self):
         return "SIRET %s - pk %s" % (self.carrier.siret, self.pk)
 
+    def save(self, *args, **kwargs):  # pylint: disable=W0221
+        self.specialities_mask = get_specialities_mask(self.specialities)
+        if "update_fields" in kwargs:
+            kwargs["update_fields"] = list(kwargs["update_fields"])
+            kwargs["update_fields"].append("specialities_mask")
+        super().save(*args, **kwargs)
+
     def get_description_of_changes(self):
         changes = []
         for (field, label) in self.INPUT_FIELDS.items():
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+
+def get_generation():
+    """The generation of the search table is shared by all the processes (web
+    workers and import commands) so it's stored in a PostgreSQL sequence."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT last_value FROM carrier_search_generation")
+        return cursor.fetchone()[0]
+
+
+def _bump_generation():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval('carrier_search_generation')")
+
+
+def bump_generation():
+    """Invalidate all the cached results.
+
+    The sequence isn't transactional so the generation is bumped right away
+    (the current transaction must not reuse its stale entries) and once again
+    on commit (a concurrent search could have cached the previous rows under
+    the new generation).
+    """
+    _bump_generation()
+    transaction.on_commit(_bump_generation)
+
+
+class SearchCache:
+    """LRU cache of the search results of the current process.
+
+    Each entry is stored with the generation of the search table, the entries
+    of a previous generation are discarded on read.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get(self, key, generation):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, generation, value):
+        if self.max_size <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (generation, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+search_cache = SearchCache(settings.CARRIERS_SEARCH_CACHE_SIZE)
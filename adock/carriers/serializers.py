@@ -1,4 +1,5 @@
 # pylint: disable=W0223
+from django.conf import settings
 from rest_framework import serializers
 
 from ..accounts import models as accounts_models
@@ -66,6 +67,30 @@ class CarrierEditableSerializer(serializers.ModelSerializer):
         return attrs
 
 
+class CarrierBulkSerializer(serializers.Serializer):
+    sirets = serializers.ListField(
+        # Formatted SIRET are accepted (spaces)
+        child=serializers.CharField(max_length=32),
+        allow_empty=False,
+    )
+    # Fields of the carrier detail instead of the ones of the search results
+    detail = serializers.BooleanField(required=False, default=False)
+
+    def validate_sirets(self, value):
+        if len(value) > settings.CARRIERS_BULK_LIMIT:
+            raise serializers.ValidationError(
+                "Le nombre de SIRET est limité à %d." % settings.CARRIERS_BULK_LIMIT
+            )
+
+        # Spaces removed and unique (in the same order)
+        sirets = []
+        for siret in value:
+            siret = siret.replace(" ", "")
+            if siret not in sirets:
+                sirets.append(siret)
+        return sirets
+
+
 class WorkerSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=100)
     date = serializers.CharField(max_length=64)
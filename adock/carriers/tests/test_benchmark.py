@@ -0,0 +1,51 @@
+import io
+import json
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from .. import models
+
+
+@override_settings(ENVIRONMENT="DEVELOPMENT")
+class BenchmarkTestCase(TestCase):
+    def test_load_benchmark_carriers(self):
+        call_command("load_benchmark_carriers", count=100, stdout=io.StringIO())
+        self.assertEqual(models.Carrier.objects.count(), 100)
+        self.assertEqual(models.CarrierSearch.objects.count(), 100)
+        self.assertFalse(models.Carrier.objects.filter(editable=None).exists())
+
+        call_command("load_benchmark_carriers", delete=True, stdout=io.StringIO())
+        self.assertEqual(models.Carrier.objects.count(), 0)
+        self.assertEqual(models.CarrierSearch.objects.count(), 0)
+
+    @override_settings(ENVIRONMENT="PRODUCTION")
+    def test_load_benchmark_carriers_production(self):
+        with self.assertRaises(SystemExit):
+            call_command("load_benchmark_carriers", stderr=io.StringIO())
+
+    def test_benchmark_search(self):
+        call_command("load_benchmark_carriers", count=100, stdout=io.StringIO())
+        stdout = io.StringIO()
+        call_command("benchmark_search", iterations=1, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report["siret_prefix"]["requests"], 3)
+        self.assertEqual(report["siret_prefix"]["queries"], 2)
+        self.assertIn("p99_ms", report["departement"])
+
+    def test_benchmark_search_compare_sql_json(self):
+        call_command("load_benchmark_carriers", count=100, stdout=io.StringIO())
+        stdout = io.StringIO()
+        call_command(
+            "benchmark_search",
+            iterations=1,
+            shape=["limit"],
+            compare_sql_json=True,
+            stdout=stdout,
+        )
+        report = json.loads(stdout.getvalue())
+        self.assertListEqual(list(report.keys()), ["limit"])
+        self.assertEqual(
+            report["limit"]["python"]["results"], report["limit"]["sql"]["results"]
+        )
+        self.assertIn("cpu_ms_saved", report["limit"])
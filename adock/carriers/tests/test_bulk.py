@@ -0,0 +1,58 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from .. import factories
+
+
+class CarrierBulkTestCase(TestCase):
+    def setUp(self):
+        self.carriers = [factories.CarrierFactory(with_editable=True) for _ in range(3)]
+        self.url = reverse("carriers_bulk")
+
+    def post_bulk(self, data, status_code=200):
+        response = self.client.post(self.url, data, content_type="application/json")
+        self.assertEqual(response.status_code, status_code)
+        return response.json()
+
+    def test_list(self):
+        sirets = [carrier.siret for carrier in reversed(self.carriers)]
+        with self.assertNumQueries(1):
+            data = self.post_bulk({"sirets": sirets + ["12345678900000"]})
+
+        self.assertEqual([c["siret"] for c in data["carriers"]], sirets)
+        self.assertIn("working_area", data["carriers"][0])
+        self.assertNotIn("lti_numero", data["carriers"][0])
+        self.assertEqual(data["missing"], ["12345678900000"])
+
+    def test_detail(self):
+        factories.CarrierCertificateFactory(carrier=self.carriers[0])
+        sirets = [carrier.siret for carrier in self.carriers]
+        with self.assertNumQueries(1):
+            data = self.post_bulk({"sirets": sirets, "detail": True})
+
+        self.assertEqual([c["siret"] for c in data["carriers"]], sirets)
+        self.assertIn("lti_numero", data["carriers"][0])
+        self.assertIsNotNone(data["carriers"][0]["latest_certificate"])
+        self.assertIsNone(data["carriers"][1]["latest_certificate"])
+        self.assertEqual(data["missing"], [])
+
+    def test_formatted_and_duplicated_sirets(self):
+        siret = self.carriers[0].siret
+        formatted_siret = "%s %s %s %s" % (siret[:3], siret[3:6], siret[6:9], siret[9:])
+        data = self.post_bulk({"sirets": [formatted_siret, siret]})
+        self.assertEqual([c["siret"] for c in data["carriers"]], [siret])
+
+    def test_invalid(self):
+        data = self.post_bulk({"sirets": []}, 400)
+        self.assertIn("sirets", data["errors"])
+
+        with self.settings(CARRIERS_BULK_LIMIT=2):
+            data = self.post_bulk(
+                {"sirets": [carrier.siret for carrier in self.carriers]}, 400
+            )
+        self.assertEqual(
+            data["errors"]["sirets"], ["Le nombre de SIRET est limité à 2."]
+        )
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 405)
@@ -1,15 +1,25 @@
-from unittest import skipIf
+from unittest import mock, skipIf
 import copy
+import datetime
+import io
+import os
 import re
+import subprocess
+import tempfile
+import zipfile
 
 from django.conf import settings
 from django.core import mail
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.cache import caches
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
 from adock.accounts.test import AuthTestCase
+from adock.core import pdf as core_pdf
 
-from .. import factories, models
+from .. import certificates, factories, models
 
 
 CERTIFICATE_DATA = {
@@ -166,7 +176,23 @@ class SignCarrierCertificateTestCase(AuthTestCase):
         )
 
 
+def is_puppeteer_installed():
+    try:
+        return (
+            subprocess.call(
+                ["node", "-e", "require.resolve('puppeteer')"],
+                cwd=settings.BASE_DIR,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            == 0
+        )
+    except FileNotFoundError:
+        return False
+
+
 @skipIf(settings.USE_CIRCLECI, "Image not ready for CircleCI")
+@skipIf(not is_puppeteer_installed(), "Puppeteer not installed")
 class GetCarrierCertificateTestCase(TestCase):
     def setUp(self):
         self.carrier = factories.CarrierFactory()
@@ -196,3 +222,241 @@ class GetCarrierCertificateTestCase(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response["Content-Type"], "application/pdf")
+
+
+class CertificatePDFTestCaseMixin(TestCase):
+    """The PDF renderer is replaced by a mock (self.render_pdf)"""
+
+    certificate_kind = models.CERTIFICATE_WORKERS
+
+    def setUp(self):
+        patcher = mock.patch("adock.core.pdf.render_pdf", return_value=b"%PDF-1.4")
+        self.render_pdf = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.carrier = factories.CarrierFactory()
+        self.certificate = factories.CarrierCertificateFactory(
+            carrier=self.carrier, kind=self.certificate_kind
+        )
+        self.url = reverse(
+            "carriers_certificate_detail", kwargs={"carrier_siret": self.carrier.siret}
+        )
+
+
+class CachedCarrierCertificateTestCase(CertificatePDFTestCaseMixin):
+    def test_get_cached_pdf(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4")
+        self.assertEqual(response["Content-Length"], "8")
+        etag = response["ETag"]
+        self.assertEqual(etag, certificates.get_etag(self.certificate))
+        pdf = self.certificate.pdfs.get()
+        self.assertEqual(bytes(pdf.content), b"%PDF-1.4")
+
+        # Served from the database
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4")
+        self.assertEqual(self.render_pdf.call_count, 1)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.render_pdf.call_count, 1)
+
+    def test_get_new_template_version(self):
+        models.CarrierCertificatePDF.objects.create(
+            certificate=self.certificate, template_version="old", content=b"old"
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4")
+        self.assertEqual(self.render_pdf.call_count, 1)
+        self.assertEqual(
+            self.certificate.pdfs.get().template_version,
+            certificates.get_template_version("certificate_workers.html"),
+        )
+
+    def test_failed_render_not_stored(self):
+        self.render_pdf.return_value = b""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+        self.assertFalse(self.certificate.pdfs.exists())
+
+
+class AsyncCarrierCertificateTestCase(CertificatePDFTestCaseMixin):
+    certificate_kind = models.CERTIFICATE_NO_WORKERS
+
+    def test_get_async(self):
+        response = self.client.get(self.url, {"async": 1})
+        self.assertEqual(response.status_code, 202)
+        job_json = response.json()["job"]
+        self.assertEqual(job_json["status"], "pending")
+        self.assertEqual(response["Location"], job_json["url"])
+        self.render_pdf.assert_not_called()
+
+        # Deduplicated
+        response = self.client.get(self.url, {"async": 1})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["job"]["id"], job_json["id"])
+        self.assertEqual(models.CarrierCertificatePDFJob.objects.count(), 1)
+
+        job = certificates.claim_job()
+        self.assertEqual(job.pk, job_json["id"])
+        response = self.client.get(job_json["url"])
+        self.assertEqual(response.json()["job"]["status"], "running")
+        # Already started
+        self.assertIsNone(certificates.claim_job())
+
+        certificates.run_job(job)
+        response = self.client.get(job_json["url"])
+        self.assertEqual(response.status_code, 200)
+        job_json = response.json()["job"]
+        self.assertEqual(job_json["status"], "done")
+        self.assertTrue(job_json["pdf_url"].endswith(self.url))
+
+        # Served from the cache, the PDF is loaded only once
+        with mock.patch.object(certificates, "get_pdf") as get_pdf:
+            response = self.client.get(self.url, {"async": 1})
+        get_pdf.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4")
+        self.assertEqual(self.render_pdf.call_count, 1)
+
+        stats = certificates.get_job_stats()
+        self.assertEqual(stats["pending"], 0)
+        self.assertEqual(stats["done"], 1)
+        self.assertIsNotNone(stats["render_duration_max"])
+
+    def test_get_not_async(self):
+        response = self.client.get(self.url, {"async": 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4")
+
+    def test_purge_jobs(self):
+        job = certificates.enqueue(self.certificate)
+        certificates.run_job(certificates.claim_job())
+        certificates.purge_jobs()
+        self.assertTrue(models.CarrierCertificatePDFJob.objects.exists())
+
+        models.CarrierCertificatePDFJob.objects.filter(pk=job.pk).update(
+            finished_at=timezone.now() - datetime.timedelta(days=2)
+        )
+        certificates.purge_jobs()
+        self.assertFalse(models.CarrierCertificatePDFJob.objects.exists())
+
+    def test_get_async_failed(self):
+        self.render_pdf.side_effect = core_pdf.PDFRenderError("Browser crashed")
+        response = self.client.get(self.url, {"async": 1})
+        job_url = response.json()["job"]["url"]
+        certificates.run_job(certificates.claim_job())
+
+        response = self.client.get(job_url)
+        self.assertEqual(response.json()["job"]["status"], "failed")
+        # Enqueued again
+        response = self.client.get(self.url, {"async": 1})
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(response.json()["job"]["url"], job_url)
+
+    def test_get_async_queue_full(self):
+        with self.settings(CARRIERS_CERTIFICATE_PDF_QUEUE_SIZE=1):
+            other_certificate = factories.CarrierCertificateFactory()
+            certificates.enqueue(other_certificate)
+            response = self.client.get(self.url, {"async": 1})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "10")
+        self.render_pdf.assert_not_called()
+
+
+class ExportCarrierCertificatesTestCase(CertificatePDFTestCaseMixin):
+    certificate_kind = models.CERTIFICATE_NO_WORKERS
+
+    def setUp(self):
+        super().setUp()
+        # The certificate of the mixin
+        self.certificate_35 = self.certificate
+        models.Carrier.objects.filter(pk=self.carrier.pk).update(departement="35")
+        self.certificate_44 = factories.CarrierCertificateFactory(
+            carrier__departement="44", kind=models.CERTIFICATE_WORKERS
+        )
+        # Not confirmed
+        factories.CarrierCertificateFactory(
+            carrier__departement="44", confirmed_at=None
+        )
+        fd, self.output = tempfile.mkstemp(suffix=".zip")
+        os.close(fd)
+        self.addCleanup(os.remove, self.output)
+
+    def export(self, **options):
+        call_command(
+            "export_certificates",
+            self.output,
+            processes=1,
+            stdout=io.StringIO(),
+            **options
+        )
+        with zipfile.ZipFile(self.output) as archive:
+            return archive.namelist()
+
+    def test_export(self):
+        names = self.export()
+        self.assertEqual(
+            names,
+            [
+                "35/" + certificates.get_pdf_filename(self.certificate_35),
+                "44/" + certificates.get_pdf_filename(self.certificate_44),
+            ],
+        )
+        # Stored in the cache
+        self.assertTrue(self.certificate_35.pdfs.exists())
+        self.export()
+        self.assertEqual(self.render_pdf.call_count, 2)
+
+    def test_export_previous_certificate(self):
+        previous_certificate = self.certificate_35
+        self.certificate_35 = factories.CarrierCertificateFactory(carrier=self.carrier)
+        self.assertEqual(len(self.export(departement=["35"])), 2)
+        # Only the PDF of the latest certificate is stored
+        self.assertFalse(previous_certificate.pdfs.exists())
+        self.assertTrue(self.certificate_35.pdfs.exists())
+
+    def test_export_filters(self):
+        self.assertEqual(len(self.export(departement=["44"])), 1)
+        self.assertEqual(len(self.export(kind=models.CERTIFICATE_NO_WORKERS)), 1)
+        self.assertEqual(len(self.export(since="2000-01-01", until="2000-12-31")), 0)
+
+
+class WarmQRCodesTestCase(TestCase):
+    @override_settings(QR_CODE_CACHE="default")
+    def test_warm_qr_codes(self):
+        certificate = factories.CarrierCertificateFactory()
+        # Not confirmed
+        factories.CarrierCertificateFactory(confirmed_at=None)
+        core_pdf.clear_qr_code_cache()
+        self.addCleanup(core_pdf.clear_qr_code_cache)
+        self.addCleanup(caches["default"].clear)
+
+        with mock.patch.object(
+            core_pdf, "make_qr_code", return_value="<svg/>"
+        ) as make_qr_code:
+            stdout = io.StringIO()
+            call_command("warm_qr_codes", stdout=stdout)
+            self.assertIn("QR codes warmed: 1", stdout.getvalue())
+            make_qr_code.assert_called_once_with(
+                certificates.get_qr_code_data(certificate.carrier), 2, 7
+            )
+            # Rendered by another process
+            core_pdf.clear_qr_code_cache()
+            certificates.render_html(certificate)
+            self.assertEqual(make_qr_code.call_count, 1)
+
+    @override_settings(QR_CODE_CACHE="")
+    def test_warm_qr_codes_without_cache(self):
+        factories.CarrierCertificateFactory()
+        stderr = io.StringIO()
+        with mock.patch.object(core_pdf, "make_qr_code") as make_qr_code:
+            with self.assertRaises(SystemExit) as cm:
+                call_command("warm_qr_codes", stderr=stderr)
+        self.assertEqual(cm.exception.code, 1)
+        self.assertIn("QR_CODE_CACHE isn't set", stderr.getvalue())
+        make_qr_code.assert_not_called()
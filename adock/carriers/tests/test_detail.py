@@ -7,7 +7,7 @@ from django.urls import reverse
 from adock.accounts.test import AuthTestCase
 
 from . import test as carriers_test
-from .. import factories, models, validators
+from .. import documents, factories, models, tokens, validators, views
 
 PHONE = "+33240424546"
 PHONE_DISPLAY = "02 40 42 45 46"
@@ -73,13 +73,52 @@ class CarrierDetailTestCase(carriers_test.CarrierTestCaseMixin):
             )
             factories.CarrierFactory(siret=siret)
 
+        # Another company
+        factories.CarrierFactory(siret="98765432100012")
+
         response = self.client.get(self.carrier_detail_url)
         carrier_data = response.json()["carrier"]
         self.assertEqual(len(carrier_data["other_facilities"]), 3)
         self.assertIn("siret", carrier_data["other_facilities"][0])
+        self.assertEqual(carrier_data["other_facilities_count"], 3)
+        self.assertIsNone(carrier_data["other_facilities_next"])
+
+    def test_get_other_facilities_paginated(self):
+        siren = self.carrier.get_siren()
+        sirets = ["{siren}{i:05}".format(siren=siren, i=i) for i in range(5)]
+        for siret in sirets:
+            factories.CarrierFactory(siret=siret)
+
+        with self.settings(CARRIERS_OTHER_FACILITIES_LIMIT=2):
+            documents.carrier_document_refresh()
+            response = self.client.get(self.carrier_detail_url)
+        carrier_data = response.json()["carrier"]
+        self.assertEqual(
+            [c["siret"] for c in carrier_data["other_facilities"]], sirets[:2]
+        )
+        self.assertEqual(carrier_data["other_facilities_count"], 5)
+
+        url = reverse(
+            "carriers_other_facilities", kwargs={"carrier_siret": self.carrier.siret}
+        )
+        response = self.client.get(
+            url, {"cursor": carrier_data["other_facilities_next"], "limit": 2}
+        )
+        data = response.json()
+        self.assertEqual([c["siret"] for c in data["other_facilities"]], sirets[2:4])
+        self.assertEqual(data["count"], 5)
+
+        response = self.client.get(url, {"cursor": data["next"], "limit": 2})
+        data = response.json()
+        self.assertEqual([c["siret"] for c in data["other_facilities"]], sirets[4:])
+        self.assertIsNone(data["next"])
+
+        response = self.client.get(url, {"cursor": "foo"})
+        self.assertEqual(response.status_code, 400)
 
     def test_latest_certificate(self):
         certificate = factories.CarrierCertificateFactory(carrier=self.carrier)
+        documents.carrier_document_refresh()
         response = self.client.get(self.carrier_detail_url)
         carrier_data = response.json()["carrier"]
         self.assertEqual(
@@ -87,6 +126,187 @@ class CarrierDetailTestCase(carriers_test.CarrierTestCaseMixin):
             certificate.get_kind_display(),
         )
 
+    def test_latest_certificate_same_date(self):
+        certificate = factories.CarrierCertificateFactory(carrier=self.carrier)
+        other_certificate = factories.CarrierCertificateFactory(carrier=self.carrier)
+        # created_at is set on creation
+        models.CarrierCertificate.objects.update(created_at=certificate.created_at)
+        carrier = documents.get_carrier_detail_queryset().get(pk=self.carrier.pk)
+        self.assertEqual(carrier.latest_certificate_id, other_certificate.pk)
+        self.assertEqual(self.carrier.get_latest_certificate(), other_certificate)
+
+    def test_get_num_queries(self):
+        factories.CarrierCertificateFactory(carrier=self.carrier)
+        factories.CarrierFactory(
+            siret=self.carrier.siret[: validators.SIREN_LENGTH] + "00099"
+        )
+        # Not refreshed (as after update-carrier.sql), the carrier with its
+        # annotations and the other facilities without any write
+        models.Carrier.objects.update(document=None)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.carrier_detail_url)
+        carrier_data = response.json()["carrier"]
+        self.assertEqual(len(carrier_data["other_facilities"]), 1)
+        self.assertIsNotNone(carrier_data["latest_certificate"])
+        self.carrier.refresh_from_db()
+        self.assertIsNone(self.carrier.document)
+
+        # Then only the carrier with its stored document
+        documents.carrier_document_refresh()
+        with self.assertNumQueries(1):
+            response = self.client.get(self.carrier_detail_url)
+        self.assertEqual(response.json()["carrier"], carrier_data)
+
+    def test_document_refresh(self):
+        other_carrier = factories.CarrierFactory(
+            siret=self.carrier.siret[: validators.SIREN_LENGTH] + "00099",
+            with_editable=True,
+        )
+        factories.CarrierFactory(siret="98765432100012", with_editable=True)
+        self.assertEqual(documents.carrier_document_refresh(), 3)
+
+        self.carrier.refresh_from_db()
+        document = self.carrier.document
+        self.assertEqual(document["siret"], self.carrier.siret)
+        self.assertNotIn("user_is_owner", document)
+        # The count is added on read
+        self.assertNotIn("other_facilities_count", document)
+        self.assertEqual(document["other_facilities"][0]["siret"], other_carrier.siret)
+        # Same document than the one built on the fly
+        response = self.client.get(self.carrier_detail_url)
+        models.Carrier.objects.update(document=None)
+        self.assertEqual(
+            self.client.get(self.carrier_detail_url).json(), response.json()
+        )
+
+        # Not refreshed until the confirmation
+        certificate = factories.CarrierCertificateFactory(
+            carrier=self.carrier, confirmed_at=None
+        )
+        response = self.client.get(self.carrier_detail_url)
+        self.assertIsNone(response.json()["carrier"]["latest_certificate"])
+        response = self.client.get(
+            reverse(
+                "carriers_certificate_confirm",
+                kwargs={
+                    "certificate_id": certificate.pk,
+                    "token": tokens.certificate_token_generator.make_token(certificate),
+                },
+            )
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.carrier_detail_url)
+        self.assertIsNotNone(response.json()["carrier"]["latest_certificate"])
+
+    def test_document_refresh_on_save(self):
+        siren = self.carrier.get_siren()
+        with self.settings(CARRIERS_OTHER_FACILITIES_LIMIT=1):
+            # The documents list 2 other facilities
+            carriers = [
+                factories.CarrierFactory(
+                    siret="{siren}{i:05}".format(siren=siren, i=i), with_editable=True
+                )
+                for i in range(4)
+            ]
+            documents.carrier_document_refresh()
+            versions = dict(
+                models.Carrier.objects.values_list("siret", "document_version")
+            )
+
+            # Only listed by the first two
+            listed_carrier = carriers[2]
+            listed_carrier.enseigne = "TRANSPORTS MARTIN"
+            listed_carrier.save()
+            changed = set(
+                siret
+                for siret, version in models.Carrier.objects.values_list(
+                    "siret", "document_version"
+                )
+                if versions[siret] != version
+            )
+            self.assertEqual(
+                changed, {listed_carrier.siret, carriers[0].siret, carriers[1].siret}
+            )
+            versions = dict(
+                models.Carrier.objects.values_list("siret", "document_version")
+            )
+
+            # Listed by none
+            carriers[3].enseigne = "TRANSPORTS DUPONT"
+            carriers[3].save()
+            changed = set(
+                siret
+                for siret, version in models.Carrier.objects.values_list(
+                    "siret", "document_version"
+                )
+                if versions[siret] != version
+            )
+            self.assertEqual(changed, {carriers[3].siret})
+            versions = dict(
+                models.Carrier.objects.values_list("siret", "document_version")
+            )
+
+            # Not listed in the summary of the other facilities
+            listed_carrier.editable.description = "Transport de fret"
+            listed_carrier.editable.save()
+            listed_carrier.save()
+            changed = set(
+                siret
+                for siret, version in models.Carrier.objects.values_list(
+                    "siret", "document_version"
+                )
+                if versions[siret] != version
+            )
+            self.assertEqual(changed, {listed_carrier.siret})
+
+            # Same documents than a full refresh
+            documents_by_siret = dict(
+                models.Carrier.objects.values_list("siret", "document")
+            )
+            documents.carrier_document_refresh()
+            self.assertEqual(
+                dict(models.Carrier.objects.values_list("siret", "document")),
+                documents_by_siret,
+            )
+
+    def test_get_etag(self):
+        response = self.client.get(self.carrier_detail_url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertIn("Authorization", response["Vary"])
+
+        # Only the carrier is loaded to compare the version
+        with self.assertNumQueries(1):
+            response = self.client.get(self.carrier_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        # A new certificate changes the version (on confirmation)
+        factories.CarrierCertificateFactory(carrier=self.carrier)
+        documents.carrier_document_refresh()
+        response = self.client.get(self.carrier_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        etag = response["ETag"]
+
+        # The changes of the other carriers don't
+        factories.CarrierFactory(siret="98765432100012", with_editable=True)
+        response = self.client.get(self.carrier_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Such as the changes of the carrier
+        self.carrier.enseigne = "TRANSPORTS MARTIN"
+        self.carrier.save()
+        response = self.client.get(self.carrier_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        etag = response["ETag"]
+
+        # Same version when the document is built on the fly
+        models.Carrier.objects.update(document=None)
+        response = self.client.get(self.carrier_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
     def test_completeness(self):
         # The default factory sets all fields
         self.assertEqual(
@@ -246,6 +466,28 @@ class CarrierDetailPostTestCase(AuthTestCase, carriers_test.CarrierTestCaseMixin
             "Adresse e-mail : foo@example.com, Téléphone : +33240424546, Aire de travail : DEPARTEMENT",
         )
 
+    def test_get_owner_num_queries(self):
+        models.CarrierUser.objects.create(carrier=self.carrier, user=self.user)
+        documents.carrier_document_refresh()
+        # The user of the token and the carrier with its document
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                self.carrier_detail_url, HTTP_AUTHORIZATION=self.http_authorization
+            )
+        self.assertEqual(response.json()["carrier"]["user_is_owner"], True)
+
+    def test_get_etag_owner(self):
+        response = self.client.get(self.carrier_detail_url)
+        etag = response["ETag"]
+        models.CarrierUser.objects.create(carrier=self.carrier, user=self.user)
+        response = self.client.get(
+            self.carrier_detail_url,
+            HTTP_IF_NONE_MATCH=etag,
+            HTTP_AUTHORIZATION=self.http_authorization,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["carrier"]["user_is_owner"], True)
+
     def test_post_response(self):
         NEW_PHONE = "+33240424546"
         NEW_EMAIL = "foo@example.com"
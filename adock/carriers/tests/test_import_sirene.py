@@ -0,0 +1,69 @@
+import csv
+import gzip
+import io
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from .. import models
+
+
+def get_sirene_columns():
+    with open(os.path.join(settings.BASE_DIR, "scripts", "create-sirene.sql")) as f:
+        create_table = f.read().split("create table sirene (")[1].split(");")[0]
+    return re.findall(r"^  (\w+) ", create_table, re.MULTILINE)
+
+
+class ImportSireneTestCase(TestCase):
+    def setUp(self):
+        self.datafiles_root = tempfile.mkdtemp()
+        self.gzip_filename = os.path.join(self.datafiles_root, "sirene.csv.gz")
+        self.addCleanup(os.rmdir, self.datafiles_root)
+        self.addCleanup(os.remove, self.gzip_filename)
+
+        columns = get_sirene_columns()
+        with gzip.open(self.gzip_filename, "wt", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for siret in ("80005226884728", "12345678912345"):
+                row = dict.fromkeys(columns, "")
+                row.update(
+                    siren=siret[:9],
+                    nic=siret[9:],
+                    siret=siret,
+                    libelleVoieEtablissement="DE LA GARE, ÉTAGE 2",
+                )
+                writer.writerow(row[column] for column in columns)
+
+        self.feed = models.CarrierFeed.objects.create(
+            source="sirene",
+            title="Sirene",
+            url="http://example.com",
+            filename="sirene.csv.gz",
+        )
+
+    def test_import(self):
+        stdout = io.StringIO()
+        with override_settings(DATAFILES_ROOT=self.datafiles_root):
+            call_command("import_sirene", stdout=stdout)
+
+        self.assertIn("2 rows copied", stdout.getvalue())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT siret, libelleVoieEtablissement, is_deleted FROM sirene "
+                "ORDER BY siret"
+            )
+            self.assertEqual(
+                cursor.fetchall(),
+                [
+                    ("12345678912345", "DE LA GARE, ÉTAGE 2", False),
+                    ("80005226884728", "DE LA GARE, ÉTAGE 2", False),
+                ],
+            )
+        self.feed.refresh_from_db()
+        self.assertIsNotNone(self.feed.applied_at)
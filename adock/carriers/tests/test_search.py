@@ -1,15 +1,19 @@
+from django.db import connection
 from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
 from . import test
 from .. import factories, models
+from .. import search_cache as carriers_search_cache
 
 
 class CarrierSearchTestCase(TestCase):
     def setUp(self):
         super().setUp()
         self.search_url = reverse("carriers_search")
+        # The generation isn't rolled back between tests
+        carriers_search_cache.search_cache.clear()
 
     def get_carriers(self, params=None):
         """Helper"""
@@ -153,6 +157,61 @@ class CarrierSearchQueryTestCase(CarrierSearchTestCase):
         self.assertEqual(data["limit"], 1)
         self.assertEqual(len(data["carriers"]), 1)
 
+    def test_search_with_cursor(self):
+        # Sorted by -completeness then enseigne and SIRET
+        carriers = [factories.CarrierFactory(enseigne="FOO %d" % i) for i in range(5)]
+        carriers.append(factories.CarrierFactory(enseigne="FOO 9", with_editable=True))
+        expected_sirets = [carriers[-1].siret] + [c.siret for c in carriers[:-1]]
+
+        sirets = []
+        params = {"q": "Foo", "limit": 2}
+        for _ in range(3):
+            response = self.client.get(self.search_url, params)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual(len(data["carriers"]), 2)
+            sirets.extend(carrier["siret"] for carrier in data["carriers"])
+            params["cursor"] = data.get("next")
+
+        self.assertListEqual(sirets, expected_sirets)
+        # Last page
+        self.assertIsNone(params["cursor"])
+
+    def test_search_with_cursor_and_departement(self):
+        factories.CarrierFactory.create_batch(
+            3,
+            enseigne="FOO",
+            with_editable={"working_area": models.WORKING_AREA_FRANCE},
+        )
+        response = self.client.get(
+            self.search_url, {"q": "Foo", "limit": 2, "departement-depart": "35"}
+        )
+        data = response.json()
+        self.assertEqual(len(data["carriers"]), 2)
+        self.assertIn("next", data)
+
+        response = self.client.get(
+            self.search_url,
+            {
+                "q": "Foo",
+                "limit": 2,
+                "departement-depart": "35",
+                "cursor": data["next"],
+            },
+        )
+        data = response.json()
+        self.assertEqual(len(data["carriers"]), 1)
+        self.assertNotIn("next", data)
+
+    def test_search_with_invalid_cursor(self):
+        for cursor in ("A", "W10=", "WyJBIiwgIkIiLCAiQyIsICJEIl0="):
+            response = self.client.get(self.search_url, {"q": "Foo", "cursor": cursor})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                response.json()["message"],
+                "Le curseur « %s » n'est pas valide." % cursor,
+            )
+
     def test_search_with_invalid_limit(self):
         factories.CarrierFactory.create_batch(3, enseigne="FOO")
         response = self.client.get(self.search_url, {"q": "Foo", "limit": "A"})
@@ -363,3 +422,447 @@ class CarrierSearchSpecialitiesTestCase(CarrierSearchTestCase):
         """The transport should provide the both."""
         carriers = self.get_carriers({"specialities[]": ["LOT", "ANIMAL"]})
         self.assertEqual(len(carriers), 1)
+
+    def test_invalid_speciality(self):
+        response = self.client.get(self.search_url, {"specialities[]": ["LOT", "FOO"]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["message"], "La spécialité « FOO » n'est pas valide."
+        )
+
+    def test_specialities_mask(self):
+        carrier = factories.CarrierFactory(
+            with_editable={"specialities": ["ANIMAL", "VRAC_SOLIDE"]}
+        )
+        self.assertEqual(carrier.editable.specialities_mask, 1 | 1 << 16)
+        self.assertEqual(
+            models.CarrierSearch.objects.get(siret=carrier.siret).specialities_mask,
+            1 | 1 << 16,
+        )
+
+        carrier.editable.specialities = ["AUTRE"]
+        carrier.editable.save(update_fields=["specialities"])
+        carrier.editable.refresh_from_db()
+        self.assertEqual(carrier.editable.specialities_mask, 2)
+
+    def test_specialities_mask_unknown_speciality(self):
+        # Removed from the choices but still stored
+        carrier = factories.CarrierFactory(
+            with_editable={"specialities": ["ANIMAL", "OLD_SPECIALITY"]}
+        )
+        self.assertEqual(carrier.editable.specialities_mask, 1)
+
+    def test_specialities_mask_duplicated_speciality(self):
+        carrier = factories.CarrierFactory(
+            with_editable={"specialities": ["AUTRE", "AUTRE"]}
+        )
+        self.assertEqual(carrier.editable.specialities_mask, 2)
+
+
+class CarrierSearchTableTestCase(TestCase):
+    def test_refresh_on_save(self):
+        carrier = factories.CarrierFactory(
+            with_editable={"working_area": models.WORKING_AREA_FRANCE}
+        )
+        carrier_search = models.CarrierSearch.objects.get(siret=carrier.siret)
+        self.assertEqual(carrier_search.working_area, models.WORKING_AREA_FRANCE)
+        self.assertEqual(
+            carrier_search.working_area_rank, models.WORKING_AREA_RANK_FRANCE
+        )
+        self.assertEqual(carrier_search.completeness, carrier.completeness)
+        self.assertTrue(carrier_search.has_lti)
+        self.assertFalse(carrier_search.has_lc)
+
+        carrier.deleted_at = timezone.now()
+        carrier.save()
+        self.assertFalse(models.CarrierSearch.objects.exists())
+
+    def test_rebuild(self):
+        carrier = factories.CarrierFactory()
+        models.CarrierSearch.objects.all().delete()
+        models.carrier_search_refresh()
+        carrier_search = models.CarrierSearch.objects.get()
+        self.assertEqual(carrier_search.siret, carrier.siret)
+        self.assertEqual(
+            carrier_search.working_area_rank, models.WORKING_AREA_RANK_UNDEFINED
+        )
+
+
+class CarrierSearchNearTestCase(CarrierSearchTestCase):
+    def setUp(self):
+        super().setUp()
+        factories.CarrierFactory(
+            raison_sociale="NANTES",
+            code_postal="44000",
+            latitude=47.218,
+            longitude=-1.553,
+            lc_numero="2017 84 0000285",
+        )
+        factories.CarrierFactory(
+            raison_sociale="SAINT-HERBLAIN",
+            code_postal="44800",
+            latitude=47.212,
+            longitude=-1.65,
+        )
+        factories.CarrierFactory(
+            raison_sociale="RENNES",
+            code_postal="35000",
+            latitude=48.117,
+            longitude=-1.677,
+        )
+        factories.CarrierFactory(raison_sociale="NOWHERE")
+
+    def test_search_near_position(self):
+        carriers = self.get_carriers({"near": "47.22,-1.55"})
+        self.assertListEqual(
+            [carrier["raison_sociale"] for carrier in carriers],
+            ["NANTES", "SAINT-HERBLAIN"],
+        )
+
+        carriers = self.get_carriers({"near": "47.22,-1.66", "radius": "150"})
+        self.assertListEqual(
+            [carrier["raison_sociale"] for carrier in carriers],
+            ["SAINT-HERBLAIN", "NANTES", "RENNES"],
+        )
+
+    def test_search_near_zip_code(self):
+        carriers = self.get_carriers({"near": "35000", "radius": "5"})
+        self.assertEqual(len(carriers), 1)
+        self.assertEqual(carriers[0]["raison_sociale"], "RENNES")
+
+        response = self.client.get(self.search_url, {"near": "75001"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["message"],
+            "Aucun transporteur n'est localisé dans le code postal « 75001 ».",
+        )
+
+    def test_search_near_with_filters(self):
+        carriers = self.get_carriers({"near": "47.22,-1.55", "licence-types[]": ["lc"]})
+        self.assertEqual(len(carriers), 1)
+        self.assertEqual(carriers[0]["raison_sociale"], "NANTES")
+
+    def test_search_near_with_cursor(self):
+        response = self.client.get(
+            self.search_url, {"near": "47.22,-1.66", "radius": "150", "limit": 2}
+        )
+        data = response.json()
+        self.assertEqual(len(data["carriers"]), 2)
+        carriers = self.get_carriers(
+            {
+                "near": "47.22,-1.66",
+                "radius": "150",
+                "limit": 2,
+                "cursor": data["next"],
+            }
+        )
+        self.assertEqual(len(carriers), 1)
+        self.assertEqual(carriers[0]["raison_sociale"], "RENNES")
+
+    def test_search_near_invalid(self):
+        for params, message in (
+            ({"near": "foo"}, "La position « foo » n'est pas valide."),
+            ({"near": "91,2"}, "La position « 91,2 » n'est pas valide."),
+            (
+                {"near": "47,2", "radius": "A"},
+                "Le rayon de recherche « A » n'est pas un nombre valide.",
+            ),
+            (
+                {"near": "47,2", "radius": "1000"},
+                "Le rayon de recherche doit être compris entre 0 et 200 km.",
+            ),
+        ):
+            response = self.client.get(self.search_url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()["message"], message)
+
+
+class CarrierSearchCacheTestCase(CarrierSearchTestCase):
+    def test_cache_hit(self):
+        factories.CarrierFactory(enseigne="TRANSPORTS ÉCLAIR")
+        carriers = self.get_carriers({"q": "eclair"})
+        self.assertEqual(len(carriers), 1)
+
+        # Same normalized criteria, only the generation is read
+        with self.assertNumQueries(1):
+            carriers = self.get_carriers({"q": "Eclair"})
+        self.assertEqual(len(carriers), 1)
+
+        stats = carriers_search_cache.search_cache.get_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_cache_invalidation(self):
+        carrier = factories.CarrierFactory(enseigne="TRANSPORTS ÉCLAIR")
+        carriers = self.get_carriers({"q": "eclair"})
+        self.assertEqual(len(carriers), 1)
+
+        carrier.deleted_at = timezone.now()
+        carrier.save()
+        carriers = self.get_carriers({"q": "eclair"})
+        self.assertEqual(len(carriers), 0)
+        self.assertEqual(carriers_search_cache.search_cache.get_stats()["hits"], 0)
+
+    def test_cache_eviction(self):
+        search_cache = carriers_search_cache.SearchCache(2)
+        search_cache.set("a", 1, "A")
+        search_cache.set("b", 1, "B")
+        self.assertEqual(search_cache.get("a", 1), "A")
+        # b is the least recently used
+        search_cache.set("c", 1, "C")
+        self.assertIsNone(search_cache.get("b", 1))
+        self.assertEqual(search_cache.get("a", 1), "A")
+        # Previous generation
+        self.assertIsNone(search_cache.get("c", 2))
+
+        stats = search_cache.get_stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 2)
+
+
+class CarrierSuggestTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.suggest_url = reverse("carriers_suggest")
+
+    def get_carriers(self, params=None):
+        """Helper"""
+        response = self.client.get(self.suggest_url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["carriers"]
+
+    def test_empty(self):
+        factories.CarrierFactory(enseigne="TRANSPORTS")
+        self.assertListEqual(self.get_carriers(), [])
+        self.assertListEqual(self.get_carriers({"q": " ., "}), [])
+
+    def test_suggest_on_enseigne(self):
+        factories.CarrierFactory(enseigne="TRANSPORTS ÉCLAIR", ville="NANTES")
+        factories.CarrierFactory(enseigne="TRANSPORTS DUPONT")
+        factories.CarrierFactory(enseigne="DUPONT TRANSPORTS")
+
+        carriers = self.get_carriers({"q": "transports"})
+        self.assertListEqual(
+            [carrier["enseigne"] for carrier in carriers],
+            ["TRANSPORTS DUPONT", "TRANSPORTS ÉCLAIR"],
+        )
+        self.assertCountEqual(carriers[0].keys(), ["siret", "enseigne", "ville"])
+
+        # Accents, dots and repeated spaces are ignored
+        carriers = self.get_carriers({"q": "Trans.ports  écl"})
+        self.assertEqual(len(carriers), 1)
+        self.assertEqual(carriers[0]["ville"], "NANTES")
+
+        # LIKE patterns are escaped
+        self.assertListEqual(self.get_carriers({"q": "TRANS%"}), [])
+
+    def test_suggest_on_siret(self):
+        factories.CarrierFactory(siret=test.VALID_SIRET)
+        carriers = self.get_carriers({"q": test.VALID_SIRET_WITH_SPACES[0:8]})
+        self.assertEqual(len(carriers), 1)
+        self.assertEqual(carriers[0]["siret"], test.VALID_SIRET)
+
+    @override_settings(CARRIERS_SUGGEST_LIMIT=2)
+    def test_suggest_limit(self):
+        for _ in range(3):
+            factories.CarrierFactory(enseigne="TRANSPORTS")
+
+        with self.assertNumQueries(1):
+            carriers = self.get_carriers({"q": "trans"})
+        self.assertEqual(len(carriers), 2)
+        self.assertLess(carriers[0]["siret"], carriers[1]["siret"])
+
+
+class CarrierSearchFacetsTestCase(CarrierSearchTestCase):
+    def setUp(self):
+        super().setUp()
+        factories.CarrierFactory(
+            raison_sociale="TRANSPORTS A",
+            departement="44",
+            lc_numero="2017 84 0000285",
+            lti_numero="",
+            with_editable={
+                "working_area": models.WORKING_AREA_DEPARTEMENT,
+                "working_area_departements": ["44"],
+                "specialities": ["LOT", "ANIMAL"],
+            },
+        )
+        factories.CarrierFactory(
+            raison_sociale="TRANSPORTS B",
+            departement="44",
+            lc_numero="",
+            lti_numero="2018 84 0000392",
+            with_editable={
+                "working_area": models.WORKING_AREA_FRANCE,
+                "specialities": ["LOT"],
+            },
+        )
+        factories.CarrierFactory(
+            raison_sociale="TRANSPORTS C",
+            departement="35",
+            lc_numero="",
+            lti_numero="2018 84 0000393",
+            with_editable={
+                "working_area": models.WORKING_AREA_FRANCE,
+                "specialities": None,
+            },
+        )
+
+    def test_no_facets(self):
+        response = self.client.get(self.search_url)
+        self.assertNotIn("facets", response.json())
+
+    def test_facets(self):
+        # Only one extra query
+        with self.assertNumQueries(3):
+            response = self.client.get(self.search_url, {"facets": "1", "limit": 1})
+        data = response.json()
+        self.assertEqual(len(data["carriers"]), 1)
+        self.assertDictEqual(
+            data["facets"],
+            {
+                "total": 3,
+                "departements": {"35": 1, "44": 2},
+                "working_areas": {
+                    models.WORKING_AREA_DEPARTEMENT: 1,
+                    models.WORKING_AREA_FRANCE: 2,
+                },
+                "license_types": {"lc": 1, "lti": 2},
+                "specialities": {"ANIMAL": 1, "LOT": 2},
+            },
+        )
+
+    def test_facets_with_filters(self):
+        response = self.client.get(
+            self.search_url,
+            {"facets": "1", "q": "transports", "specialities[]": ["LOT"]},
+        )
+        facets = response.json()["facets"]
+        self.assertEqual(facets["total"], 2)
+        self.assertDictEqual(facets["departements"], {"44": 2})
+        self.assertDictEqual(facets["license_types"], {"lc": 1, "lti": 1})
+
+        response = self.client.get(self.search_url, {"facets": "1", "q": "nothing"})
+        self.assertDictEqual(
+            response.json()["facets"],
+            {
+                "total": 0,
+                "departements": {},
+                "working_areas": {},
+                "license_types": {"lc": 0, "lti": 0},
+                "specialities": {},
+            },
+        )
+
+
+class CarrierSearchFuzzyTestCase(CarrierSearchTestCase):
+    def setUp(self):
+        super().setUp()
+        factories.CarrierFactory(enseigne="TRANSPORTS DUPONT ET FILS")
+        factories.CarrierFactory(enseigne="TRANSPORTS DUPONT")
+        factories.CarrierFactory(enseigne="TRANSPORTS MARTIN")
+
+    def test_exact_search(self):
+        carriers = self.get_carriers({"q": "transports dupomt"})
+        self.assertEqual(len(carriers), 0)
+
+    def test_fuzzy_search(self):
+        carriers = self.get_carriers({"q": "transports dupomt", "fuzzy": "1"})
+        # Ordered by similarity
+        self.assertListEqual(
+            [carrier["enseigne"] for carrier in carriers],
+            ["TRANSPORTS DUPONT", "TRANSPORTS DUPONT ET FILS"],
+        )
+
+        carriers = self.get_carriers({"q": "transports dupömt.", "fuzzy": "1"})
+        self.assertEqual(len(carriers), 2)
+
+    @override_settings(CARRIERS_SEARCH_SIMILARITY_THRESHOLD=0.4)
+    def test_fuzzy_threshold(self):
+        carriers = self.get_carriers({"q": "transports dupomt", "fuzzy": "1"})
+        self.assertEqual(len(carriers), 3)
+        self.assertEqual(carriers[2]["enseigne"], "TRANSPORTS MARTIN")
+
+    def test_fuzzy_session_unchanged(self):
+        self.get_carriers({"q": "transports dupomt", "fuzzy": "1"})
+        # The connection could be reused by other requests
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW pg_trgm.similarity_threshold")
+            self.assertEqual(cursor.fetchone()[0], "0.3")
+
+    def test_fuzzy_search_with_cursor(self):
+        response = self.client.get(
+            self.search_url, {"q": "transports dupomt", "fuzzy": "1", "limit": 1}
+        )
+        data = response.json()
+        self.assertEqual(data["carriers"][0]["enseigne"], "TRANSPORTS DUPONT")
+        carriers = self.get_carriers(
+            {"q": "transports dupomt", "fuzzy": "1", "limit": 1, "cursor": data["next"]}
+        )
+        self.assertEqual(len(carriers), 1)
+        self.assertEqual(carriers[0]["enseigne"], "TRANSPORTS DUPONT ET FILS")
+
+    def test_fuzzy_search_on_siret(self):
+        carrier = factories.CarrierFactory(siret=test.VALID_SIRET)
+        carriers = self.get_carriers({"q": test.VALID_SIRET, "fuzzy": "1"})
+        self.assertEqual(len(carriers), 1)
+        self.assertEqual(carriers[0]["siret"], carrier.siret)
+
+
+class CarrierSearchSQLJSONTestCase(CarrierSearchTestCase):
+    def setUp(self):
+        super().setUp()
+        factories.CarrierFactory(
+            enseigne="TRANSPORTS ÉCLAIR",
+            latitude=47.218,
+            longitude=-1.553,
+            with_editable={"working_area": models.WORKING_AREA_FRANCE},
+        )
+        factories.CarrierFactory(
+            enseigne='TRANSPORTS "DUPONT" \\ FILS',
+            latitude=47.212,
+            longitude=-1.65,
+            with_editable={
+                "working_area": models.WORKING_AREA_DEPARTEMENT,
+                "working_area_departements": ["44"],
+                "specialities": ["LOT"],
+            },
+        )
+        factories.CarrierFactory(enseigne="TRANSPORTS MARTIN")
+
+    def assertSamePayloads(self, params):
+        carriers_search_cache.search_cache.clear()
+        with self.settings(CARRIERS_SEARCH_SQL_JSON=False):
+            response = self.client.get(self.search_url, params)
+            self.assertEqual(response.status_code, 200)
+            expected = response.json()
+
+        carriers_search_cache.search_cache.clear()
+        with self.settings(CARRIERS_SEARCH_SQL_JSON=True):
+            response = self.client.get(self.search_url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "application/json")
+            self.assertEqual(response.json(), expected)
+
+        return expected
+
+    def test_same_payloads(self):
+        for params in (
+            {},
+            {"q": "transports"},
+            {"q": "nothing"},
+            {"q": "transports", "limit": 2},
+            {"departement-depart": "44", "limit": 1, "facets": "1"},
+            {"near": "47.22,-1.6", "limit": 1},
+            {"q": "transports martim", "fuzzy": "1", "limit": 1},
+        ):
+            self.assertSamePayloads(params)
+
+    def test_same_payloads_with_cursor(self):
+        payload = self.assertSamePayloads({"limit": 2})
+        payload = self.assertSamePayloads({"limit": 2, "cursor": payload["next"]})
+        self.assertEqual(len(payload["carriers"]), 1)
+        self.assertNotIn("next", payload)
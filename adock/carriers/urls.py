@@ -4,7 +4,14 @@ from . import views
 
 urlpatterns = [
     path("search/", views.carrier_search, name="carriers_search"),
+    path("suggest/", views.carrier_suggest, name="carriers_suggest"),
+    path("bulk/", views.carrier_bulk, name="carriers_bulk"),
     path("<str:carrier_siret>/", views.carrier_detail, name="carriers_detail"),
+    path(
+        "<str:carrier_siret>/other_facilities/",
+        views.carrier_other_facilities,
+        name="carriers_other_facilities",
+    ),
     path(
         "editable/<int:carrier_editable_id>/confirm/<str:token>/",
         views.carrier_editable_confirm,
@@ -23,6 +30,12 @@ urlpatterns = [
         name="carriers_certificate_detail_html",
         kwargs={"as_pdf": False},
     ),
+    # Render job of the asynchronous mode (?async=1) of the certificate
+    path(
+        "certificate/job/<int:job_id>/",
+        views.certificate_job_detail,
+        name="carriers_certificate_job",
+    ),
     path(
         "certificate/<int:certificate_id>/confirm/<str:token>/",
         views.certificate_confirm,
@@ -10,6 +10,7 @@ SIRET_LENGTH = SIREN_LENGTH + NIC_LENGTH
 
 RE_ONLY_DIGITS_AND_SPACES = re.compile(r"[\d ]")
 RE_ONLY_DIGITS = re.compile(r"\d")
+RE_ZIP_CODE = re.compile(r"^\d{5}$")
 SEARCH_DELETED_CHARS = ".,"
 SEARCH_Q_TRANS_TABLE = str.maketrans(dict.fromkeys(SEARCH_DELETED_CHARS))
 
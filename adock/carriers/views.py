@@ -1,26 +1,42 @@
+import base64
+import binascii
+import hashlib
+import json
+import logging
 import re
+import socket
+import unicodedata
 
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import connection, transaction
-from django.db.models import F, Q
-from django.db.models.expressions import OrderBy, RawSQL
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404, render
+from django.db.models import Avg, F, Q
+from django.db.models.expressions import RawSQL
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.utils import timezone
-from django.utils.formats import date_format
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
 from django.views.decorators.http import require_POST
 
 from ..core import pdf as core_pdf
 from ..core import views as core_views
 from ..accounts import mails as accounts_mails
 from ..accounts import views as accounts_views
+from ..outbox import backends as outbox_backends
 
+from . import certificates as carriers_certificates
+from . import documents as carriers_documents
 from . import mails as carriers_mails
 from . import models as carriers_models
+from . import search_cache as carriers_search_cache
 from . import tokens as carriers_tokens
 from . import validators as carriers_validators
 from . import serializers as carriers_serializers
 
+logger = logging.getLogger(__name__)
+
 CARRIER_LIST_FIELDS = (
     "siret",
     "raison_sociale",
@@ -33,141 +49,191 @@ CARRIER_LIST_FIELDS = (
     "lc_nombre",
 )
 
-CARRIER_DETAIL_FIELDS = (
-    "siret",
-    # get_siren is added too
-    "raison_sociale",
-    "enseigne",
-    "gestionnaire",
-    "adresse",
-    "code_postal",
-    "ville",
-    "debut_activite",
-    "code_ape",
-    "libelle_ape",
-    "numero_tva",
-    "completeness",
-    "lti_numero",
-    "lti_date_debut",
-    "lti_date_fin",
-    "lti_nombre",
-    "lc_numero",
-    "lc_date_debut",
-    "lc_date_fin",
-    "lc_nombre",
-    "objectif_co2",
-    "objectif_co2_begin",
-    "objectif_co2_end",
-    "deleted_at",
-    "sirene_exists",
-    "sirene_closed_at",
-    "longitude",
-    "latitude",
-    # is_confirmed boolean is added to indicate if editable is present
-)
 
-# From CarrierEditable
-CARRIER_DETAIL_EDITABLE_FIELDS = (
-    # "telephone" is manually added
-    "email",
-    "working_area",
-    "working_area_departements",
-    "specialities",
-    "website",
-    "description",
-)
+def get_carrier_etag(carrier, other_facilities_count):
+    """The version of the carrier detail, only changed by the changes of its
+    document (see carrier_detail) and the number of other facilities (not
+    stored)."""
+    version = "%s-%s-%s" % (
+        carrier.document_version,
+        other_facilities_count,
+        carrier.user_is_owner,
+    )
+    return hashlib.sha1(version.encode()).hexdigest()
 
-OTHER_FACILITIES_LIST_FIELDS = (
-    "code_postal",
-    "completeness",
-    "debut_activite",
-    "deleted_at",
-    "enseigne",
-    "is_siege",
-    "sirene_closed_at",
-    "siret",
-    "ville",
-)
 
+def get_carriers_as_json(carriers, order_by_list, limit=None):
+    carriers = (
+        carriers.order_by(*order_by_list)
+        .values(*CARRIER_LIST_FIELDS)
+        .annotate(working_area=F("editable__working_area"))
+    )
+    if limit:
+        return list(carriers[:limit])
+    else:
+        return list(carriers)
 
-def format_telephone(phonenumber):
-    return (
-        phonenumber
-        if isinstance(phonenumber, str)
-        else "0" + phonenumber.format_as(settings.PHONENUMBER_DEFAULT_REGION)
+
+def get_search_page_as_json(carriers, sort_keys, limit):
+    """Returns the carriers of the page and the cursor of the next page (None
+    when the page is the last one).
+
+    The sort keys are annotated to be able to build the cursor from the last
+    row of the page.
+    """
+    sort_names = ["sort_key_%d" % i for i in range(len(sort_keys))]
+    carriers = (
+        carriers.annotate(
+            **{
+                sort_name: RawSQL(sql, params)
+                for sort_name, (sql, params, _) in zip(sort_names, sort_keys)
+            }
+        )
+        .order_by(*sort_names)
+        .values(*CARRIER_LIST_FIELDS, "working_area", *sort_names)
     )
+    # One more row to know if a next page exists
+    carriers = list(carriers[: limit + 1])
+    next_cursor = None
+    if len(carriers) > limit:
+        carriers = carriers[:limit]
+        next_cursor = encode_search_cursor(
+            [carriers[-1][sort_name] for sort_name in sort_names]
+        )
+
+    for carrier in carriers:
+        for sort_name in sort_names:
+            del carrier[sort_name]
 
+    return carriers, next_cursor
 
-def get_carrier_as_json(user, carrier):
-    carrier_json = {}
 
-    for field in CARRIER_DETAIL_FIELDS:
-        carrier_json[field] = getattr(carrier, field)
-    carrier_json["siren"] = carrier.get_siren()
+class RawJSON(str):
+    """JSON already serialized (by PostgreSQL)"""
 
-    editable = carrier.editable
-    carrier_json["is_confirmed"] = bool(editable.confirmed_at)
-    carrier_json["telephone"] = format_telephone(editable.telephone)
 
-    for field in CARRIER_DETAIL_EDITABLE_FIELDS:
-        carrier_json[field] = getattr(editable, field)
+def get_search_page_as_sql_json(carriers, sort_keys, limit):
+    """Alternate path of get_search_page_as_json, the JSON of the carriers is
+    built by PostgreSQL in the same query and returned as a RawJSON string so
+    the rows aren't materialized in Python.
 
-    carrier_json["user_is_owner"] = (not user.is_anonymous) and (
-        user.carriers.filter(siret=carrier.siret).exists()
+    Returns the JSON, the number of carriers of the page and the cursor of the
+    next page.
+    """
+    sort_names = ["sort_key_%d" % i for i in range(len(sort_keys))]
+    carriers = (
+        carriers.annotate(
+            **{
+                sort_name: RawSQL(sql, params)
+                for sort_name, (sql, params, _) in zip(sort_names, sort_keys)
+            }
+        )
+        .order_by(*sort_names)
+        .values(*CARRIER_LIST_FIELDS, "working_area", *sort_names)
+    )
+    subquery, subquery_params = carriers[: limit + 1].query.sql_with_params()
+    carrier_object = "json_build_object(%s)" % ", ".join(
+        "'{field}', p.{field}".format(field=field)
+        for field in CARRIER_LIST_FIELDS + ("working_area",)
     )
+    sort_values = ", ".join("p." + sort_name for sort_name in sort_names)
+    sort_order = ", ".join("s." + sort_name for sort_name in sort_names)
 
-    # License renewal on going, we don't set the field if we don't have the
-    # information (paper process for example)
-    latest_license_renewal = carrier.get_latest_license_renewal()
-    if (
-        latest_license_renewal is not None
-        and latest_license_renewal.delivered_at is None
-    ):
-        carrier_json[
-            "license_renewal_on_going"
-        ] = latest_license_renewal.confirmed_at.date()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT
+                COALESCE(
+                    json_agg({carrier_object} ORDER BY p.rn) FILTER (WHERE p.rn <= %s),
+                    '[]'
+                )::text,
+                count(*),
+                (array_agg(json_build_array({sort_values})) FILTER (WHERE p.rn = %s))[1]
+            FROM (
+                SELECT s.*, row_number() OVER (ORDER BY {sort_order}) AS rn
+                FROM ({subquery}) s
+            ) p
+            """.format(
+                carrier_object=carrier_object,
+                sort_values=sort_values,
+                sort_order=sort_order,
+                subquery=subquery,
+            ),
+            [limit, limit] + list(subquery_params),
+        )
+        carriers_json, count, last_values = cursor.fetchone()
 
-    return carrier_json
+    next_cursor = None
+    if count > limit:
+        count = limit
+        next_cursor = encode_search_cursor(last_values)
 
+    return RawJSON(carriers_json), count, next_cursor
 
-def get_carriers_as_json(carriers, order_by_list, limit=None, with_details=False):
-    carriers = (
-        carriers.order_by(*order_by_list)
-        .values(*CARRIER_LIST_FIELDS)
-        .annotate(working_area=F("editable__working_area"))
+
+OTHER_FACILITIES_SORT_KEYS = [("siret", [], str)]
+
+
+def get_other_facilities_as_json(carrier, limit, cursor=None):
+    """Returns the other establishments of the company ordered by SIRET, their
+    total count and the cursor of the next page (None when the page is the
+    last one).
+
+    The count isn't queried when the first page contains all of them.
+    """
+    other_facilities = carriers_models.Carrier.objects.filter(
+        siren=carrier.get_siren()
+    ).exclude(pk=carrier.pk)
+
+    page = other_facilities
+    if cursor:
+        values = decode_search_cursor(cursor, OTHER_FACILITIES_SORT_KEYS)
+        page = page.filter(siret__gt=values[0])
+
+    # One more row to know if there is a next page
+    page = list(
+        page.order_by("siret").values(*carriers_documents.OTHER_FACILITIES_LIST_FIELDS)[
+            : limit + 1
+        ]
     )
-    if limit:
-        return list(carriers[:limit])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_search_cursor([page[-1]["siret"]])
+
+    if cursor or next_cursor:
+        count = other_facilities.count()
     else:
-        return list(carriers)
+        count = len(page)
 
+    return page, count, next_cursor
 
-def get_other_facilities_as_json(carrier):
-    other_facilities = (
-        carriers_models.Carrier.objects.filter(
-            siret__startswith=carrier.siret[: carriers_validators.SIREN_LENGTH]
-        )
+
+def get_other_facilities_page(carrier, other_facilities):
+    """Returns the first page of the other facilities listed in the document
+    of the carrier (see get_other_facilities_as_json), their total count is
+    only queried when there is a next page."""
+    limit = settings.CARRIERS_OTHER_FACILITIES_LIMIT
+    if len(other_facilities) <= limit:
+        return other_facilities, len(other_facilities), None
+
+    page = other_facilities[:limit]
+    count = (
+        carriers_models.Carrier.objects.filter(siren=carrier.get_siren())
         .exclude(pk=carrier.pk)
-        .values(*OTHER_FACILITIES_LIST_FIELDS)
+        .count()
     )
-    return list(other_facilities)
+    return page, count, encode_search_cursor([page[-1]["siret"]])
 
 
-def get_latest_certificate_as_json(carrier):
-    certificate = carrier.get_latest_certificate()
-    if not certificate:
-        return None
-
-    return {
-        "kind_display": certificate.get_kind_display(),
-        "created_at": certificate.created_at,
-    }
+def normalize_search_q(q):
+    # Remove ignored characters
+    return q.translate(carriers_validators.SEARCH_Q_TRANS_TABLE).upper()
 
 
 def carrier_search_q(carriers, q):
     """Filtering on enseigne, SIREN/SIRET, zip code"""
-    # Remove ignored characters
-    q = q.translate(carriers_validators.SEARCH_Q_TRANS_TABLE).upper()
+    q = normalize_search_q(q)
     if carriers_validators.RE_ONLY_DIGITS_AND_SPACES.match(q):
         # Zip code or SIREN/SIRET number so we remove useless spaces
         q = q.replace(" ", "")
@@ -213,6 +279,23 @@ def carrier_search_q(carriers, q):
     return carriers
 
 
+def carrier_search_fuzzy(carriers, q):
+    """Typo tolerant filtering on enseigne with the similarity operator of
+    pg_trgm, served by the GIN trigram index carrier_search_trgm_enseigne.
+
+    The operator uses the threshold of the server (0.3 by default) so the
+    stricter CARRIERS_SEARCH_SIMILARITY_THRESHOLD is checked on the rows found
+    by the index (the session setting is left untouched).
+    """
+    return carriers.extra(
+        where=[
+            '"carrier_search"."enseigne_unaccent" %% UNACCENT(%s)',
+            'similarity("carrier_search"."enseigne_unaccent", UNACCENT(%s)) >= %s',
+        ],
+        params=[q, q, settings.CARRIERS_SEARCH_SIMILARITY_THRESHOLD],
+    )
+
+
 class SearchException(Exception):
     def __init__(self, message, status_code=400):
         self.message = message
@@ -243,98 +326,496 @@ def carrier_search_get_limit(request):
     return limit
 
 
-def carrier_search(request):
-    """The search allows to filter on:
-       - partial enseigne or SIRET
-       - type of the license (LC heavy or LTI light)
+def get_search_sort_keys(departements, near=None, fuzzy_q=None):
+    """Returns the list of (SQL expression, params, type) used to rank the
+    results.
+
+    All the keys are ascending (completeness is negated) so the keyset
+    pagination is a simple row comparison on the same expressions. The SIRET
+    is the last key to provide a total ordering. Without departements, the
+    keys match the carrier_search_ranking index.
+
+    Around a position, the nearest carriers are returned first. In fuzzy
+    mode, the most similar enseignes are returned first.
     """
-    carriers = carriers_models.Carrier.objects.filter(
-        deleted_at=None, sirene_closed_at=None
+    if near:
+        latitude, longitude, _ = near
+        return [
+            (SEARCH_DISTANCE_SQL, (latitude, longitude), float),
+            ('"carrier_search"."siret"', (), str),
+        ]
+
+    if fuzzy_q:
+        # float8 to get back the exact value in the cursor
+        return [
+            (
+                '-similarity("carrier_search"."enseigne_unaccent", UNACCENT(%s))::float8',
+                (fuzzy_q,),
+                float,
+            ),
+            ('"carrier_search"."siret"', (), str),
+        ]
+
+    sort_keys = [('"carrier_search"."working_area_rank"', (), int)]
+
+    # By departement of the company if relevant
+    if departements:
+        sort_keys.append(
+            (
+                'CASE WHEN "carrier_search"."departement" = ANY(%s) THEN 1 ELSE 2 END',
+                (departements,),
+                int,
+            )
+        )
+
+    # By completeness and enseigne
+    sort_keys.extend(
+        (
+            ('-"carrier_search"."completeness"', (), int),
+            ('"carrier_search"."enseigne"', (), str),
+            ('"carrier_search"."siret"', (), str),
+        )
     )
-    q = request.GET.get("q")
-    if q:
-        carriers = carrier_search_q(carriers, q)
+    return sort_keys
 
-    # Filtering on type of license
-    license_types = request.GET.getlist("licence-types[]")
-    for license_type in license_types:
-        if license_type == "lc":
-            carriers = carriers.exclude(lc_numero="")
-        elif license_type == "lti":
-            carriers = carriers.exclude(lti_numero="")
 
-    # Filtering on departements
+# Distance in meters between the position (latitude, longitude) and the carrier
+SEARCH_DISTANCE_SQL = """
+    earth_distance(
+        ll_to_earth(%s, %s),
+        ll_to_earth("carrier_search"."latitude", "carrier_search"."longitude")
+    )
+"""
+
+
+def carrier_search_get_near(request):
+    """Returns the tuple (latitude, longitude, radius in meters) of the search
+    around a position or None.
+
+    The position is provided as 'latitude,longitude' or as a zip code (the
+    center of the carriers of this zip code is used).
+    """
+    near = request.GET.get("near")
+    if not near:
+        return None
+
+    if carriers_validators.RE_ZIP_CODE.match(near):
+        position = carriers_models.CarrierSearch.objects.filter(
+            code_postal=near, latitude__isnull=False, longitude__isnull=False
+        ).aggregate(latitude=Avg("latitude"), longitude=Avg("longitude"))
+        if position["latitude"] is None:
+            raise SearchException(
+                message="Aucun transporteur n'est localisé dans le code postal « %s »."
+                % near
+            )
+        latitude, longitude = position["latitude"], position["longitude"]
+    else:
+        try:
+            latitude, longitude = (float(value) for value in near.split(","))
+        except ValueError:
+            latitude = longitude = None
+
+        if (
+            latitude is None
+            or not -90 <= latitude <= 90
+            or not -180 <= longitude <= 180
+        ):
+            raise SearchException(message="La position « %s » n'est pas valide." % near)
+
+    radius = request.GET.get("radius")
+    if radius:
+        try:
+            radius = float(radius)
+        except ValueError:
+            raise SearchException(
+                message="Le rayon de recherche « %s » n'est pas un nombre valide."
+                % radius
+            )
+
+        if not 0 < radius <= settings.CARRIERS_SEARCH_RADIUS_MAX:
+            raise SearchException(
+                message="Le rayon de recherche doit être compris entre 0 et %d km."
+                % settings.CARRIERS_SEARCH_RADIUS_MAX
+            )
+    else:
+        radius = settings.CARRIERS_SEARCH_RADIUS
+
+    return latitude, longitude, radius * 1000
+
+
+def carrier_search_near(carriers, near):
+    """Filtering on the carriers located in the radius around the position.
+
+    The bounding cube of earth_box is served by the GiST index
+    carrier_search_earth, the exact distance is checked afterwards.
+    """
+    latitude, longitude, radius = near
+    return carriers.extra(
+        where=[
+            """
+            earth_box(ll_to_earth(%s, %s), %s)
+                @> ll_to_earth("carrier_search"."latitude", "carrier_search"."longitude")
+            """,
+            SEARCH_DISTANCE_SQL + " <= %s",
+        ],
+        params=[latitude, longitude, radius, latitude, longitude, radius],
+    )
+
+
+def encode_search_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_search_cursor(cursor, sort_keys):
+    """The cursor is only valid for the same search criteria (same number and
+    types of sort keys)."""
+    try:
+        values = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        )
+    except (binascii.Error, UnicodeError, ValueError):
+        values = None
+
+    if not isinstance(values, list) or len(values) != len(sort_keys):
+        raise SearchException(message="Le curseur « %s » n'est pas valide." % cursor)
+
+    for value, (_, _, value_type) in zip(values, sort_keys):
+        # bool is a subclass of int
+        if not isinstance(value, value_type) or isinstance(value, bool):
+            raise SearchException(
+                message="Le curseur « %s » n'est pas valide." % cursor
+            )
+
+    return values
+
+
+def carrier_search_seek(carriers, sort_keys, values):
+    """Keyset pagination, the results are located after the values of the
+    cursor. Unlike an OFFSET, the cost doesn't depend on the depth of the
+    page."""
+    sql_list = []
+    params = []
+    for sql, sql_params, _ in sort_keys:
+        sql_list.append(sql)
+        params.extend(sql_params)
+    params.extend(values)
+
+    return carriers.extra(
+        where=[
+            "(%s) > (%s)" % (", ".join(sql_list), ", ".join(["%s"] * len(sort_keys)))
+        ],
+        params=params,
+    )
+
+
+def get_search_facets(carriers):
+    """Counts of the filtered carriers by departement, working area, type of
+    license and speciality.
+
+    All the counts are computed in one scan of the results thanks to
+    GROUPING SETS, the license types and specialities are aggregated in the
+    grand total set.
+    """
+    subquery, subquery_params = carriers.values(
+        "departement", "working_area", "has_lc", "has_lti", "specialities_mask"
+    ).query.sql_with_params()
+
+    speciality_codes = list(carriers_models.SPECIALITY_BITS.keys())
+    speciality_count = "count(*) FILTER (WHERE s.specialities_mask & %s <> 0)"
+    speciality_counts = [speciality_count] * len(speciality_codes)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT
+                GROUPING(s.departement),
+                GROUPING(s.working_area),
+                s.departement,
+                s.working_area,
+                count(*),
+                count(*) FILTER (WHERE s.has_lc),
+                count(*) FILTER (WHERE s.has_lti),
+                {speciality_counts}
+            FROM ({subquery}) s
+            GROUP BY GROUPING SETS ((s.departement), (s.working_area), ())
+            """.format(
+                speciality_counts=",\n".join(speciality_counts), subquery=subquery
+            ),
+            list(carriers_models.SPECIALITY_BITS.values()) + list(subquery_params),
+        )
+        rows = cursor.fetchall()
+
+    facets = {
+        "departements": {},
+        "working_areas": {},
+        "license_types": {},
+        "specialities": {},
+    }
+    for row in rows:
+        departement_grouped, working_area_grouped, departement, working_area = row[:4]
+        count = row[4]
+        if not departement_grouped:
+            facets["departements"][departement or ""] = count
+        elif not working_area_grouped:
+            working_area = working_area or carriers_models.WORKING_AREA_UNDEFINED
+            facets["working_areas"][working_area] = count
+        else:
+            # Grand total
+            facets["total"] = count
+            facets["license_types"] = {"lc": row[5], "lti": row[6]}
+            facets["specialities"] = {
+                code: speciality_count
+                for code, speciality_count in zip(speciality_codes, row[7:])
+                if speciality_count
+            }
+
+    return facets
+
+
+def get_search_departements(request):
     departements = []
     for field in ("departement-depart", "departement-arrivee"):
         departement = request.GET.get(field)
         if departement:
-            if carriers_validators.is_french_departement(departement):
-                departements.append(departement)
-            else:
-                message = (
-                    "Le numéro de département français « %s » n'est pas valide."
-                    % request.GET.get(field)
+            if not carriers_validators.is_french_departement(departement):
+                raise SearchException(
+                    message="Le numéro de département français « %s » n'est pas valide."
+                    % departement
                 )
-                return JsonResponse({"message": message}, status=400)
+            departements.append(departement)
+
+    return departements
+
 
+def get_search_specialities_mask(request):
+    """The API uses the codes of the specialities but the search table
+    stores them as a bitmask."""
+    specialities = request.GET.getlist("specialities[]")
+    for speciality in specialities:
+        if speciality not in carriers_models.SPECIALITY_BITS:
+            raise SearchException(
+                message="La spécialité « %s » n'est pas valide." % speciality
+            )
+
+    return carriers_models.get_specialities_mask(specialities)
+
+
+def get_search_page(
+    request,
+    q,
+    license_types,
+    departements,
+    specialities_mask,
+    limit,
+    with_facets,
+    fuzzy,
+):
+    # Only active carriers (not deleted and not closed) are present in the
+    # search table.
+    carriers = carriers_models.CarrierSearch.objects.all()
+    # The fuzzy mode only applies to the search on enseigne
+    fuzzy_q = None
+    if q:
+        if fuzzy and not carriers_validators.RE_ONLY_DIGITS_AND_SPACES.match(q):
+            fuzzy_q = " ".join(q.split())
+            carriers = carrier_search_fuzzy(carriers, fuzzy_q)
+        else:
+            carriers = carrier_search_q(carriers, q)
+
+    # Filtering on type of license
+    for license_type in license_types:
+        if license_type == "lc":
+            carriers = carriers.filter(has_lc=True)
+        elif license_type == "lti":
+            carriers = carriers.filter(has_lti=True)
+
+    # Filtering on departements, served by a bitmap OR of the indexes on
+    # working_area and working_area_departements (GIN)
     if departements:
         carriers = carriers.filter(
-            Q(editable__working_area=carriers_models.WORKING_AREA_INTERNATIONAL)
-            | Q(editable__working_area=carriers_models.WORKING_AREA_FRANCE)
+            Q(
+                working_area__in=(
+                    carriers_models.WORKING_AREA_INTERNATIONAL,
+                    carriers_models.WORKING_AREA_FRANCE,
+                )
+            )
             | Q(
-                editable__working_area__in=(
+                working_area__in=(
                     carriers_models.WORKING_AREA_DEPARTEMENT,
                     carriers_models.WORKING_AREA_REGION,
                 ),
-                editable__working_area_departements__contains=departements,
+                working_area_departements__contains=departements,
             )
         )
 
-    # Filtering on specialities
-    specialities = request.GET.getlist("specialities[]")
-    if specialities:
-        carriers = carriers.filter(editable__specialities__contains=specialities)
+    # Filtering on specialities (all of them)
+    if specialities_mask:
+        carriers = carriers.extra(
+            where=['"carrier_search"."specialities_mask" & %s = %s'],
+            params=[specialities_mask, specialities_mask],
+        )
 
-    # Ordering
+    near = carrier_search_get_near(request)
+    if near:
+        carriers = carrier_search_near(carriers, near)
 
-    # Raw SQL is more simple here than Case, When, etc
-    order_departement_counter = OrderBy(
-        RawSQL(
-            """
-            CASE "carrier_editable"."working_area"
-            WHEN 'DEPARTEMENT' THEN array_length("carrier_editable"."working_area_departements", 1)
-            WHEN 'REGION' THEN array_length("carrier_editable"."working_area_departements", 1)
-            WHEN 'FRANCE' THEN 101
-            WHEN 'INTERNATIONAL' THEN 102
-            END
-        """,
-            (),
-        ),
-        nulls_last=True,
-    )
+    facets = get_search_facets(carriers) if with_facets else None
 
-    order_by_list = [order_departement_counter]
+    sort_keys = get_search_sort_keys(departements, near, fuzzy_q)
+    cursor = request.GET.get("cursor")
+    if cursor:
+        carriers = carrier_search_seek(
+            carriers, sort_keys, decode_search_cursor(cursor, sort_keys)
+        )
 
-    # By departement of the company if relevant
-    if departements:
-        order_departement_company = RawSQL(
-            "CASE WHEN departement IN (%s) THEN 1 ELSE 2 END", (",".join(departements),)
+    if settings.CARRIERS_SEARCH_SQL_JSON:
+        carriers, count, next_cursor = get_search_page_as_sql_json(
+            carriers, sort_keys, limit
         )
-        order_by_list.append(order_departement_company)
+    else:
+        carriers, next_cursor = get_search_page_as_json(carriers, sort_keys, limit)
+        count = len(carriers)
+    payload = {"carriers": carriers}
 
-    # By completeness and enseigne
-    order_by_list.extend(("-completeness", "enseigne"))
+    if count == limit:
+        payload["limit"] = limit
+
+    if next_cursor:
+        payload["next"] = next_cursor
+
+    if facets is not None:
+        payload["facets"] = facets
+
+    return payload
+
+
+def carrier_search(request):
+    """The search allows to filter on:
+       - partial enseigne or SIRET (or similar enseigne with `fuzzy=1`)
+       - type of the license (LC heavy or LTI light)
+       - distance around a position ('near' and 'radius' in km)
+
+    The results are paginated with an opaque cursor, the payload provides the
+    cursor of the next page in the `next` attribute to pass as `cursor`
+    parameter.
+
+    With `facets=1`, the counts of all the results by departement, working
+    area, type of license and speciality are provided in `facets`.
+
+    The pages are cached by normalized criteria until the next change of the
+    search table.
+    """
+    q = request.GET.get("q")
+    if q:
+        q = normalize_search_q(q)
+    license_types = sorted(set(request.GET.getlist("licence-types[]")))
+    with_facets = request.GET.get("facets") == "1"
+    fuzzy = request.GET.get("fuzzy") == "1"
 
     try:
+        departements = get_search_departements(request)
+        specialities_mask = get_search_specialities_mask(request)
         limit = carrier_search_get_limit(request)
+        key = (
+            q or "",
+            tuple(license_types),
+            tuple(sorted(departements)),
+            specialities_mask,
+            limit,
+            request.GET.get("near"),
+            request.GET.get("radius"),
+            request.GET.get("cursor"),
+            with_facets,
+            fuzzy,
+            settings.CARRIERS_SEARCH_SQL_JSON,
+        )
+        generation = carriers_search_cache.get_generation()
+        payload = carriers_search_cache.search_cache.get(key, generation)
+        if payload is None:
+            payload = get_search_page(
+                request,
+                q,
+                license_types,
+                departements,
+                specialities_mask,
+                limit,
+                with_facets,
+                fuzzy,
+            )
+            carriers_search_cache.search_cache.set(key, generation, payload)
     except SearchException as e:
         return JsonResponse({"message": e.message}, status=e.status_code)
-    payload = {"carriers": get_carriers_as_json(carriers, order_by_list, limit)}
 
-    if len(payload["carriers"]) == limit:
-        payload["limit"] = limit
+    return get_search_response(payload)
+
+
+def get_search_response(payload):
+    """The JSON of the carriers built by PostgreSQL is inserted unchanged in
+    the response."""
+    if not isinstance(payload["carriers"], RawJSON):
+        return JsonResponse(payload)
 
-    return JsonResponse(payload)
+    others = {k: v for k, v in payload.items() if k != "carriers"}
+    content = '{"carriers": ' + payload["carriers"]
+    if others:
+        content += ", " + json.dumps(others, cls=DjangoJSONEncoder)[1:]
+    else:
+        content += "}"
+    return HttpResponse(content, content_type="application/json")
+
+
+def unaccent(value):
+    """Close to the unaccent function of PostgreSQL, used to compute the prefix
+    in Python so the LIKE pattern is a constant served by the index."""
+    return "".join(
+        c for c in unicodedata.normalize("NFKD", value) if not unicodedata.combining(c)
+    )
+
+
+def escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def carrier_suggest(request):
+    """Lightweight typeahead on the prefix of the enseigne or of the SIRET.
+
+    The rules of carrier_search_q are applied so the suggestions are a subset
+    of the results of the search.
+    """
+    q = request.GET.get("q")
+    if q:
+        q = normalize_search_q(q).strip()
+    if not q:
+        return JsonResponse({"carriers": []})
+
+    carriers = carriers_models.CarrierSearch.objects.all()
+    if carriers_validators.RE_ONLY_DIGITS_AND_SPACES.match(q):
+        # Zip code or SIREN/SIRET number so we remove useless spaces
+        q = q.replace(" ", "")
+
+    if carriers_validators.RE_ONLY_DIGITS.match(q) and len(q) > 5:
+        # SIREN/SIRET (carrier_search_siret_like index)
+        carriers = carriers.filter(siret__startswith=q).order_by("siret")
+    else:
+        # Served by the carrier_search_enseigne_prefix index in C collation for
+        # the LIKE and the ordering.
+        carriers = (
+            carriers.annotate(
+                enseigne_prefix=RawSQL(
+                    '"carrier_search"."enseigne_unaccent" COLLATE "C"', ()
+                )
+            )
+            .extra(
+                where=['"carrier_search"."enseigne_unaccent" COLLATE "C" LIKE %s'],
+                params=[escape_like(unaccent(" ".join(q.split()))) + "%"],
+            )
+            .order_by("enseigne_prefix", "siret")
+        )
+
+    carriers = carriers.values("siret", "enseigne", "ville")[
+        : settings.CARRIERS_SUGGEST_LIMIT
+    ]
+    return JsonResponse({"carriers": list(carriers)})
 
 
 def get_carrier_value_for_json(k, v):
@@ -370,6 +851,7 @@ def check_user_has_accepted_cgu(user):
         )
 
 
+@outbox_backends.atomic_with_outbox
 def carrier_detail_apply_changes(
     user, carrier, editable_serialized, created_by_email_serialized
 ):
@@ -379,6 +861,9 @@ def carrier_detail_apply_changes(
     - account_confirmation_sent_to: email of user who create the changes if account not enabled yet
     - old_account_sent_to: email of previous user who edit the carrier if any
 
+    The changes and the mails (when the outbox is used) are committed
+    together.
+
     This function is a bit complex for two reasons:
     - to reduce the number of mails sent in subscription, only one mail is sent to
       user account to confirm account creation and carrier changes on same email address
@@ -472,9 +957,37 @@ def carrier_detail(request, carrier_siret):
     data_json = {}
     # Access to deleted carriers is allowed.
     carrier = get_object_or_404(
-        carriers_models.Carrier.objects.select_related("editable"), siret=carrier_siret
+        carriers_documents.get_carrier_detail_queryset(request.user),
+        siret=carrier_siret,
     )
 
+    if carrier.document is None:
+        # Not refreshed yet (after update-carrier.sql), the document is stored
+        # by refresh_carrier_documents and not on read
+        carrier.document = carriers_documents.get_carrier_document(
+            carrier, carriers_documents.get_other_facilities(carrier)
+        )
+        _, carrier.document_version = carriers_documents.dump_carrier_document(
+            carrier.document
+        )
+
+    carrier_json = dict(carrier.document)
+    (
+        carrier_json["other_facilities"],
+        carrier_json["other_facilities_count"],
+        carrier_json["other_facilities_next"],
+    ) = get_other_facilities_page(carrier, carrier.document["other_facilities"])
+
+    etag = None
+    if request.method == "GET":
+        etag = quote_etag(
+            get_carrier_etag(carrier, carrier_json["other_facilities_count"])
+        )
+        response = get_conditional_response(request, etag=etag)
+        if response:
+            patch_vary_headers(response, ["Authorization"])
+            return response
+
     if request.method == "POST":
         editable_serialized, response = core_views.request_validate(
             request, carriers_serializers.CarrierEditableSerializer
@@ -513,6 +1026,9 @@ def carrier_detail(request, carrier_siret):
         mails_sent_to = carrier_detail_apply_changes(
             user, carrier, editable_serialized, created_by_email_serialized
         )
+        # The relation between the carrier and the user is created on POST
+        if user == request.user:
+            carrier.user_is_owner = True
         # Add them to the response
         data_json.update(mails_sent_to)
         data_json["message"] = (
@@ -526,11 +1042,76 @@ def carrier_detail(request, carrier_siret):
                 % mails_sent_to["account_confirmation_sent_to"]
             )
 
-    carrier_json = get_carrier_as_json(request.user, carrier)
-    carrier_json["other_facilities"] = get_other_facilities_as_json(carrier)
-    carrier_json["latest_certificate"] = get_latest_certificate_as_json(carrier)
+    carrier_json["user_is_owner"] = carrier.user_is_owner
     data_json["carrier"] = carrier_json
-    return JsonResponse(data_json)
+    response = JsonResponse(data_json)
+    if etag:
+        response["ETag"] = etag
+        # The ownership of the carrier depends on the user
+        patch_vary_headers(response, ["Authorization"])
+    return response
+
+
+def carrier_other_facilities(request, carrier_siret):
+    """The other establishments of the company paginated like the search, the
+    payload provides the cursor of the next page in the `next` attribute."""
+    carrier = get_object_or_404(carriers_models.Carrier, siret=carrier_siret)
+    try:
+        limit = carrier_search_get_limit(request)
+        other_facilities, count, next_cursor = get_other_facilities_as_json(
+            carrier, limit, request.GET.get("cursor")
+        )
+    except SearchException as e:
+        return JsonResponse({"message": e.message}, status=e.status_code)
+
+    return JsonResponse(
+        {"other_facilities": other_facilities, "count": count, "next": next_cursor}
+    )
+
+
+@require_POST
+def carrier_bulk(request):
+    """Lookup of a list of carriers by SIRET in one query whatever the number
+    of SIRET. The carriers are returned in the order of the request and the
+    unknown SIRET are listed in `missing`.
+
+    The detail fields don't include the other facilities.
+    """
+    bulk_serialized, response = core_views.request_validate(
+        request, carriers_serializers.CarrierBulkSerializer
+    )
+    if response:
+        return response
+
+    sirets = bulk_serialized.validated_data["sirets"]
+    if bulk_serialized.validated_data["detail"]:
+        carriers = carriers_documents.get_carrier_detail_queryset(request.user).filter(
+            siret__in=sirets
+        )
+        carriers_json = {}
+        for carrier in carriers:
+            carrier_json = carriers_documents.get_carrier_as_json(carrier)
+            carrier_json["user_is_owner"] = carrier.user_is_owner
+            carrier_json[
+                "latest_certificate"
+            ] = carriers_documents.get_latest_certificate_as_json(carrier)
+            carriers_json[carrier.siret] = carrier_json
+    else:
+        carriers_json = {
+            carrier_json["siret"]: carrier_json
+            for carrier_json in get_carriers_as_json(
+                carriers_models.Carrier.objects.filter(siret__in=sirets), ["siret"]
+            )
+        }
+
+    return JsonResponse(
+        {
+            "carriers": [
+                carriers_json[siret] for siret in sirets if siret in carriers_json
+            ],
+            "missing": [siret for siret in sirets if siret not in carriers_json],
+        }
+    )
 
 
 def carrier_editable_save(carrier_editable):
@@ -538,9 +1119,11 @@ def carrier_editable_save(carrier_editable):
         carrier_editable.confirmed_at = timezone.now()
         carrier_editable.save()
         carrier_editable.carrier.editable = carrier_editable
+        # The document of the carrier is refreshed on save
         carrier_editable.carrier.save()
 
 
+@outbox_backends.atomic_with_outbox
 def carrier_editable_confirm(request, carrier_editable_id, token):
     if settings.ENVIRONMENT == "E2E":
         carrier_editable = (
@@ -593,6 +1176,7 @@ def carrier_editable_confirm(request, carrier_editable_id, token):
     return JsonResponse(data)
 
 
+@outbox_backends.atomic_with_outbox
 def _certificate_sign(request, carrier):
     serializer, response = core_views.request_validate(
         request, carriers_serializers.CertificateSerializer
@@ -640,36 +1224,86 @@ def _certificate_get(request, carrier, as_pdf=True):
             status=404,
         )
 
-    template_name = (
-        "certificate_workers.html"
-        if certificate.kind == carriers_models.CERTIFICATE_WORKERS
-        else "certificate_no_workers.html"
-    )
-    qr_code = core_pdf.get_qr_code(
-        settings.HTTP_CLIENT_URL + "transporteur/" + carrier.siret
-    )
-    response = render(
-        request,
-        template_name,
-        {
-            "carrier": carrier,
-            "certificate": certificate,
-            "formated_date": date_format(certificate.created_at),
-            "HOSTNAME": settings.HOSTNAME,
-            "HTTP_CLIENT_URL": settings.HTTP_CLIENT_URL,
-            "qr_code": qr_code,
-        },
+    if not as_pdf:
+        return HttpResponse(carriers_certificates.render_html(certificate, request))
+
+    etag = carriers_certificates.get_etag(certificate)
+    response = get_conditional_response(request, etag=etag)
+    if response:
+        return response
+
+    if request.GET.get("async") == "1":
+        content = carriers_certificates.get_cached_pdf(certificate)
+        if content is None:
+            return _certificate_enqueue(request, certificate)
+    else:
+        try:
+            content = carriers_certificates.get_pdf(certificate)
+        except (core_pdf.PDFRenderError, socket.timeout) as e:
+            logger.error("Unable to render the certificate %s: %s", certificate.pk, e)
+            return JsonResponse(
+                {"message": "Le document PDF n'a pas pu être généré."}, status=503
+            )
+
+    response = core_pdf.pdf_chunked_response(
+        content, carriers_certificates.get_pdf_filename(certificate)
     )
+    if content:
+        response["ETag"] = etag
+    return response
+
+
+def get_certificate_job_as_json(request, job):
+    job_json = {
+        "id": job.pk,
+        "status": job.get_status(),
+        "url": request.build_absolute_uri(
+            reverse("carriers_certificate_job", kwargs={"job_id": job.pk})
+        ),
+    }
+    if job_json["status"] == "done":
+        job_json["pdf_url"] = request.build_absolute_uri(
+            reverse(
+                "carriers_certificate_detail",
+                kwargs={"carrier_siret": job.certificate.carrier_id},
+            )
+        )
+    return job_json
+
 
-    if as_pdf:
-        return core_pdf.pdf_response(
-            response.content.decode("utf-8"),
-            "adock-%s-attestation-%s.pdf" % (carrier.siret, certificate.pk),
+def _certificate_enqueue(request, certificate):
+    try:
+        job = carriers_certificates.enqueue(certificate)
+    except carriers_certificates.QueueFull:
+        response = JsonResponse(
+            {
+                "message": "Trop de documents PDF sont en cours de génération, "
+                "veuillez réessayer dans quelques instants."
+            },
+            status=503,
         )
+        response["Retry-After"] = 10
+        return response
 
+    job.certificate = certificate
+    job_json = get_certificate_job_as_json(request, job)
+    response = JsonResponse({"job": job_json}, status=202)
+    response["Location"] = job_json["url"]
+    response["Retry-After"] = 1
     return response
 
 
+def certificate_job_detail(request, job_id):
+    job = get_object_or_404(
+        carriers_models.CarrierCertificatePDFJob.objects.select_related("certificate"),
+        pk=job_id,
+    )
+    job_json = get_certificate_job_as_json(request, job)
+    if job.error:
+        job_json["message"] = "Le document PDF n'a pas pu être généré."
+    return JsonResponse({"job": job_json})
+
+
 def certificate_detail(request, carrier_siret, as_pdf=True):
     carrier = get_object_or_404(carriers_models.Carrier, siret=carrier_siret)
 
@@ -685,6 +1319,7 @@ def certificate_detail(request, carrier_siret, as_pdf=True):
     return _certificate_get(request, carrier, as_pdf)
 
 
+@outbox_backends.atomic_with_outbox
 def certificate_confirm(request, certificate_id, token):
     if settings.ENVIRONMENT == "E2E":
         certificate = (
@@ -710,6 +1345,14 @@ def certificate_confirm(request, certificate_id, token):
 
     certificate.confirmed_at = timezone.now()
     certificate.save()
+    carriers_documents.carrier_document_refresh(
+        carriers_models.Carrier.objects.filter(pk=certificate.carrier_id)
+    )
+    # The PDF of the previous certificates won't be served anymore
+    carriers_models.CarrierCertificatePDF.objects.filter(
+        certificate__carrier_id=certificate.carrier_id
+    ).exclude(certificate=certificate).delete()
+    carriers_certificates.prerender(certificate)
     carriers_mails.mail_managers_certificate_confirmed(certificate)
     return JsonResponse(
         {
@@ -724,6 +1367,7 @@ def certificate_confirm(request, certificate_id, token):
 
 
 @require_POST
+@outbox_backends.atomic_with_outbox
 def license_renewal_ask(request, carrier_siret):
     carrier = get_object_or_404(carriers_models.Carrier, siret=carrier_siret)
 
@@ -775,13 +1419,14 @@ def license_renewal_ask(request, carrier_siret):
             "message": (
                 "Votre demande de renouvellement de licence est enregistrée ! "
                 "Pour la transmettre aux services de la DREAL, confirmez cette demande "
-                "grâce au lien envoyé à l’adresse e-mail votre entreprise « %s »."
+                "grâce au lien envoyé à l’adresse e-mail votre entreprise « %s »."
             )
             % carrier.editable.email,
         }
     )
 
 
+@outbox_backends.atomic_with_outbox
 def license_renewal_confirm(request, license_renewal_id, token):
     # Service available in DREAL Bretagne only
     license_renewal = get_object_or_404(
@@ -801,6 +1446,9 @@ def license_renewal_confirm(request, license_renewal_id, token):
         )
     license_renewal.confirmed_at = timezone.now()
     license_renewal.save()
+    carriers_documents.carrier_document_refresh(
+        carriers_models.Carrier.objects.filter(pk=license_renewal.carrier_id)
+    )
 
     carriers_mails.mail_dreal_license_renewal_with_fallback(license_renewal)
     carriers_mails.mail_managers_license_renewal_confirmed(license_renewal)
@@ -1,18 +1,25 @@
+import functools
+import hashlib
 import io
 import logging
 import os
+import signal
+import socket
+import struct
 import subprocess
-import tempfile
+import threading
+import time
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.core.cache import caches
+from django.http import StreamingHttpResponse
 import qrcode
 import qrcode.image.svg
 
 logger = logging.getLogger(__name__)
 
 
-def get_qr_code(data=None, border=2, box_size=7):
+def make_qr_code(data, border, box_size):
     qr = qrcode.QRCode(
         image_factory=qrcode.image.svg.SvgImage, border=border, box_size=box_size
     )
@@ -24,34 +31,191 @@ def get_qr_code(data=None, border=2, box_size=7):
     return content
 
 
-def pdf_response(html_content, pdf_filename):
-    (temp_html_fd, temp_html_path) = tempfile.mkstemp(
-        prefix=pdf_filename.replace(".pdf", ""), suffix=".html", text=True
-    )
-    with open(temp_html_path, "w") as f:
-        f.write(html_content)
+def get_shared_qr_code(data, border, box_size):
+    """The SVG are stored in the Django cache QR_CODE_CACHE (shared by the
+    processes) when it's set."""
+    if not settings.QR_CODE_CACHE:
+        return make_qr_code(data, border, box_size)
 
-    (temp_pdf_fd, temp_pdf_path) = tempfile.mkstemp(
-        prefix=pdf_filename.replace(".pdf", ""), suffix=".pdf"
-    )
-    ps = subprocess.Popen(
-        [
-            "node",
-            os.path.join(settings.BASE_DIR, "htmltopdf.js"),
-            temp_html_path,
-            temp_pdf_path,
-        ]
+    cache = caches[settings.QR_CODE_CACHE]
+    key = "qr_code:%s" % (
+        hashlib.sha1(("%s|%d|%d" % (data, border, box_size)).encode()).hexdigest()
     )
-    ps.wait()
+    content = cache.get(key)
+    if content is None:
+        content = make_qr_code(data, border, box_size)
+        cache.set(key, content, None)
+    return content
+
+
+# LRU cache of the process, created on the first call so QR_CODE_CACHE_SIZE
+# is read once the settings are loaded
+_qr_code_lru = None
+
+
+def get_qr_code(data=None, border=2, box_size=7):
+    """The SVG are cached by the process (QR_CODE_CACHE_SIZE) and by the shared
+    cache."""
+    global _qr_code_lru
+    if _qr_code_lru is None:
+        _qr_code_lru = functools.lru_cache(maxsize=settings.QR_CODE_CACHE_SIZE)(
+            get_shared_qr_code
+        )
+    return _qr_code_lru(data, border, box_size)
+
+
+def clear_qr_code_cache():
+    """The cache of the process is created again with the current size"""
+    global _qr_code_lru
+    _qr_code_lru = None
+
+
+class PDFRenderError(Exception):
+    pass
+
+
+class RenderStats:
+    """Durations of the renders of the current process by renderer"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.renderers = {}
+
+    def add(self, renderer, duration, failed=False):
+        with self.lock:
+            stats = self.renderers.setdefault(
+                renderer, {"renders": 0, "failures": 0, "duration": 0, "max": 0}
+            )
+            stats["renders"] += 1
+            stats["failures"] += failed
+            stats["duration"] += duration
+            stats["max"] = max(stats["max"], duration)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                renderer: {
+                    "renders": stats["renders"],
+                    "failures": stats["failures"],
+                    "duration_avg": stats["duration"] / stats["renders"],
+                    "duration_max": stats["max"],
+                }
+                for renderer, stats in self.renderers.items()
+            }
 
-    os.close(temp_html_fd)
-    os.remove(temp_html_path)
 
-    with open(temp_pdf_path, "rb") as f:
-        response = HttpResponse(f.read(), content_type="application/pdf")
-        response["Content-Disposition"] = 'attachment; filename="%s"' % (pdf_filename)
+render_stats = RenderStats()
 
-    os.close(temp_pdf_fd)
-    os.remove(temp_pdf_path)
 
+def recv_exactly(sock, length):
+    chunks = []
+    while length:
+        chunk = sock.recv(min(length, 65536))
+        if not chunk:
+            raise PDFRenderError("Connection closed by the renderer")
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b"".join(chunks)
+
+
+def render_pdf_with_server(html_content):
+    """The PDF is rendered by htmltopdf-server.js listening on the Unix socket
+    PDF_RENDERER_SOCKET (see the protocol in the script)."""
+    data = html_content.encode("utf-8")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(settings.PDF_RENDERER_TIMEOUT)
+    try:
+        sock.connect(settings.PDF_RENDERER_SOCKET)
+        sock.sendall(struct.pack(">I", len(data)) + data)
+        status, length = struct.unpack(">BI", recv_exactly(sock, 5))
+        content = recv_exactly(sock, length)
+    except (FileNotFoundError, ConnectionRefusedError, socket.timeout):
+        # Handled by render_pdf
+        raise
+    except OSError as e:
+        # The renderer has crashed or restarted during the render
+        raise PDFRenderError("Connection error with the renderer: %s" % e)
+    finally:
+        sock.close()
+
+    if status != 0:
+        raise PDFRenderError(content.decode("utf-8", "replace"))
+    return content
+
+
+def kill_process_group(ps):
+    try:
+        os.killpg(ps.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def render_pdf_with_process(html_content):
+    """A new browser is launched for each PDF, the HTML and the PDF are
+    exchanged through the pipes of the process.
+
+    The browser is started in a new process group so all its processes are
+    killed after PDF_RENDERER_TIMEOUT seconds.
+    """
+    with subprocess.Popen(
+        ["node", os.path.join(settings.BASE_DIR, "htmltopdf.js")],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    ) as ps:
+        try:
+            content, errors = ps.communicate(
+                html_content.encode("utf-8"), timeout=settings.PDF_RENDERER_TIMEOUT
+            )
+        except subprocess.TimeoutExpired:
+            raise PDFRenderError(
+                "Timeout after %d seconds" % settings.PDF_RENDERER_TIMEOUT
+            )
+        finally:
+            # Chromium could be left behind by node
+            kill_process_group(ps)
+
+    if ps.returncode != 0:
+        raise PDFRenderError(errors.decode("utf-8", "replace").strip()[-1000:])
+    return content
+
+
+def render_pdf(html_content):
+    if settings.PDF_RENDERER_SOCKET:
+        start = time.perf_counter()
+        try:
+            content = render_pdf_with_server(html_content)
+            render_stats.add("server", time.perf_counter() - start)
+            return content
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            # The renderer isn't running
+            logger.warning("PDF renderer not available (%s), fallback to process", e)
+        except (PDFRenderError, socket.timeout):
+            render_stats.add("server", time.perf_counter() - start, failed=True)
+            raise
+
+    start = time.perf_counter()
+    try:
+        content = render_pdf_with_process(html_content)
+    except PDFRenderError:
+        render_stats.add("process", time.perf_counter() - start, failed=True)
+        raise
+    render_stats.add("process", time.perf_counter() - start)
+    return content
+
+
+def pdf_chunked_response(content, pdf_filename, chunk_size=65536):
+    """The PDF is already rendered in memory, it's only written to the client
+    by chunks of chunk_size bytes (the Content-Length is known)."""
+    response = StreamingHttpResponse(
+        (content[i : i + chunk_size] for i in range(0, len(content), chunk_size)),
+        content_type="application/pdf",
+    )
+    response["Content-Disposition"] = 'attachment; filename="%s"' % (pdf_filename)
+    response["Content-Length"] = len(content)
     return response
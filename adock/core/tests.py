@@ -0,0 +1,195 @@
+import os
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from . import pdf as core_pdf
+
+
+class FakeRendererHandler(socketserver.BaseRequestHandler):
+    """Implements the protocol of htmltopdf-server.js"""
+
+    def handle(self):
+        (length,) = struct.unpack(">I", core_pdf.recv_exactly(self.request, 4))
+        html = core_pdf.recv_exactly(self.request, length).decode("utf-8")
+        if "error" in html:
+            body = b"Error: Timeout after 20000 ms"
+            status = 1
+        else:
+            body = b"%PDF-" + html.encode("utf-8")
+            status = 0
+        self.request.sendall(struct.pack(">BI", status, len(body)) + body)
+
+
+class PDFRendererTestCase(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dirname = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dirname, "renderer.sock")
+        self.server = socketserver.UnixStreamServer(
+            self.socket_path, FakeRendererHandler
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.socket_path)
+        os.rmdir(self.tmp_dirname)
+
+    def test_render_with_server(self):
+        with override_settings(PDF_RENDERER_SOCKET=self.socket_path):
+            content = core_pdf.render_pdf("<p>Attestation é</p>")
+        self.assertEqual(content, "%PDF-<p>Attestation é</p>".encode("utf-8"))
+
+    def test_render_error(self):
+        with override_settings(PDF_RENDERER_SOCKET=self.socket_path):
+            with self.assertRaises(core_pdf.PDFRenderError):
+                core_pdf.render_pdf("<p>error</p>")
+
+    def test_renderer_connection_reset(self):
+        sock = mock.Mock()
+        sock.sendall.side_effect = ConnectionResetError(104, "Connection reset by peer")
+        with override_settings(PDF_RENDERER_SOCKET=self.socket_path), mock.patch.object(
+            core_pdf.socket, "socket", return_value=sock
+        ):
+            with self.assertRaises(core_pdf.PDFRenderError):
+                core_pdf.render_pdf("<p>Attestation</p>")
+        sock.close.assert_called_once_with()
+
+    def test_fallback_to_process(self):
+        with override_settings(
+            PDF_RENDERER_SOCKET=self.socket_path + ".missing"
+        ), mock.patch.object(
+            core_pdf, "render_pdf_with_process", return_value=b"%PDF-process"
+        ):
+            content = core_pdf.render_pdf("<p>Attestation</p>")
+        self.assertEqual(content, b"%PDF-process")
+
+
+class PDFChunkedResponseTestCase(SimpleTestCase):
+    def test_chunked_response(self):
+        response = core_pdf.pdf_chunked_response(
+            b"%PDF-1.4", "attestation.pdf", chunk_size=3
+        )
+        self.assertEqual(list(response.streaming_content), [b"%PD", b"F-1", b".4"])
+        self.assertEqual(response["Content-Length"], "8")
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="attestation.pdf"'
+        )
+
+
+# Replace node by Python scripts with the same interface than htmltopdf.js
+ECHO_SCRIPT = "import sys; sys.stdout.buffer.write(b'%PDF-' + sys.stdin.buffer.read())"
+ERROR_SCRIPT = "import sys; sys.stderr.write('Render error: no browser'); sys.exit(1)"
+# The child process simulates Chromium left behind by node
+HANG_SCRIPT = """
+import subprocess, sys, time
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+with open(sys.argv[1], "w") as f:
+    f.write(str(child.pid))
+time.sleep(60)
+"""
+
+
+def is_process_alive(pid):
+    try:
+        with open("/proc/%d/status" % pid) as f:
+            # Zombie (not reaped by init)
+            return "\tZ" not in f.read()
+    except FileNotFoundError:
+        return False
+
+
+class PDFProcessTestCase(SimpleTestCase):
+    def setUp(self):
+        core_pdf.render_stats.clear()
+
+    def render(self, script, *args):
+        popen = subprocess.Popen
+
+        def fake_popen(command, **kwargs):
+            return popen([sys.executable, "-c", script] + list(args), **kwargs)
+
+        with mock.patch.object(core_pdf.subprocess, "Popen", fake_popen):
+            return core_pdf.render_pdf("<p>Attestation é</p>")
+
+    def test_render(self):
+        content = self.render(ECHO_SCRIPT)
+        self.assertEqual(content, "%PDF-<p>Attestation é</p>".encode("utf-8"))
+        stats = core_pdf.render_stats.get_stats()
+        self.assertEqual(stats["process"]["renders"], 1)
+        self.assertEqual(stats["process"]["failures"], 0)
+
+    def test_render_error(self):
+        with self.assertRaisesMessage(core_pdf.PDFRenderError, "no browser"):
+            self.render(ERROR_SCRIPT)
+        self.assertEqual(core_pdf.render_stats.get_stats()["process"]["failures"], 1)
+
+    @override_settings(PDF_RENDERER_TIMEOUT=2)
+    def test_render_timeout(self):
+        fd, pid_path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, pid_path)
+        start = time.perf_counter()
+        with self.assertRaisesMessage(core_pdf.PDFRenderError, "Timeout"):
+            self.render(HANG_SCRIPT, pid_path)
+        self.assertLess(time.perf_counter() - start, 10)
+
+        with open(pid_path) as f:
+            child_pid = int(f.read())
+        # The whole process group is killed
+        for _ in range(50):
+            if not is_process_alive(child_pid):
+                break
+            time.sleep(0.1)
+        self.assertFalse(is_process_alive(child_pid))
+
+
+class QRCodeTestCase(SimpleTestCase):
+    def setUp(self):
+        core_pdf.clear_qr_code_cache()
+        self.addCleanup(core_pdf.clear_qr_code_cache)
+        self.addCleanup(caches["default"].clear)
+
+    def test_qr_code_memoized(self):
+        with mock.patch.object(
+            core_pdf, "make_qr_code", wraps=core_pdf.make_qr_code
+        ) as make_qr_code:
+            svg = core_pdf.get_qr_code("https://example.com/transporteur/1")
+            self.assertIn("<svg", svg)
+            core_pdf.get_qr_code("https://example.com/transporteur/1")
+            self.assertEqual(make_qr_code.call_count, 1)
+            # Other parameters
+            core_pdf.get_qr_code("https://example.com/transporteur/1", box_size=5)
+            self.assertEqual(make_qr_code.call_count, 2)
+
+    @override_settings(QR_CODE_CACHE_SIZE=1)
+    def test_qr_code_cache_size(self):
+        with mock.patch.object(
+            core_pdf, "make_qr_code", return_value="<svg/>"
+        ) as make_qr_code:
+            core_pdf.get_qr_code("https://example.com/transporteur/1")
+            core_pdf.get_qr_code("https://example.com/transporteur/2")
+            # The first one has been evicted
+            core_pdf.get_qr_code("https://example.com/transporteur/1")
+        self.assertEqual(make_qr_code.call_count, 3)
+
+    @override_settings(QR_CODE_CACHE="default")
+    def test_qr_code_shared_cache(self):
+        with mock.patch.object(
+            core_pdf, "make_qr_code", return_value="<svg/>"
+        ) as make_qr_code:
+            core_pdf.get_qr_code("https://example.com/transporteur/1")
+            # Another process
+            core_pdf.clear_qr_code_cache()
+            svg = core_pdf.get_qr_code("https://example.com/transporteur/1")
+        self.assertEqual(svg, "<svg/>")
+        self.assertEqual(make_qr_code.call_count, 1)
@@ -0,0 +1,40 @@
+import functools
+
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+
+from . import models as outbox_models
+
+
+class EmailBackend(BaseEmailBackend):
+    """Store the messages in the outbox, they are sent by the send_outbox
+    command with the OUTBOX_EMAIL_BACKEND so the requests never wait for the
+    SMTP server."""
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+
+        outbox_models.Message.objects.bulk_create(
+            [
+                outbox_models.Message.from_email_message(email_message)
+                for email_message in email_messages
+            ]
+        )
+        return len(email_messages)
+
+
+def atomic_with_outbox(view):
+    """The view is atomic when the mails are stored in the outbox so they're
+    only sent if the changes are committed. Otherwise the mails are sent to
+    the SMTP server during the view and mustn't hold a transaction open."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if settings.EMAIL_BACKEND == "adock.outbox.backends.EmailBackend":
+            with transaction.atomic():
+                return view(*args, **kwargs)
+        return view(*args, **kwargs)
+
+    return wrapper
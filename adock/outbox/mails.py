@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.mail import mail_managers
+
+from . import models as outbox_models
+
+
+def mail_managers_or_digest(subject, message):
+    """In digest mode, the notification is stored to be sent with the other
+    ones by the send_managers_digest command."""
+    if settings.MANAGERS_DIGEST:
+        outbox_models.ManagersEvent.objects.create(subject=subject, message=message)
+    else:
+        mail_managers(subject, message, fail_silently=True)
+
+
+def get_digest(events):
+    """Returns the subject and the message of the digest of the events"""
+    subject = "log - Résumé de %d notification%s" % (
+        len(events),
+        "s" if len(events) > 1 else "",
+    )
+    sections = []
+    for event in events:
+        sections.append(
+            "{underline}\n{subject}\n{underline}\n{message}".format(
+                subject=event.subject,
+                underline="=" * len(event.subject),
+                message=event.message.strip(),
+            )
+        )
+    return subject, "\n\n\n".join(sections) + "\n"
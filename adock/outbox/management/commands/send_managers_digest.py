@@ -0,0 +1,31 @@
+from django.core.mail import mail_managers
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from adock.outbox import mails as outbox_mails
+from adock.outbox import models as outbox_models
+
+
+class Command(BaseCommand):
+    help = "Send the pending notifications of the managers in a single mail."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            events = list(
+                outbox_models.ManagersEvent.objects.select_for_update(
+                    skip_locked=True
+                ).order_by("created_at", "pk")
+            )
+            if not events:
+                return
+
+            subject, message = outbox_mails.get_digest(events)
+            # The events are kept on failure
+            mail_managers(subject, message)
+            outbox_models.ManagersEvent.objects.filter(
+                pk__in=[event.pk for event in events]
+            ).delete()
+
+        self.stdout.write(
+            self.style.SUCCESS("Digest of %d notifications sent." % len(events))
+        )
@@ -0,0 +1,141 @@
+import datetime
+import smtplib
+import time
+
+import sentry_sdk
+from django.conf import settings
+from django.core.mail import get_connection, mail_managers
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from adock.outbox import models as outbox_models
+
+
+class ConnectionLost(Exception):
+    pass
+
+
+def is_connection_error(error):
+    """The mail isn't the cause (closed by the server, network error or
+    timeout), the other SMTP errors are subclasses of OSError too."""
+    return isinstance(error, smtplib.SMTPServerDisconnected) or (
+        isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+    )
+
+
+class Command(BaseCommand):
+    help = "Send the mails of the outbox with a single connection to the SMTP server."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Don't exit and check the outbox every OUTBOX_POLL_INTERVAL seconds.",
+        )
+
+    def claim_batch(self):
+        """Returns the next messages to send, they're leased to this worker.
+
+        The send_after of the messages is pushed by OUTBOX_LEASE_DURATION in a
+        short transaction so the rows aren't locked while the mails are sent.
+        The messages of a stopped worker are sent again at the end of the
+        lease.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            messages = list(
+                outbox_models.Message.objects.select_for_update(skip_locked=True)
+                .filter(
+                    sent_at__isnull=True, failed_at__isnull=True, send_after__lte=now
+                )
+                .order_by("send_after", "pk")[: settings.OUTBOX_BATCH_SIZE]
+            )
+            outbox_models.Message.objects.filter(
+                pk__in=[message.pk for message in messages]
+            ).update(
+                send_after=now
+                + datetime.timedelta(seconds=settings.OUTBOX_LEASE_DURATION)
+            )
+        return messages
+
+    def send_batch(self, connection):
+        """Returns the number of processed messages"""
+        messages = self.claim_batch()
+        for i, message in enumerate(messages):
+            try:
+                message.get_email_message(connection).send()
+                message.sent_at = timezone.now()
+                self.counters["sent"] += 1
+            except Exception as e:  # pylint: disable=W0703
+                if is_connection_error(e):
+                    # The lease of the remaining messages is released without
+                    # counting an attempt
+                    outbox_models.Message.objects.filter(
+                        pk__in=[remaining.pk for remaining in messages[i:]]
+                    ).update(send_after=timezone.now())
+                    raise ConnectionLost(e)
+
+                if message.set_failed_attempt(e):
+                    self.counters["retried"] += 1
+                else:
+                    self.counters["failed"] += 1
+                    self.fail(message, e)
+            # The result is committed on its own (autocommit) so it's kept if
+            # the next message stops the worker
+            message.save(
+                update_fields=[
+                    "sent_at",
+                    "attempts",
+                    "last_error",
+                    "send_after",
+                    "failed_at",
+                ]
+            )
+
+        return len(messages)
+
+    def fail(self, message, error):
+        sentry_sdk.capture_exception(error)
+        self.stderr.write(
+            self.style.ERROR("Unable to send '%s': %s" % (message.subject, error))
+        )
+        if message.fallback_to_managers:
+            mail_managers(
+                "log - ÉCHEC - %s" % message.subject,
+                message.body,
+                fail_silently=True,
+                connection=get_connection(settings.OUTBOX_EMAIL_BACKEND),
+            )
+
+    def send_outbox(self, connection):
+        """Returns True when the connection has been lost after sending some
+        mails, a new connection can be opened at once."""
+        sent = self.counters["sent"]
+        try:
+            # The connection is opened once for all the messages and closed on
+            # error
+            with connection:
+                while self.send_batch(connection):
+                    pass
+        except ConnectionLost as e:
+            self.stderr.write(self.style.WARNING("Outbox: connection lost (%s)" % e))
+            return self.counters["sent"] > sent
+        except Exception as e:  # pylint: disable=W0703
+            # Unable to open the connection, the messages will be retried
+            sentry_sdk.capture_exception(e)
+            self.stderr.write(self.style.ERROR("Outbox: %s" % e))
+        return False
+
+    def handle(self, *args, **options):
+        self.counters = {"sent": 0, "retried": 0, "failed": 0}
+        connection = get_connection(settings.OUTBOX_EMAIL_BACKEND)
+        while True:
+            if self.send_outbox(connection):
+                continue
+
+            if not options["loop"]:
+                break
+            time.sleep(settings.OUTBOX_POLL_INTERVAL)
+
+        self.stdout.write(self.style.SUCCESS("Outbox: %s" % self.counters))
@@ -0,0 +1,102 @@
+import datetime
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core.mail import EmailMessage
+from django.db import models
+from django.utils import timezone
+
+
+class Message(models.Model):
+    """Mail waiting to be sent by the send_outbox command.
+
+    The messages are created in the transaction of the request so they are
+    only sent when the changes are committed.
+    """
+
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = ArrayField(models.CharField(max_length=255), default=list)
+    cc = ArrayField(models.CharField(max_length=255), default=list)
+    bcc = ArrayField(models.CharField(max_length=255), default=list)
+    reply_to = ArrayField(models.CharField(max_length=255), default=list)
+    # Forwarded to the managers when the message can't be sent
+    fallback_to_managers = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Not before this date on retry
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    # All the attempts have failed
+    failed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = "outbox_message"
+        indexes = [
+            # Only the messages to send
+            models.Index(
+                name="outbox_message_to_send",
+                fields=["send_after"],
+                condition=models.Q(sent_at__isnull=True, failed_at__isnull=True),
+            )
+        ]
+
+    def __str__(self):
+        return self.subject
+
+    @classmethod
+    def from_email_message(cls, email_message, fallback_to_managers=False):
+        return cls(
+            subject=email_message.subject,
+            body=email_message.body,
+            from_email=email_message.from_email,
+            to=list(email_message.to),
+            cc=list(email_message.cc),
+            bcc=list(email_message.bcc),
+            reply_to=list(email_message.reply_to),
+            fallback_to_managers=fallback_to_managers,
+        )
+
+    def get_email_message(self, connection=None):
+        return EmailMessage(
+            subject=self.subject,
+            body=self.body,
+            from_email=self.from_email,
+            to=self.to,
+            cc=self.cc,
+            bcc=self.bcc,
+            reply_to=self.reply_to,
+            connection=connection,
+        )
+
+    def set_failed_attempt(self, error):
+        """Exponential backoff between the attempts (OUTBOX_RETRY_DELAY,
+        twice, four times, etc), returns False when the message won't be sent
+        anymore."""
+        self.attempts += 1
+        self.last_error = str(error)
+        if self.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            self.failed_at = timezone.now()
+            return False
+
+        self.send_after = timezone.now() + datetime.timedelta(
+            seconds=settings.OUTBOX_RETRY_DELAY * 2 ** (self.attempts - 1)
+        )
+        return True
+
+
+class ManagersEvent(models.Model):
+    """Notification of the managers waiting for the next digest (see
+    send_managers_digest command), deleted once sent."""
+
+    subject = models.TextField()
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "outbox_managers_event"
+
+    def __str__(self):
+        return self.subject
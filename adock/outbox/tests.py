@@ -0,0 +1,252 @@
+import datetime
+import io
+import smtplib
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from ..carriers import factories as carriers_factories
+from ..carriers import mails as carriers_mails
+from . import backends as outbox_backends
+from . import models as outbox_models
+
+DREAL_EMAIL = "dreal@example.com"
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+
+class LeaseCheckingEmailBackend(LocmemEmailBackend):
+    """Records the messages still to claim when a mail is sent"""
+
+    claimable = []
+
+    def send_messages(self, messages):
+        LeaseCheckingEmailBackend.claimable.append(
+            outbox_models.Message.objects.filter(
+                sent_at__isnull=True, send_after__lte=timezone.now()
+            ).count()
+        )
+        return super().send_messages(messages)
+
+
+class DisconnectingEmailBackend(LocmemEmailBackend):
+    """The server closes the connection after one message"""
+
+    opened = 0
+
+    def open(self):
+        DisconnectingEmailBackend.opened += 1
+        self.sent = 0
+        return True
+
+    def send_messages(self, messages):
+        if self.sent:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.sent += len(messages)
+        return super().send_messages(messages)
+
+
+class RefusingEmailBackend(LocmemEmailBackend):
+    """The relay refuses the address of the DREAL"""
+
+    def send_messages(self, messages):
+        for message in messages:
+            if DREAL_EMAIL in message.to:
+                raise smtplib.SMTPRecipientsRefused({DREAL_EMAIL: (550, b"Unknown")})
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND="adock.outbox.backends.EmailBackend",
+    OUTBOX_EMAIL_BACKEND="adock.outbox.tests.CountingEmailBackend",
+)
+class OutboxTestCase(TestCase):
+    def send_outbox(self):
+        call_command("send_outbox", stdout=io.StringIO(), stderr=io.StringIO())
+
+    def create_account(self):
+        response = self.client.post(
+            reverse("accounts_create"),
+            {
+                "email": "foo@example.com",
+                "first_name": "Claude",
+                "last_name": "Martin",
+                "password": "secret1234",
+                "has_accepted_cgu": True,
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_send(self):
+        self.create_account()
+        # Stored in the outbox, not sent in the request
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(outbox_models.Message.objects.count(), 2)
+
+        CountingEmailBackend.opened = 0
+        self.send_outbox()
+        self.assertEqual(len(mail.outbox), 2)
+        # One connection for all the messages
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertFalse(
+            outbox_models.Message.objects.filter(sent_at__isnull=True).exists()
+        )
+
+        # Already sent
+        self.send_outbox()
+        self.assertEqual(len(mail.outbox), 2)
+
+    @override_settings(
+        OUTBOX_EMAIL_BACKEND="adock.outbox.tests.LeaseCheckingEmailBackend"
+    )
+    def test_claimed_before_send(self):
+        self.create_account()
+        LeaseCheckingEmailBackend.claimable = []
+        self.send_outbox()
+        # The batch is leased before the first mail
+        self.assertEqual(LeaseCheckingEmailBackend.claimable, [0, 0])
+        self.assertEqual(len(mail.outbox), 2)
+
+    @override_settings(
+        OUTBOX_EMAIL_BACKEND="adock.outbox.tests.DisconnectingEmailBackend"
+    )
+    def test_connection_lost(self):
+        for i in range(3):
+            outbox_models.Message.from_email_message(
+                mail.EmailMessage(
+                    "Renouvellement %d" % i, "Licences", "a@example.com", [DREAL_EMAIL]
+                )
+            ).save()
+
+        DisconnectingEmailBackend.opened = 0
+        self.send_outbox()
+        # Reopened after each lost connection
+        self.assertEqual(DisconnectingEmailBackend.opened, 3)
+        self.assertEqual(len(mail.outbox), 3)
+        # Not counted as failed attempts
+        self.assertFalse(
+            outbox_models.Message.objects.filter(
+                Q(sent_at__isnull=True) | ~Q(attempts=0)
+            ).exists()
+        )
+
+    def test_lease_expired(self):
+        message = outbox_models.Message.from_email_message(
+            mail.EmailMessage(
+                "Renouvellement", "Licences", "a@example.com", ["b@example.com"]
+            )
+        )
+        # Claimed by a worker stopped before the send
+        message.send_after = timezone.now() + datetime.timedelta(seconds=60)
+        message.save()
+        self.send_outbox()
+        self.assertEqual(len(mail.outbox), 0)
+
+        # End of the lease
+        message.send_after = timezone.now() - datetime.timedelta(seconds=1)
+        message.save()
+        self.send_outbox()
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(
+        OUTBOX_EMAIL_BACKEND="adock.outbox.tests.RefusingEmailBackend",
+        OUTBOX_MAX_ATTEMPTS=2,
+        OUTBOX_RETRY_DELAY=60,
+    )
+    def test_retry_and_fallback(self):
+        message = outbox_models.Message.from_email_message(
+            mail.EmailMessage(
+                "Renouvellement", "Licences", "a@example.com", [DREAL_EMAIL]
+            ),
+            fallback_to_managers=True,
+        )
+        message.save()
+
+        self.send_outbox()
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 1)
+        self.assertIn(DREAL_EMAIL, message.last_error)
+        self.assertGreater(message.send_after, timezone.now())
+        self.assertIsNone(message.failed_at)
+
+        # Not before the delay
+        self.send_outbox()
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 1)
+
+        message.send_after = timezone.now() - datetime.timedelta(seconds=1)
+        message.save()
+        self.send_outbox()
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 2)
+        self.assertIsNotNone(message.failed_at)
+        self.assertIsNone(message.sent_at)
+
+        # Forwarded to the managers
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            mail.outbox[0].subject, "[A Dock] log - ÉCHEC - Renouvellement"
+        )
+
+
+class AtomicWithOutboxTestCase(TransactionTestCase):
+    def get_in_atomic_block(self):
+        return outbox_backends.atomic_with_outbox(lambda: connection.in_atomic_block)()
+
+    @override_settings(EMAIL_BACKEND="adock.outbox.backends.EmailBackend")
+    def test_atomic_with_outbox(self):
+        self.assertTrue(self.get_in_atomic_block())
+
+    @override_settings(EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend")
+    def test_not_atomic_without_outbox(self):
+        # The mails are sent by the view
+        self.assertFalse(self.get_in_atomic_block())
+
+
+@override_settings(MANAGERS_DIGEST=True)
+class ManagersDigestTestCase(TestCase):
+    def send_managers_digest(self):
+        call_command("send_managers_digest", stdout=io.StringIO())
+
+    def test_digest(self):
+        carriers = [
+            carriers_factories.CarrierFactory(with_editable=True) for _ in range(2)
+        ]
+        for carrier in carriers:
+            carriers_mails.mail_managers_carrier_confirmed(carrier.editable)
+        certificate = carriers_factories.CarrierCertificateFactory(carrier=carriers[0])
+        carriers_mails.mail_managers_certificate_confirmed(certificate)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.send_managers_digest()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            mail.outbox[0].subject, "[A Dock] log - Résumé de 3 notifications"
+        )
+        for carrier in carriers:
+            self.assertIn(
+                "log - La modification du transporteur %s est confirmée."
+                % carrier.siret,
+                mail.outbox[0].body,
+            )
+        self.assertIn("L'attestation %s" % certificate.pk, mail.outbox[0].body)
+
+        # Deleted once sent
+        self.assertFalse(outbox_models.ManagersEvent.objects.exists())
+
+        # Nothing new
+        self.send_managers_digest()
+        self.assertEqual(len(mail.outbox), 1)
@@ -36,3 +36,36 @@ class SelftestTestCase(AuthTestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertIn("actions", response.json())
+
+    def test_search_cache_stats(self):
+        http_authorization = self.log_in()
+        response = self.client.post(
+            self.url,
+            {"search_cache_stats": True},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=http_authorization,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("hit_ratio", response.json()["output"])
+
+    def test_certificate_jobs_stats(self):
+        http_authorization = self.log_in()
+        response = self.client.post(
+            self.url,
+            {"certificate_jobs_stats": True},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=http_authorization,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["output"]["pending"], 0)
+
+    def test_pdf_render_stats(self):
+        http_authorization = self.log_in()
+        response = self.client.post(
+            self.url,
+            {"pdf_render_stats": True},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=http_authorization,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.json()["output"], dict)
@@ -5,8 +5,11 @@ from django.core.mail import mail_managers
 from django.http.response import JsonResponse
 import sentry_sdk
 
+from adock.core import pdf as core_pdf
 from adock.core import views as core_views
 from adock.accounts.decorators import user_is_staff
+from adock.carriers import certificates as carriers_certificates
+from adock.carriers import search_cache as carriers_search_cache
 from adock.meta import models as meta_models
 
 logger = logging.getLogger(__name__)
@@ -35,6 +38,12 @@ def selftest_index_post(request):
             output = metas[0].data
         else:
             output = "No Meta entries in DB."
+    elif "search_cache_stats" in payload:
+        output = carriers_search_cache.search_cache.get_stats()
+    elif "certificate_jobs_stats" in payload:
+        output = carriers_certificates.get_job_stats()
+    elif "pdf_render_stats" in payload:
+        output = core_pdf.render_stats.get_stats()
     elif "raise_exception" in payload:
         raise Exception("Raised by selftest page (safe to ignore).")
     elif "capture_event" in payload:
@@ -57,6 +66,9 @@ def selftest_index(request):
                 "add_log_entry": "Add entry to Django log",
                 "mail_managers": "Mail managers",
                 "connect_db": "Connect to DB",
+                "search_cache_stats": "Statistics of the search cache of the process",
+                "certificate_jobs_stats": "Queue and render times of the certificates",
+                "pdf_render_stats": "Render times of the PDF of the process",
                 "raise_exception": "Raise an exception (for Sentry)",
                 "capture_event": "Capture an event for Sentry",
             }
@@ -32,6 +32,7 @@ INSTALLED_APPS = [
     "adock.accounts.apps.AccountsConfig",
     "adock.carriers.apps.CarriersConfig",
     "adock.meta.apps.MetaConfig",
+    "adock.outbox.apps.OutboxConfig",
     "adock.selftest.apps.SelftestConfig",
     "adock.stats.apps.StatsConfig",
 ]
@@ -135,8 +136,56 @@ EMAIL_HOST = "localhost"
 EMAIL_HOST_USER = ""
 EMAIL_HOST_PASSWORD = ""
 EMAIL_TIMEOUT = 5
+# Used by the send_outbox command when USE_MAIL_OUTBOX is enabled
+OUTBOX_EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 5
+# Delay (seconds) before the first retry, doubled on each attempt
+OUTBOX_RETRY_DELAY = 60
+OUTBOX_POLL_INTERVAL = 10
+# The messages claimed by a worker aren't sent by the other ones during this
+# delay (seconds), they're sent again when the worker stops before the end
+OUTBOX_LEASE_DURATION = 600
+# The notifications of the managers are sent in a digest by the
+# send_managers_digest command (to run at the interval of the digest)
+MANAGERS_DIGEST = False
 
 CARRIERS_LIMIT = 200
+# Default and maximal radius (km) of the search around a position
+CARRIERS_SEARCH_RADIUS = 30
+CARRIERS_SEARCH_RADIUS_MAX = 200
+# Number of search results kept in the LRU cache of each process (0 to disable)
+CARRIERS_SEARCH_CACHE_SIZE = 1000
+# The JSON of the search results is built by PostgreSQL
+CARRIERS_SEARCH_SQL_JSON = False
+CARRIERS_SUGGEST_LIMIT = 10
+# Other establishments of the company in the carrier detail (next ones with
+# the paginated endpoint)
+CARRIERS_OTHER_FACILITIES_LIMIT = 20
+# Maximal number of SIRET of a bulk lookup
+CARRIERS_BULK_LIMIT = 500
+# Minimal trigram similarity of the enseigne in fuzzy search (pg_trgm), the
+# default of pg_trgm (0.3) is too loose with the common words (TRANSPORTS...).
+# It can't be lower than the pg_trgm.similarity_threshold of the server.
+CARRIERS_SEARCH_SIMILARITY_THRESHOLD = 0.5
+
+# Unix socket of htmltopdf-server.js, a process is launched by PDF otherwise
+PDF_RENDERER_SOCKET = ""
+# Timeout (seconds) of the exchanges with the renderer
+PDF_RENDERER_TIMEOUT = 30
+# QR codes of the certificates kept by each process
+QR_CODE_CACHE_SIZE = 1000
+# Alias of the Django cache shared by the processes to store the QR codes (see
+# the warm_qr_codes command), disabled by default
+QR_CODE_CACHE = ""
+# Maximal number of certificates waiting to be rendered by the
+# render_certificates command (asynchronous mode)
+CARRIERS_CERTIFICATE_PDF_QUEUE_SIZE = 100
+# Number of threads of the render_certificates command
+CARRIERS_CERTIFICATE_PDF_WORKERS = 2
+CARRIERS_CERTIFICATE_PDF_POLL_INTERVAL = 1
+# The job of a stopped worker is taken again after this delay (seconds)
+CARRIERS_CERTIFICATE_PDF_JOB_TIMEOUT = 120
 
 # Validity of token to confirm email address
 PASSWORD_RESET_TIMEOUT_DAYS = 2
@@ -152,6 +201,8 @@ USE_DEBUG_CONSOLE = False
 USE_DJANGO_EXTENSIONS = False
 USE_SENTRY = True
 USE_CIRCLECI = False
+# The mails are stored in the outbox and sent by the send_outbox command
+USE_MAIL_OUTBOX = False
 
 SENTRY_DSN = ""
 
@@ -203,6 +254,9 @@ LOGGING = {
     "loggers": {PROJECT: {"handlers": ["output"], "level": "DEBUG"}},
 }
 
+if USE_MAIL_OUTBOX:
+    EMAIL_BACKEND = "adock.outbox.backends.EmailBackend"
+
 if USE_DEBUG_CONSOLE:
     LOGGING["handlers"]["output"] = {"class": "logging.StreamHandler", "level": "DEBUG"}
 
@@ -0,0 +1,171 @@
+// Long-lived renderer of PDF used by adock/core/pdf.py (PDF_RENDERER_SOCKET).
+//
+// Usage: node htmltopdf-server.js SOCKET_PATH [POOL_SIZE] [TIMEOUT_MS]
+//
+// The browser is launched once and its pages are reused. POOL_SIZE renders
+// run at the same time, the other requests wait in a bounded queue.
+//
+// Protocol (one render by connection):
+// - request: length of the HTML (4 bytes, big endian) then the HTML (UTF-8),
+//   the request is rejected when more data follows
+// - response: status (1 byte, 0 on success), length of the body (4 bytes, big
+//   endian) then the body (the PDF or the error message)
+const fs = require("fs");
+const net = require("net");
+const puppeteer = require("puppeteer");
+
+const socketPath = process.argv[2];
+const poolSize = parseInt(process.argv[3] || "2", 10);
+const renderTimeout = parseInt(process.argv[4] || "20000", 10);
+const maxQueueLength = poolSize * 8;
+
+let browserPromise = null;
+const idlePages = [];
+const queue = [];
+let activeRenders = 0;
+
+function getBrowser() {
+  if (browserPromise === null) {
+    browserPromise = puppeteer
+      .launch({
+        args: ["--disable-gpu", "--no-sandbox", "--disable-setuid-sandbox"]
+      })
+      .then(browser => {
+        // Crash recovery, the browser is launched again on next render
+        browser.on("disconnected", () => {
+          console.error("Browser disconnected");
+          browserPromise = null;
+          idlePages.length = 0;
+        });
+        return browser;
+      })
+      .catch(err => {
+        browserPromise = null;
+        throw err;
+      });
+  }
+  return browserPromise;
+}
+
+async function acquirePage() {
+  const page = idlePages.pop();
+  if (page && !page.isClosed()) {
+    return page;
+  }
+  const browser = await getBrowser();
+  const newPage = await browser.newPage();
+  newPage.on("error", err => console.error(`Page error: ${err}`));
+  await newPage.emulateMedia("screen");
+  return newPage;
+}
+
+function withTimeout(promise, ms) {
+  let timer;
+  const timeout = new Promise((_, reject) => {
+    timer = setTimeout(() => reject(new Error(`Timeout after ${ms} ms`)), ms);
+  });
+  return Promise.race([promise, timeout]).finally(() => clearTimeout(timer));
+}
+
+async function render(html) {
+  const page = await acquirePage();
+  try {
+    const pdf = await withTimeout(
+      page
+        .setContent(html, { waitUntil: "networkidle0" })
+        .then(() => page.pdf({ format: "A4" })),
+      renderTimeout
+    );
+    idlePages.push(page);
+    return pdf;
+  } catch (err) {
+    // The page could be stuck so it's replaced
+    page.close().catch(() => {});
+    throw err;
+  }
+}
+
+// Bounded concurrency
+function schedule(html) {
+  return new Promise((resolve, reject) => {
+    if (queue.length >= maxQueueLength) {
+      reject(new Error("Queue of the renderer is full"));
+      return;
+    }
+    queue.push({ html, resolve, reject });
+    next();
+  });
+}
+
+function next() {
+  if (activeRenders >= poolSize || queue.length === 0) {
+    return;
+  }
+  const job = queue.shift();
+  activeRenders++;
+  render(job.html)
+    .then(job.resolve, job.reject)
+    .finally(() => {
+      activeRenders--;
+      next();
+    });
+}
+
+function writeResponse(conn, status, body) {
+  const header = Buffer.alloc(5);
+  header.writeUInt8(status, 0);
+  header.writeUInt32BE(body.length, 1);
+  conn.end(Buffer.concat([header, body]));
+}
+
+const server = net.createServer(conn => {
+  let data = Buffer.alloc(0);
+  let expectedLength = null;
+  conn.on("error", err => console.error(`Connection error: ${err}`));
+  const onData = chunk => {
+    data = Buffer.concat([data, chunk]);
+    if (expectedLength === null && data.length >= 4) {
+      expectedLength = data.readUInt32BE(0);
+    }
+    if (expectedLength !== null && data.length >= expectedLength + 4) {
+      // One render by connection, nothing is read after the request
+      conn.removeListener("data", onData);
+      conn.pause();
+      if (data.length > expectedLength + 4) {
+        writeResponse(
+          conn,
+          1,
+          Buffer.from("Error: Unexpected data after the request", "utf8")
+        );
+        return;
+      }
+      const html = data.slice(4, expectedLength + 4).toString("utf8");
+      schedule(html).then(
+        pdf => writeResponse(conn, 0, pdf),
+        err => {
+          console.error(`Render error: ${err}`);
+          writeResponse(conn, 1, Buffer.from(String(err), "utf8"));
+        }
+      );
+    }
+  };
+  conn.on("data", onData);
+});
+
+if (fs.existsSync(socketPath)) {
+  fs.unlinkSync(socketPath);
+}
+server.listen(socketPath, () => {
+  console.info(`Listening on ${socketPath} (pool of ${poolSize} pages)`);
+  // Warm up
+  getBrowser().catch(err => console.error(`Unable to launch browser: ${err}`));
+});
+
+process.on("SIGTERM", () => {
+  server.close();
+  if (browserPromise) {
+    browserPromise.then(browser => browser.close()).then(() => process.exit(0));
+  } else {
+    process.exit(0);
+  }
+});
@@ -1,24 +1,37 @@
+// Renders the HTML read on stdin to a PDF written on stdout (used by
+// adock/core/pdf.py when htmltopdf-server.js isn't running). The logs are
+// written on stderr.
 const puppeteer = require("puppeteer");
 
+function readStdin() {
+  return new Promise((resolve, reject) => {
+    const chunks = [];
+    process.stdin.on("data", chunk => chunks.push(chunk));
+    process.stdin.on("end", () => resolve(Buffer.concat(chunks).toString("utf8")));
+    process.stdin.on("error", reject);
+  });
+}
+
 (async () => {
-  const htmlFilename = await process.argv[2];
-  const pdfFilename = await process.argv[3];
+  const html = await readStdin();
   const browser = await puppeteer.launch({
-    args: [
-      "--disable-gpu",
-      "--no-sandbox",
-      "--disable-setuid-sandbox",
-      "--allow-file-access-from-files"
-    ]
-  });
-  const page = await browser.newPage();
-  page.on("console", (...args) => console.info("PAGE LOG:", ...args));
-  page.on("error", err => {
-    console.error(`Error event emitted: ${err}`);
-    console.error(err.stack);
+    args: ["--disable-gpu", "--no-sandbox", "--disable-setuid-sandbox"]
   });
-  await page.emulateMedia("screen");
-  await page.goto("file://" + htmlFilename, { waitUntil: "networkidle0" });
-  await page.pdf({ path: pdfFilename, format: "A4" });
-  await browser.close();
-})();
+  try {
+    const page = await browser.newPage();
+    page.on("console", (...args) => console.error("PAGE LOG:", ...args));
+    page.on("error", err => {
+      console.error(`Error event emitted: ${err}`);
+      console.error(err.stack);
+    });
+    await page.emulateMedia("screen");
+    await page.setContent(html, { waitUntil: "networkidle0" });
+    const pdf = await page.pdf({ format: "A4" });
+    await new Promise(resolve => process.stdout.write(pdf, resolve));
+  } finally {
+    await browser.close();
+  }
+})().catch(err => {
+  console.error(`Render error: ${err}`);
+  process.exit(1);
+});
@@ -52,6 +52,6 @@ alter table greco
 
 -- Find a carrier to assign based on greco SIREN
 update greco g
-    set carrier_id = (select c.siret from carrier c where c.siret like concat(g.siren, '%') limit 1);
+    set carrier_id = (select c.siret from carrier c where c.siren = g.siren order by c.siret limit 1);
 
 commit;
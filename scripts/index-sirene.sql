@@ -0,0 +1,6 @@
+-- Run once the sirene table is filled (faster than on each inserted row)
+
+alter table sirene add is_hidden boolean default false;
+alter table sirene add is_deleted boolean default false;
+
+create unique index sirene_siret_idx on sirene (siret);
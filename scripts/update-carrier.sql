@@ -2,6 +2,7 @@ begin;
 
 insert into carrier
     (siret,
+     siren,
      raison_sociale,
      enseigne,
      enseigne_unaccent,
@@ -24,8 +25,10 @@ insert into carrier
      sirene_closed_at,
      objectif_co2,
      longitude,
-     latitude)
+     latitude,
+     document_version)
     select r.siret,
+           r.siret::char(9) as siren,
            r.raison_sociale,
            coalesce(nullif(s.enseigne1Etablissement, ''), r.raison_sociale) as enseigne,
            unaccent(translate(coalesce(nullif(s.enseigne1Etablissement, ''), r.raison_sociale), ',.', '')) as enseigne_unaccent,
@@ -76,7 +79,8 @@ insert into carrier
            case when s.etatAdministratifEtablissement = 'F' then s.dateDernierTraitementEtablissement else null end as sirene_closed_at,
            '' as objectif_co2,
            s.longitude,
-           s.latitude
+           s.latitude,
+           '' as document_version
     from registre as r
     left join sirene as s
       on s.siret = r.siret
@@ -131,6 +135,7 @@ with new_carrier_editable AS (
       working_area,
       working_area_departements,
       specialities,
+      specialities_mask,
       website,
       description
     )
@@ -144,6 +149,7 @@ with new_carrier_editable AS (
       -- Default departement for working area departements in company departement
       case when departement is null then null else array[departement] end as working_area_departements,
       null as specialities,
+      0 as specialities_mask,
       '' as website,
       '' as description
     from carrier
@@ -151,6 +157,15 @@ with new_carrier_editable AS (
   returning *
 ) update carrier set editable_id = nce.id from new_carrier_editable nce where siret = nce.carrier_id;
 
+-- Rebuild the search table of the active carriers
+select carrier_search_refresh(null);
+
+-- The stored documents are out of date, the detail is built on the fly until
+-- refresh_carrier_documents (Django) stores them again
+update carrier
+   set document = null, document_version = ''
+ where document is not null;
+
 -- Update meta stats
 with json_data as (
   select json_build_object('count', count(*), 'date', current_date) from carrier where deleted_at is null and sirene_closed_at is null
@@ -164,3 +179,6 @@ on conflict (name) do update
     set data = (select * from json_data);
 
 commit;
+
+-- Invalidate the cached search results (not transactional)
+select nextval('carrier_search_generation');